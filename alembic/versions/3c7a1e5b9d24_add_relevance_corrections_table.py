@@ -0,0 +1,48 @@
+"""add relevance corrections table
+
+Revision ID: 3c7a1e5b9d24
+Revises: 8b3e5d1f0a62
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3c7a1e5b9d24"
+down_revision: Union[str, Sequence[str], None] = "8b3e5d1f0a62"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "relevance_corrections",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("request_id", sa.Integer(), nullable=False),
+        sa.Column("condition", sa.String(length=500), nullable=False),
+        sa.Column("drug", sa.String(length=500), nullable=False),
+        sa.Column("resource_type", sa.String(length=64), nullable=False),
+        sa.Column("resource_id", sa.String(length=128), nullable=True),
+        sa.Column("description", sa.Text(), nullable=False),
+        sa.Column("relevant", sa.Boolean(), nullable=False),
+        sa.Column("predicted_relevant", sa.Boolean(), nullable=True),
+        sa.Column("author", sa.String(length=200), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(["request_id"], ["prior_auth_requests.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_relevance_corrections_request_id"),
+        "relevance_corrections",
+        ["request_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_relevance_corrections_request_id"), table_name="relevance_corrections")
+    op.drop_table("relevance_corrections")
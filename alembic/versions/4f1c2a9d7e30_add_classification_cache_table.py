@@ -0,0 +1,42 @@
+"""add classification cache table
+
+Revision ID: 4f1c2a9d7e30
+Revises: ca2ec978beed
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4f1c2a9d7e30"
+down_revision: Union[str, Sequence[str], None] = "ca2ec978beed"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "classification_cache",
+        sa.Column("key", sa.String(length=64), primary_key=True),
+        sa.Column("condition", sa.String(length=500), nullable=False),
+        sa.Column("drug", sa.String(length=500), nullable=False),
+        sa.Column("resource_type", sa.String(length=64), nullable=False),
+        sa.Column("description", sa.Text(), nullable=False),
+        sa.Column("prompt_version", sa.String(length=16), nullable=False),
+        sa.Column("relevant", sa.Boolean(), nullable=False),
+        sa.Column("reasoning", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index(
+        "ix_classification_cache_expires_at", "classification_cache", ["expires_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_classification_cache_expires_at", table_name="classification_cache")
+    op.drop_table("classification_cache")
@@ -0,0 +1,26 @@
+"""add cited resources to prior auth answers
+
+Revision ID: 5d8e2f7a1c46
+Revises: 3c7a1e5b9d24
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5d8e2f7a1c46"
+down_revision: Union[str, Sequence[str], None] = "3c7a1e5b9d24"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("prior_auth_answers", sa.Column("cited_resources", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("prior_auth_answers", "cited_resources")
@@ -0,0 +1,26 @@
+"""add EHR patient id to prior auth requests
+
+Revision ID: 6e1b7c3a9f58
+Revises: 9a4c6e8b2d17
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6e1b7c3a9f58"
+down_revision: Union[str, Sequence[str], None] = "9a4c6e8b2d17"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("prior_auth_requests", sa.Column("patient_id", sa.String(length=128), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("prior_auth_requests", "patient_id")
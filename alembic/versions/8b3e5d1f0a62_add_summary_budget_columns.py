@@ -0,0 +1,30 @@
+"""add summary budget columns to prior auth requests
+
+Revision ID: 8b3e5d1f0a62
+Revises: 4f1c2a9d7e30
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8b3e5d1f0a62"
+down_revision: Union[str, Sequence[str], None] = "4f1c2a9d7e30"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("prior_auth_requests", sa.Column("summary_tokens", sa.Integer(), nullable=True))
+    op.add_column("prior_auth_requests", sa.Column("summary_lines_dropped", sa.Integer(), nullable=True))
+    op.add_column("prior_auth_requests", sa.Column("summary_tokens_dropped", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("prior_auth_requests", "summary_tokens_dropped")
+    op.drop_column("prior_auth_requests", "summary_lines_dropped")
+    op.drop_column("prior_auth_requests", "summary_tokens")
@@ -0,0 +1,46 @@
+"""add case resource verdicts table
+
+Revision ID: 9a4c6e8b2d17
+Revises: 5d8e2f7a1c46
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9a4c6e8b2d17"
+down_revision: Union[str, Sequence[str], None] = "5d8e2f7a1c46"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "case_resource_verdicts",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("case_id", sa.Integer(), nullable=False),
+        sa.Column("scope", sa.String(length=64), nullable=False),
+        sa.Column("resource_type", sa.String(length=64), nullable=False),
+        sa.Column("resource_id", sa.String(length=128), nullable=False),
+        sa.Column("version", sa.String(length=128), nullable=False),
+        sa.Column("relevant", sa.Boolean(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(["case_id"], ["cases.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("case_id", "scope", "resource_type", "resource_id"),
+    )
+    op.create_index(
+        op.f("ix_case_resource_verdicts_case_id"),
+        "case_resource_verdicts",
+        ["case_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_case_resource_verdicts_case_id"), table_name="case_resource_verdicts")
+    op.drop_table("case_resource_verdicts")
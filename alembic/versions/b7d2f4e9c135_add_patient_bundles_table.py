@@ -0,0 +1,34 @@
+"""add patient bundles table
+
+Revision ID: b7d2f4e9c135
+Revises: 6e1b7c3a9f58
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b7d2f4e9c135"
+down_revision: Union[str, Sequence[str], None] = "6e1b7c3a9f58"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "patient_bundles",
+        sa.Column("patient_id", sa.String(length=128), nullable=False),
+        sa.Column("bundle_ref", sa.String(length=80), nullable=False),
+        sa.Column("resources", sa.Integer(), nullable=False),
+        sa.Column("source", sa.String(length=1000), nullable=False),
+        sa.Column("ingested_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("patient_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("patient_bundles")
@@ -0,0 +1,259 @@
+"""Bulk Data $export ingestion for batch re-authorization.
+
+A FHIR Bulk Data export is a directory of NDJSON files, one or more per
+resource type, each holding resources for many patients. Files for types
+the pipeline never reads (Claim, ExplanationOfBenefit, ...) are skipped
+unopened. The rest are split into byte ranges and parsed on a process pool,
+so throughput scales with cores: each worker strips plumbing, projects the
+fields the pipeline uses and groups its lines by patient reference. The
+parent appends each group to a per-patient spill file; the pool then
+writes one bundle per patient to the bundle store, handing back only the
+refs, and the parent records them in patient_bundles.
+
+The fetcher reads a patient's ingested bundle, while it is younger than
+BULK_BUNDLE_MAX_AGE_HOURS, instead of calling the EHR.
+
+    python -m app.bulk_ingest /exports/2026-10-12
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+
+from .bundle_store import LocalBundleStore, get_bundle_store
+from .db import SessionLocal, settings
+from .fhir import CLINICAL_TYPES, project_resource
+from .models import utcnow
+from .models_prior_auth import PatientBundle
+
+log = logging.getLogger(__name__)
+
+INGESTED_TYPES = {"Patient", *CLINICAL_TYPES}
+# "Observation.ndjson", "Observation.003.ndjson", "Observation_1.ndjson"
+_TYPE_PREFIX = re.compile(r"^([A-Z][A-Za-z]+)(?=[._-])")
+_PATIENT_LINE = b'{"resourceType":"Patient"'
+
+
+class IngestStats(NamedTuple):
+    files: int
+    files_skipped: int
+    lines: int
+    resources: int
+    unattributed: int
+    patients: int
+    seconds: float
+
+
+def export_files(export_dir):
+    """(files to parse, files skipped by type) in an export directory."""
+    parse, skipped = [], []
+    for path in sorted(Path(export_dir).glob("*.ndjson")):
+        match = _TYPE_PREFIX.match(path.name)
+        if match and match.group(1) not in INGESTED_TYPES:
+            skipped.append(path)
+        else:
+            parse.append(path)
+    return parse, skipped
+
+
+def _patient_of(resource):
+    if resource.get("resourceType") == "Patient":
+        return resource.get("id")
+    for key in ("subject", "patient"):
+        ref = (resource.get(key) or {}).get("reference") or ""
+        ref = ref.split("/_history/")[0]
+        if ref.startswith("urn:uuid:"):
+            return ref.removeprefix("urn:uuid:")
+        if ref.startswith("Patient/") or "/Patient/" in ref:
+            return ref.rsplit("Patient/", 1)[1]
+    return None
+
+
+def parse_chunk(path, start, end):
+    """Group the NDJSON lines that start in [start, end) of path by patient.
+
+    Returns ({patient id: projected resources as NDJSON bytes}, lines read,
+    resources kept, resources with no patient reference).
+    """
+    groups = {}
+    lines = kept = unattributed = 0
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()        # the rest of a line that belongs to the previous chunk
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            lines += 1
+            resource = json.loads(line)
+            patient_id = _patient_of(resource)
+            projected = project_resource(resource)
+            if projected is None:
+                continue
+            if patient_id is None:
+                unattributed += 1
+                continue
+            kept += 1
+            groups.setdefault(patient_id, []).append(
+                json.dumps(projected, separators=(",", ":")).encode("utf-8")
+            )
+    return {pid: b"\n".join(out) + b"\n" for pid, out in groups.items()}, lines, kept, unattributed
+
+
+def _ranges(paths, chunk_bytes):
+    for path in paths:
+        size = path.stat().st_size
+        for start in range(0, size, chunk_bytes):
+            yield str(path), start, min(start + chunk_bytes, size)
+
+
+def _spill_path(spill_dir, patient_id):
+    return spill_dir / f"{hashlib.sha1(patient_id.encode('utf-8')).hexdigest()}.ndjson"
+
+
+def _write_bundle(spill, store_root):
+    """Store a patient's spilled resources as a collection bundle, Patient first. Returns its ref.
+
+    Runs in a pool worker, which has no bundle store of its own, so it
+    writes to the parent's store root.
+    """
+    with tempfile.TemporaryFile() as out:
+        out.write(b'{"resourceType":"Bundle","type":"collection","entry":[')
+        first = True
+        for patient_lines in (True, False):
+            with open(spill, "rb") as f:
+                for line in f:
+                    if line.startswith(_PATIENT_LINE) != patient_lines:
+                        continue
+                    out.write(b'{"resource":' if first else b',{"resource":')
+                    out.write(line.rstrip(b"\n"))
+                    out.write(b"}")
+                    first = False
+        out.write(b"]}")
+        out.seek(0)
+        return LocalBundleStore(store_root).put(out)
+
+
+def ingest_export(export_dir, workers=None, chunk_bytes=None):
+    """Parse an export into per-patient bundles. Returns ({patient id: (ref, resources)}, IngestStats)."""
+    started = time.perf_counter()
+    workers = workers or settings.bulk_ingest_workers or os.cpu_count()
+    chunk_bytes = chunk_bytes or settings.bulk_ingest_chunk_mb * 1024 * 1024
+    paths, skipped = export_files(export_dir)
+    lines = kept = unattributed = 0
+    counts = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spill_dir = Path(tmp)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            ranges = list(_ranges(paths, chunk_bytes))
+            results = pool.map(parse_chunk, *zip(*ranges)) if ranges else ()
+            for groups, chunk_lines, chunk_kept, chunk_unattributed in results:
+                lines += chunk_lines
+                kept += chunk_kept
+                unattributed += chunk_unattributed
+                for patient_id, data in groups.items():
+                    with open(_spill_path(spill_dir, patient_id), "ab") as f:
+                        f.write(data)
+                    counts[patient_id] = counts.get(patient_id, 0) + data.count(b"\n")
+
+            # Serializing, hashing and writing the bundles scales with cores too
+            spills = [_spill_path(spill_dir, patient_id) for patient_id in counts]
+            refs = pool.map(_write_bundle, spills, itertools.repeat(get_bundle_store().root),
+                            chunksize=max(1, len(spills) // (workers * 4)))
+            bundles = {
+                patient_id: (ref, n) for (patient_id, n), ref in zip(counts.items(), refs)
+            }
+
+    stats = IngestStats(
+        files=len(paths), files_skipped=len(skipped), lines=lines, resources=kept,
+        unattributed=unattributed, patients=len(bundles),
+        seconds=time.perf_counter() - started,
+    )
+    log.info("Bulk ingest: %d lines from %d files (%d skipped by type) -> %d resources "
+             "for %d patients in %.1fs on %d workers; %d without a patient reference",
+             stats.lines, stats.files, stats.files_skipped, stats.resources, stats.patients,
+             stats.seconds, workers, stats.unattributed)
+    return bundles, stats
+
+
+async def record_bundles(bundles, source, session_factory=SessionLocal):
+    """Point each patient at their newly ingested bundle."""
+    if not bundles:
+        return
+    ingested_at = utcnow()
+    rows = [
+        {"patient_id": patient_id, "bundle_ref": ref, "resources": resources,
+         "source": str(source), "ingested_at": ingested_at}
+        for patient_id, (ref, resources) in bundles.items()
+    ]
+    async with session_factory() as db:
+        # One upsert for the whole export, not a round trip per patient
+        dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(PatientBundle)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PatientBundle.patient_id],
+            set_={key: stmt.excluded[key] for key in ("bundle_ref", "resources", "source", "ingested_at")},
+        )
+        await db.execute(stmt, rows)
+        await db.commit()
+
+
+async def ingested_bundle_refs(session_factory=SessionLocal):
+    """Every bundle ref recorded in patient_bundles."""
+    async with session_factory() as db:
+        return set((await db.execute(select(PatientBundle.bundle_ref))).scalars())
+
+
+async def ingested_bundle_ref(patient_id, session_factory=SessionLocal):
+    """The patient's ingested bundle if it's recent enough to use, else None."""
+    cutoff = utcnow() - timedelta(hours=settings.bulk_bundle_max_age_hours)
+    try:
+        async with session_factory() as db:
+            row = (await db.execute(
+                select(PatientBundle).where(PatientBundle.patient_id == patient_id)
+            )).scalar_one_or_none()
+    except (SQLAlchemyError, OSError) as e:
+        log.warning("Bulk ingest: could not look up patient %s: %s", patient_id, e)
+        return None
+    if row is None or not get_bundle_store().exists(row.bundle_ref):
+        return None
+    ingested_at = row.ingested_at
+    if ingested_at.tzinfo is None:
+        ingested_at = ingested_at.replace(tzinfo=cutoff.tzinfo)
+    return row.bundle_ref if ingested_at >= cutoff else None
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Ingest a FHIR Bulk Data export.")
+    parser.add_argument("export_dir", type=Path)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="parser processes (default: BULK_INGEST_WORKERS, else one per core)")
+    args = parser.parse_args()
+
+    bundles, stats = ingest_export(args.export_dir, workers=args.workers)
+    await record_bundles(bundles, args.export_dir)
+    print(f"Ingested {stats.resources} resources for {stats.patients} patients "
+          f"from {stats.files} files in {stats.seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -0,0 +1,113 @@
+"""Claim-check storage for FHIR bundles.
+
+A bundle can run to many megabytes, too large to ride inside a pub/sub
+message (Cloud Pub/Sub caps messages at 10 MB) and wasteful to hold in
+queues between stages. The fetcher writes each bundle here once and
+publishes only its reference; the classifier reads it back from here. A retry
+re-reads the stored bundle instead of fetching it from the EHR again.
+
+Bundles are stored under the SHA-256 of their bytes, so the same bundle
+fetched twice is stored once. Nothing is deleted when a ref is published;
+sweep() removes bundles nothing refers to any more once they are older
+than BUNDLE_STORE_RETENTION_HOURS, long enough for the stages and their
+retries to have read them. The local directory stands in for object
+storage; refs are plain strings, so a bucket-backed store can replace it
+without changing the pipeline.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from .db import settings
+
+log = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = Path(__file__).parent.parent / "data" / "bundles"
+
+_REF = re.compile(r"^sha256:([0-9a-f]{64})$")
+
+
+class BundleNotFound(LookupError):
+    pass
+
+
+class LocalBundleStore:
+    """Content-addressed bundles in a local directory."""
+
+    def __init__(self, root, chunk_size=1 << 20):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+
+    def _path(self, ref):
+        match = _REF.match(ref)
+        if match is None:
+            raise ValueError(f"Not a bundle reference: {ref!r}")
+        digest = match.group(1)
+        return self.root / digest[:2] / f"{digest}.json"
+
+    def put(self, fp):
+        """Copy a binary stream into the store, a chunk at a time. Returns its ref."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := fp.read(self.chunk_size):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            ref = f"sha256:{digest.hexdigest()}"
+            path = self._path(ref)
+            path.parent.mkdir(exist_ok=True)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        log.info("Bundle store: stored %s (%d bytes)", ref, size)
+        return ref
+
+    def exists(self, ref):
+        return self._path(ref).exists()
+
+    def open(self, ref):
+        """The stored bundle as a binary file object."""
+        try:
+            return open(self._path(ref), "rb")
+        except FileNotFoundError:
+            raise BundleNotFound(ref) from None
+
+    def sweep(self, keep, max_age_seconds):
+        """Delete bundles not in keep that were last written over max_age_seconds ago.
+
+        Returns the number deleted. A put of the same bytes rewrites the
+        file, so a bundle that is still being stored again stays young.
+        """
+        cutoff = time.time() - max_age_seconds
+        deleted = 0
+        for path in self.root.glob("*/*.json"):
+            if f"sha256:{path.stem}" in keep:
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    deleted += 1
+            except FileNotFoundError:
+                continue
+        if deleted:
+            log.info("Bundle store: swept %d unreferenced bundles", deleted)
+        return deleted
+
+
+_instance = None
+
+
+def get_bundle_store():
+    global _instance
+    if _instance is None:
+        _instance = LocalBundleStore(settings.bundle_store_path or DEFAULT_STORE_PATH)
+    return _instance
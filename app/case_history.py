@@ -0,0 +1,126 @@
+"""Incremental re-processing of a case's FHIR history.
+
+A case is usually submitted again after a few new results have arrived,
+not after its whole history changed. The relevance of every resource we
+classified is stored per case, keyed by resource id and version, and
+scoped to the condition, drug and classifier prompt. On a new request only
+resources that are new or changed since then are classified; the rest
+reuse their stored verdicts and the summary is rebuilt from both.
+
+A resource's version is its meta.versionId or meta.lastUpdated. Bundles
+without either (Synthea's) fall back to a fingerprint of the fields the
+summary is written from, so an edited value still counts as a change.
+"""
+import hashlib
+import logging
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from .classification_cache import normalize
+from .db import SessionLocal
+from .fhir import CLINICAL_TYPES, PROMPT_VERSION, classify_relevance
+from .models_prior_auth import CaseResourceVerdict
+
+log = logging.getLogger(__name__)
+
+
+def scope_key(condition, drug, prompt_version=PROMPT_VERSION):
+    raw = "\x1f".join((normalize(condition), normalize(drug), prompt_version))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def record_version(record):
+    if record.version:
+        return str(record.version)
+    fields = (record.description, record.codes, record.value, record.unit,
+              record.date, record.status)
+    return "sha1:" + hashlib.sha1(repr(fields).encode("utf-8")).hexdigest()
+
+
+async def _load(db, case_id, scope):
+    # Plain rows rather than ORM objects: a long history has thousands of them
+    result = await db.execute(
+        select(
+            CaseResourceVerdict.id, CaseResourceVerdict.resource_type,
+            CaseResourceVerdict.resource_id, CaseResourceVerdict.version,
+            CaseResourceVerdict.relevant,
+        ).where(
+            CaseResourceVerdict.case_id == case_id,
+            CaseResourceVerdict.scope == scope,
+        )
+    )
+    return {(row.resource_type, row.resource_id): row for row in result}
+
+
+async def classify_case(case_id, resources, condition, drug, session_factory=SessionLocal):
+    """classify_relevance, reusing this case's stored verdicts for unchanged resources.
+
+    Returns the relevant records in their original order.
+    """
+    scope = scope_key(condition, drug)
+    try:
+        async with session_factory() as db:
+            stored = await _load(db, case_id, scope)
+    except (SQLAlchemyError, OSError) as e:
+        log.warning("Case %s: stored verdicts unavailable, classifying everything: %s", case_id, e)
+        stored = None
+
+    keep = set()
+    fresh = []
+    for r in resources:
+        if r.resource_type not in CLINICAL_TYPES:
+            keep.add(id(r))     # the Patient, which classify_relevance always keeps
+            continue
+        row = stored.get((r.resource_type, r.id)) if stored and r.id else None
+        if row is not None and row.version == record_version(r):
+            if row.relevant:
+                keep.add(id(r))
+        else:
+            fresh.append(r)
+
+    clinical = sum(1 for r in resources if r.resource_type in CLINICAL_TYPES)
+    log.info("Case %s: %d resources unchanged since the last request, %d to classify",
+             case_id, clinical - len(fresh), len(fresh))
+
+    fresh_relevant = {id(r) for r in await classify_relevance(fresh, condition, drug)}
+    keep |= fresh_relevant
+
+    if stored is not None:
+        await _save(session_factory, case_id, scope, resources, fresh, fresh_relevant)
+    return [r for r in resources if id(r) in keep]
+
+
+async def _save(session_factory, case_id, scope, resources, fresh, fresh_relevant):
+    """Store verdicts for fresh resources and forget ones no longer in the bundle."""
+    present = {(r.resource_type, r.id) for r in resources if r.id}
+    try:
+        async with session_factory() as db:
+            stored = await _load(db, case_id, scope)
+            gone = [row.id for key, row in stored.items() if key not in present]
+            added, changed = {}, []
+            for r in fresh:
+                if not r.id:
+                    continue
+                values = {"version": record_version(r), "relevant": id(r) in fresh_relevant}
+                row = stored.get((r.resource_type, r.id))
+                if row is not None:
+                    changed.append({"id": row.id, **values})
+                else:
+                    # keyed, so a resource listed twice is inserted once
+                    added[(r.resource_type, r.id)] = {
+                        "case_id": case_id, "scope": scope,
+                        "resource_type": r.resource_type, "resource_id": r.id, **values,
+                    }
+            # Bulk statements, not the unit of work, so thousands of rows
+            # don't cost seconds of CPU on the event loop
+            if gone:
+                await db.execute(delete(CaseResourceVerdict).where(CaseResourceVerdict.id.in_(gone)))
+            if added:
+                await db.execute(insert(CaseResourceVerdict), list(added.values()))
+            if changed:
+                await db.execute(update(CaseResourceVerdict), changed)
+            await db.commit()
+    except (SQLAlchemyError, OSError) as e:
+        # Another request for the case may have written first; the next run redoes it
+        log.warning("Case %s: could not store verdicts: %s", case_id, e)
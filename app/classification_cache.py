@@ -0,0 +1,173 @@
+"""Two-tier cache for Gemini relevance classifications.
+
+Verdicts are keyed on the normalized (condition, drug, resource type,
+description) plus the classifier prompt version, so editing the prompt
+invalidates everything it produced. An in-process LRU answers repeat
+lookups without a round trip; misses fall through to the
+classification_cache table, which is shared by every instance.
+"""
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta, timezone
+from typing import NamedTuple
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from .db import SessionLocal, settings
+from .models import utcnow
+from .models_prior_auth import ClassificationCacheEntry
+
+log = logging.getLogger(__name__)
+
+
+class Verdict(NamedTuple):
+    relevant: bool
+    reasoning: str
+
+
+def normalize(text):
+    return " ".join(text.casefold().split())
+
+
+def cache_key(condition, drug, rtype, description, prompt_version):
+    raw = "\x1f".join((
+        normalize(condition),
+        normalize(drug),
+        rtype,
+        normalize(description),
+        prompt_version,
+    ))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _epoch(dt):
+    """time.time() value of a stored timestamp; SQLite hands them back naive, in UTC."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class ClassificationCache:
+    """LRU in front of Postgres. Pass session_factory=None for memory only."""
+
+    def __init__(self, maxsize=None, ttl_seconds=None, session_factory=SessionLocal):
+        self.maxsize = maxsize or settings.classification_cache_size
+        self.ttl_seconds = ttl_seconds or settings.classification_cache_ttl_hours * 3600
+        self._session_factory = session_factory
+        self._lru = OrderedDict()
+
+    def __len__(self):
+        return len(self._lru)
+
+    def clear(self):
+        self._lru.clear()
+
+    def _remember(self, key, verdict, expires_at):
+        self._lru[key] = (verdict, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def _recall(self, key, now):
+        entry = self._lru.get(key)
+        if entry is None:
+            return None
+        verdict, expires_at = entry
+        if expires_at <= now:
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return verdict
+
+    async def get_many(self, condition, drug, rtype, descriptions, prompt_version):
+        """Return {description: Verdict} for every description with a live entry."""
+        now = time.time()
+        keys = {
+            cache_key(condition, drug, rtype, desc, prompt_version): desc
+            for desc in descriptions
+        }
+
+        found = {}
+        missing = []
+        for key, desc in keys.items():
+            verdict = self._recall(key, now)
+            if verdict is None:
+                missing.append(key)
+            else:
+                found[desc] = verdict
+
+        if not missing or self._session_factory is None:
+            return found
+
+        try:
+            async with self._session_factory() as db:
+                result = await db.execute(
+                    select(ClassificationCacheEntry).where(
+                        ClassificationCacheEntry.key.in_(missing),
+                        ClassificationCacheEntry.expires_at > utcnow(),
+                    )
+                )
+                rows = result.scalars().all()
+        except (SQLAlchemyError, OSError) as e:
+            log.warning("Classification cache lookup failed, treating as miss: %s", e)
+            return found
+
+        for row in rows:
+            verdict = Verdict(row.relevant, row.reasoning)
+            found[keys[row.key]] = verdict
+            # Keep the row's expiry; a fresh TTL would let the verdict outlive it
+            self._remember(row.key, verdict, _epoch(row.expires_at))
+
+        return found
+
+    async def put_many(self, condition, drug, rtype, verdicts, prompt_version):
+        """Store {description: Verdict} in both tiers and evict expired rows."""
+        if not verdicts:
+            return
+
+        now = time.time()
+        expires_at = utcnow() + timedelta(seconds=self.ttl_seconds)
+        rows = []
+        for desc, verdict in verdicts.items():
+            key = cache_key(condition, drug, rtype, desc, prompt_version)
+            self._remember(key, verdict, now + self.ttl_seconds)
+            rows.append(ClassificationCacheEntry(
+                key=key,
+                condition=condition,
+                drug=drug,
+                resource_type=rtype,
+                description=desc,
+                prompt_version=prompt_version,
+                relevant=verdict.relevant,
+                reasoning=verdict.reasoning,
+                expires_at=expires_at,
+            ))
+
+        if self._session_factory is None:
+            return
+
+        try:
+            async with self._session_factory() as db:
+                await db.execute(
+                    delete(ClassificationCacheEntry).where(or_(
+                        ClassificationCacheEntry.key.in_([r.key for r in rows]),
+                        ClassificationCacheEntry.expires_at <= utcnow(),
+                    ))
+                )
+                db.add_all(rows)
+                await db.commit()
+        except (SQLAlchemyError, OSError) as e:
+            log.warning("Classification cache write failed: %s", e)
+
+
+_instance = None
+
+
+def get_classification_cache():
+    global _instance
+    if _instance is None:
+        _instance = ClassificationCache()
+    return _instance
@@ -0,0 +1,80 @@
+"""Micro-batching of identical work across concurrent requests.
+
+When several nurses submit prior auths for the same condition and drug
+within seconds of each other, each pipeline would classify mostly the same
+descriptions. Callers submit under a key; everything submitted under that
+key during a short window is deduplicated and run as one call, and each
+caller gets back only the slice it asked for.
+
+The shared call runs in a task of its own, outside every caller's context,
+at the highest Gemini priority among the callers: an interactive request
+that joins a window opened by a background one doesn't wait behind the
+background queue.
+"""
+import asyncio
+import contextvars
+import logging
+
+from .llm import at_priority, current_priority
+
+log = logging.getLogger(__name__)
+
+
+class _Window:
+    __slots__ = ("items", "run", "future", "callers", "priority")
+
+    def __init__(self, run, future, priority):
+        self.items = {}
+        self.run = run
+        self.future = future
+        self.callers = 0
+        self.priority = priority
+
+
+class Coalescer:
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._open = {}
+        self._tasks = set()
+
+    async def submit(self, key, items, run):
+        """Run `run(items)` -> {item: result}, merged with other submissions for key.
+
+        The first submission in a window supplies the `run` used for everyone,
+        so it must not close over anything that belongs to one caller.
+        """
+        if self.window_seconds <= 0:
+            return await run(list(items))
+
+        window = self._open.get(key)
+        if window is None:
+            window = _Window(run, asyncio.get_running_loop().create_future(), current_priority())
+            self._open[key] = window
+            # A fresh context, so the shared call inherits nothing from the first caller
+            task = asyncio.create_task(self._flush(key, window), context=contextvars.Context())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        window.items.update(dict.fromkeys(items))
+        window.callers += 1
+        window.priority = min(window.priority, current_priority())   # lower runs sooner
+
+        # shield: one caller being cancelled must not cancel the shared call
+        results = await asyncio.shield(window.future)
+        return {item: results[item] for item in items if item in results}
+
+    async def _flush(self, key, window):
+        await asyncio.sleep(self.window_seconds)
+        # Close the window first so late arrivals start a new one
+        del self._open[key]
+
+        if window.callers > 1:
+            log.info("Coalesced %d requests into one call of %d items",
+                     window.callers, len(window.items))
+        try:
+            with at_priority(window.priority):
+                results = await window.run(list(window.items))
+        except Exception as e:
+            window.future.set_exception(e)
+        else:
+            window.future.set_result(results)
@@ -1,3 +1,4 @@
+from typing import Literal
 from urllib.parse import quote_plus
 
 from pydantic import computed_field
@@ -22,6 +23,57 @@ class Settings(BaseSettings):
     db_pool_size: int = 5
     db_max_overflow: int = 2
     api_key: str = ""
+    gemini_base_url: str = ""
+
+    classification_cache_size: int = 10_000
+    classification_cache_ttl_hours: int = 24 * 30
+    classify_max_concurrency: int = 4
+    classify_target_latency_seconds: float = 8.0
+    classify_max_output_tokens: int = 8192
+    classify_coalesce_window_ms: int = 50
+    classify_similarity_threshold: float = 0.9
+    classify_similarity_audit: bool = True
+    classify_similarity_max_entries: int = 2000
+    classify_similarity_max_scopes: int = 256
+    relevance_model_path: str = ""
+    relevance_model_confidence: float = 0.9
+    lab_series_min_points: int = 3
+    qa_prompt_token_budget: int = 8000
+    qa_batch_questions: bool = False
+    qa_max_output_tokens: int = 8192
+    qa_max_concurrency: int = 4
+    qa_max_retries: int = 2
+    qa_retry_backoff_seconds: float = 1.0
+    qa_retrieval_top_k: int = 20
+    terminology_prefilter: bool = True
+    terminology_index_path: str = ""
+    bundle_store_path: str = ""
+    bundle_store_retention_hours: float = 24.0
+    bundle_store_sweep_minutes: float = 60.0
+    fhir_base_url: str = ""
+    fhir_access_token: str = ""
+    fhir_page_size: int = 200
+    fhir_max_concurrency: int = 4
+    fhir_max_connections: int = 10
+    fhir_timeout_seconds: float = 30.0
+    fhir_max_retries: int = 2
+    fhir_etag_cache_size: int = 10_000
+    fhir_etag_scope: Literal["page", "search"] = "page"
+    bulk_ingest_workers: int = 0
+    bulk_ingest_chunk_mb: int = 16
+    bulk_bundle_max_age_hours: int = 24 * 7
+    local_ehr_path: str = ""
+    cpu_offload: Literal["off", "thread", "process"] = "thread"
+    cpu_offload_workers: int = 2
+    llm_requests_per_minute: int = 1000
+    llm_tokens_per_minute: int = 1_000_000
+    llm_initial_concurrency: int = 8
+    llm_min_concurrency: int = 1
+    llm_max_concurrency: int = 32
+    llm_target_latency_seconds: float = 20.0
+    llm_max_retries: int = 4
+    llm_retry_base_seconds: float = 0.5
+    llm_retry_max_seconds: float = 30.0
 
     @computed_field
     @property
@@ -1,10 +1,27 @@
+import asyncio
+import hashlib
+import io
 import logging
-import os
+import mmap
+import re
+import sys
+from typing import NamedTuple
 
 from dotenv import load_dotenv
-from google import genai
 from pydantic import BaseModel, Field
 
+from . import fhir_structs
+from .fhir_structs import find_bundle_resources, iter_bundle_structs
+from .classification_cache import Verdict, get_classification_cache, normalize
+from .coalescer import Coalescer
+from .db import settings
+from .terminology import code_key, get_terminology_index
+from .labs import series_key, summarize_series
+from .relevance_model import get_relevance_model
+from .similarity import get_similarity_index
+from .llm import get_gateway
+from .tokens import RESPONSE_TOKENS_PER_CLASSIFICATION, ChunkSizer, estimate_tokens
+
 load_dotenv()
 log = logging.getLogger(__name__)
 
@@ -25,64 +42,218 @@ class BatchClassification(BaseModel):
     classifications: list[ResourceRelevance]
 
 
-def _get_gemini_client():
-    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else None
+
+
+def _first_name(resource):
+    names = resource.get("name")
+    if isinstance(names, list) and names and isinstance(names[0], dict):
+        return names[0]
+    return {}
+
+
+def _resource_version(resource):
+    """meta.versionId, else meta.lastUpdated, else None."""
+    meta = resource.get("meta") or {}
+    return meta.get("versionId") or meta.get("lastUpdated")
+
+
+def _struct_date(resource):
+    """_record_date for a typed fhir_structs resource."""
+    for key in ("effectiveDateTime", "onsetDateTime", "authoredOn",
+                "performedDateTime", "recordedDate"):
+        value = getattr(resource, key, None)
+        if value is not None:
+            return value
+    for key in ("performedPeriod", "effectivePeriod", "period"):
+        value = getattr(resource, key, None)
+        if value is not None:
+            return value.start
+    return None
+
+
+def _category_codes(categories):
+    """Code keys of a resource's category, whichever shape it takes.
+
+    Usually a list of CodeableConcepts, but Procedure.category is a single
+    concept and AllergyIntolerance.category is a list of plain codes
+    ("food", "medication"), which carry no coding system and are skipped.
+    """
+    if isinstance(categories, dict):
+        categories = [categories]
+    for category in categories or ():
+        if isinstance(category, dict):
+            for c in category.get("coding", []):
+                yield code_key(c.get("system", ""), c.get("code", ""))
+
+
+def _record_date(resource):
+    for key in ("effectiveDateTime", "onsetDateTime", "authoredOn",
+                "performedDateTime", "recordedDate"):
+        if key in resource:
+            return resource[key]
+    for key in ("performedPeriod", "effectivePeriod", "period"):
+        if key in resource:
+            return resource[key].get("start")
+    return None
+
+
+class FhirRecord:
+    """The handful of FHIR fields the classify → summarize path actually reads.
+
+    A raw Synthea resource is a deep tree of dicts; this keeps a few slots
+    per resource, with the type, description, unit and status strings
+    interned so thousands of repeated lab names share one object.
+    """
+
+    __slots__ = (
+        "resource_type", "id", "description", "codes", "value", "unit", "date", "status",
+        "given", "family", "birth_date", "gender", "version",
+    )
+
+    def __init__(self, resource_type, id=None, description=None, codes=(), value=None,
+                 unit=None, date=None, status=None, given=None, family=None,
+                 birth_date=None, gender=None, version=None):
+        self.resource_type = _intern(resource_type)
+        self.id = id
+        self.description = _intern(description)
+        self.codes = tuple(sys.intern(c) for c in codes)
+        self.value = value
+        self.unit = _intern(unit)
+        self.date = date
+        self.status = _intern(status)
+        self.given = given
+        self.family = family
+        self.birth_date = birth_date
+        self.gender = _intern(gender)
+        self.version = version
+
+    @classmethod
+    def from_resource(cls, resource):
+        rtype = resource["resourceType"]
+        version = _resource_version(resource)
 
+        if rtype == "Patient":
+            name = _first_name(resource)
+            return cls(
+                rtype,
+                id=resource.get("id"),
+                given=" ".join(name.get("given", [])),
+                family=name.get("family", ""),
+                birth_date=resource.get("birthDate"),
+                gender=resource.get("gender"),
+                version=version,
+            )
+
+        if rtype == "MedicationRequest":
+            concept = resource.get("medicationCodeableConcept", {})
+        else:
+            concept = resource.get("code", {})
+        quantity = resource.get("valueQuantity", {})
+
+        codes = [code_key(c.get("system", ""), c.get("code", ""))
+                 for c in concept.get("coding", [])]
+        codes.extend(_category_codes(resource.get("category")))
+
+        return cls(
+            rtype,
+            id=resource.get("id"),
+            description=concept.get("text"),
+            codes=codes,
+            value=quantity.get("value"),
+            unit=quantity.get("unit"),
+            date=_record_date(resource),
+            status=resource.get("status"),
+            version=version,
+        )
 
-def _get_description(resource):
-    """Extract a human-readable description from a FHIR resource."""
-    rtype = resource["resourceType"]
-    if rtype == "MedicationRequest":
-        return resource.get("medicationCodeableConcept", {}).get("text", "unknown")
-    return resource.get("code", {}).get("text", "unknown")
+    @classmethod
+    def from_struct(cls, resource):
+        """The same record as from_resource, from a typed fhir_structs resource."""
+        meta = resource.meta
+        version = (meta.versionId or meta.lastUpdated) if meta else None
+
+        if isinstance(resource, fhir_structs.Patient):
+            name = resource.name[0] if resource.name else fhir_structs.HumanName()
+            return cls(
+                "Patient",
+                id=resource.id,
+                given=" ".join(name.given),
+                family=name.family,
+                birth_date=resource.birthDate,
+                gender=resource.gender,
+                version=version,
+            )
+
+        if isinstance(resource, fhir_structs.MedicationRequest):
+            concept = resource.medicationCodeableConcept
+        else:
+            concept = getattr(resource, "code", None)
+        concept = concept or fhir_structs.CodeableConcept()
+        quantity = getattr(resource, "valueQuantity", None) or fhir_structs.Quantity()
+
+        codes = [code_key(c.system, c.code) for c in concept.coding]
+        categories = getattr(resource, "category", None) or ()
+        if isinstance(categories, fhir_structs.CodeableConcept):
+            categories = [categories]
+        for category in categories:
+            if isinstance(category, fhir_structs.CodeableConcept):
+                codes.extend(code_key(c.system, c.code) for c in category.coding)
+
+        return cls(
+            type(resource).__name__,
+            id=resource.id,
+            description=concept.text,
+            codes=codes,
+            value=quantity.value,
+            unit=quantity.unit,
+            date=_struct_date(resource),
+            status=getattr(resource, "status", None),
+            version=version,
+        )
 
+    def __reduce__(self):
+        # Pickled as a positional tuple rather than a {slot: value} dict per
+        # record when crossing to a worker process; strings are re-interned
+        return (FhirRecord, tuple(getattr(self, name) for name in self.__slots__))
 
-def strip_plumbing(bundle):
-    clean_resources = []
-    for entry in bundle["entry"]:
-        resource = entry["resource"]
-        for key in PLUMBING_KEYS:
-            resource.pop(key, None)
-        clean_resources.append(resource)
-    return clean_resources
+    def __repr__(self):
+        return f"FhirRecord({self.resource_type}/{self.id}: {self.description!r})"
 
+    def as_dict(self):
+        """The fields that are set, JSON-ready; what a citation resolves to."""
+        out = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None and value != ():
+                out[name] = list(value) if name == "codes" else value
+        return out
 
-async def classify_relevance(resources, condition, drug):
-    client = _get_gemini_client()
-    relevant = []
-    clinical_batches = {}
 
-    for r in resources:
-        rtype = r["resourceType"]
-        if rtype == "Patient":
-            relevant.append(r)
-        elif rtype in CLINICAL_TYPES:
-            clinical_batches.setdefault(rtype, []).append(r)
+def _get_description(record):
+    """Human-readable description used to deduplicate and classify a record."""
+    return record.description or "unknown"
 
-    for rtype, batch in clinical_batches.items():
-        # Deduplicate by description — classify unique names, map back to all matching resources
-        desc_to_resources = {}
-        for r in batch:
-            desc_to_resources.setdefault(_get_description(r), []).append(r)
 
-        unique_descriptions = list(desc_to_resources.keys())
-        log.info("Classifying %d unique %s descriptions (from %d resources)",
-                 len(unique_descriptions), rtype, len(batch))
+def strip_plumbing(bundle):
+    """Reduce a parsed Bundle to compact records for the Patient and clinical resources."""
+    records = []
+    for entry in bundle["entry"]:
+        resource = _clean_resource(entry["resource"])
+        if resource is not None:
+            records.append(FhirRecord.from_resource(resource))
+    return records
 
-        resource_list = "\n".join(
-            f"ID: {i} — {desc}" for i, desc in enumerate(unique_descriptions)
-        )
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=f"""You are a clinical relevance classifier for prior authorization.
+CLASSIFY_PROMPT = """You are a clinical relevance classifier for prior authorization.
 
 Given the condition and drug below, classify each {rtype} resource as relevant or not relevant.
 
 CONDITION: {condition}
 DRUG: {drug}
 
-{rtype.upper()} RESOURCES:
+{rtype_upper} RESOURCES:
 {resource_list}
 
 Classify every resource listed above. Be STRICT. A resource is relevant ONLY if it directly relates to:
@@ -95,62 +266,492 @@ Classify every resource listed above. Be STRICT. A resource is relevant ONLY if
 Routine physical examinations, general evaluations, history taking, reviews of systems,
 and standard encounter procedures are NOT relevant.
 Pre-treatment safety screenings (TB, hepatitis, CBC) ARE relevant if they relate to biologic therapy.
-When in doubt, mark as NOT relevant.""",
-            config={
-                "response_mime_type": "application/json",
-                "response_json_schema": BatchClassification.model_json_schema(),
-            },
+When in doubt, mark as NOT relevant."""
+
+# Cached verdicts are only valid for the prompt that produced them.
+PROMPT_VERSION = hashlib.sha256(CLASSIFY_PROMPT.encode("utf-8")).hexdigest()[:16]
+
+
+def _clean_resource(resource):
+    if not resource:
+        return None
+    rtype = resource.get("resourceType")
+    if rtype != "Patient" and rtype not in CLINICAL_TYPES:
+        return None
+    meta = resource.get("meta")
+    for key in PLUMBING_KEYS:
+        resource.pop(key, None)
+    # Keep just the version fields, for incremental re-processing of a case
+    if isinstance(meta, dict):
+        version = {k: meta[k] for k in ("versionId", "lastUpdated") if k in meta}
+        if version:
+            resource["meta"] = version
+    return resource
+
+
+# Everything FhirRecord.from_resource reads; see project_resource
+PROJECTED_KEYS = (
+    "resourceType", "id", "meta", "name", "birthDate", "gender", "status",
+    "code", "medicationCodeableConcept", "category", "valueQuantity",
+    "effectiveDateTime", "onsetDateTime", "authoredOn", "performedDateTime", "recordedDate",
+    "performedPeriod", "effectivePeriod", "period",
+)
+
+
+def project_resource(resource):
+    """A Patient or clinical resource cut down to the fields the pipeline reads; None otherwise."""
+    resource = _clean_resource(resource)
+    if resource is None:
+        return None
+    return {k: resource[k] for k in PROJECTED_KEYS if k in resource}
+
+
+def _map(fp):
+    """An mmap of fp when it's a real file, else its contents."""
+    try:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return fp.read()
+
+
+def read_bundle_records(fp):
+    """Compact records for the Patient and clinical resources of a Bundle file.
+
+    Decoded with the typed schema in fhir_structs, straight from an mmap of
+    the file when it has one: fields the pipeline doesn't read, and
+    resources of other types, are never built as Python objects.
+    """
+    data = _map(fp)
+    # Not closed explicitly: the mapping is released with the last Raw slice into it
+    return [FhirRecord.from_struct(r) for r in iter_bundle_structs(data)]
+
+
+def read_bundle_resources(fp, wanted):
+    """{(resourceType, id): resource dict} for the wanted resources of a Bundle file."""
+    return find_bundle_resources(_map(fp), wanted)
+
+
+async def _classify_descriptions(rtype, descriptions, condition, drug):
+    """Classify unique descriptions in one Gemini call. Returns {description: Verdict}."""
+    resource_list = "\n".join(
+        f"ID: {i} — {desc}" for i, desc in enumerate(descriptions)
+    )
+
+    response = await get_gateway().generate(
+        contents=CLASSIFY_PROMPT.format(
+            rtype=rtype,
+            rtype_upper=rtype.upper(),
+            condition=condition,
+            drug=drug,
+            resource_list=resource_list,
+        ),
+        config={
+            "response_mime_type": "application/json",
+            "response_json_schema": BatchClassification.model_json_schema(),
+        },
+        expected_output_tokens=len(descriptions) * RESPONSE_TOKENS_PER_CLASSIFICATION,
+        # Time the call itself, not the wait for quota, so chunk sizing isn't skewed
+        observe=lambda seconds: _chunk_sizer.observe(descriptions, seconds),
+    )
+
+    result = BatchClassification.model_validate_json(response.text)
+
+    verdicts = {}
+    for c in result.classifications:
+        try:
+            desc = descriptions[int(c.id)]
+        except (ValueError, IndexError):
+            continue
+        verdicts[desc] = Verdict(c.relevant, c.reasoning)
+    return verdicts
+
+
+# Shared across requests so every call refines the same throughput estimate.
+_chunk_sizer = ChunkSizer(
+    target_seconds=settings.classify_target_latency_seconds,
+    max_output_tokens=settings.classify_max_output_tokens,
+)
+_coalescer = Coalescer(window_seconds=settings.classify_coalesce_window_ms / 1000)
+
+
+async def _classify_chunk(semaphore, rtype, descriptions, condition, drug):
+    async with semaphore:
+        return await _classify_descriptions(rtype, descriptions, condition, drug)
+
+
+async def _classify_misses(semaphore, rtype, descriptions, condition, drug):
+    """Classify descriptions nothing cached could answer, and cache the verdicts."""
+    # Large batches are split so no single call blows the output limit or
+    # runs far past the target latency; chunks share the semaphore.
+    chunks = _chunk_sizer.split(descriptions)
+    if len(chunks) > 1:
+        log.info("Split %d %s descriptions into %d chunks",
+                 len(descriptions), rtype, len(chunks))
+
+    fresh = {}
+    for part in await asyncio.gather(*(
+        _classify_chunk(semaphore, rtype, chunk, condition, drug)
+        for chunk in chunks
+    )):
+        fresh.update(part)
+
+    await get_classification_cache().put_many(condition, drug, rtype, fresh, PROMPT_VERSION)
+    return fresh
+
+
+async def _classify_batch(semaphore, rtype, batch, condition, drug, scope):
+    cache = get_classification_cache()
+    index = get_terminology_index()
+
+    # Resources whose codes settle the question never reach the LLM
+    relevant = []
+    ambiguous = batch
+    if scope is not None:
+        ambiguous = []
+        rejected = 0
+        for r in batch:
+            decision = index.triage(r.codes, scope)
+            if decision is None:
+                ambiguous.append(r)
+            elif decision:
+                relevant.append(r)
+            else:
+                rejected += 1
+        log.info("Terminology pre-filter: %d %s accepted, %d rejected, %d ambiguous",
+                 len(relevant), rtype, rejected, len(ambiguous))
+
+    # Deduplicate by description — classify unique names, map back to all matching resources
+    desc_to_resources = {}
+    for r in ambiguous:
+        desc_to_resources.setdefault(_get_description(r), []).append(r)
+
+    cached = await cache.get_many(
+        condition, drug, rtype, desc_to_resources.keys(), PROMPT_VERSION
+    )
+    verdicts = dict(cached)
+    unique_descriptions = [d for d in desc_to_resources if d not in verdicts]
+
+    # The learned classifier settles what it's confident about, in-process
+    learned = {}
+    model = get_relevance_model()
+    if model is not None and unique_descriptions:
+        learned = model.classify(
+            condition, drug, rtype, unique_descriptions, settings.relevance_model_confidence
         )
+        verdicts.update(learned)
+        unique_descriptions = [d for d in unique_descriptions if d not in learned]
+
+    # Near-duplicates of descriptions we already have verdicts for can reuse them
+    similarity = get_similarity_index()
+    similarity_scope = (normalize(condition), normalize(drug), rtype, PROMPT_VERSION)
+    similarity.add(similarity_scope, cached)
+    near = {}
+    applied = 0     # near matches whose verdict was reused rather than audited
+    if unique_descriptions and settings.classify_similarity_threshold > 0:
+        near = similarity.match(
+            similarity_scope, unique_descriptions, settings.classify_similarity_threshold
+        )
+        audit = " [audit: still classifying]" if settings.classify_similarity_audit else ""
+        for desc, (known, _, score) in near.items():
+            log.info("Near-duplicate %s description %r ~ %r (%.2f)%s",
+                     rtype, desc, known, score, audit)
+        if not settings.classify_similarity_audit:
+            for desc, (known, verdict, score) in near.items():
+                verdicts[desc] = Verdict(
+                    verdict.relevant,
+                    f"Near-duplicate of {known!r} ({score:.2f}): {verdict.reasoning}",
+                )
+            unique_descriptions = [d for d in unique_descriptions if d not in near]
+            applied = len(near)
+
+    log.info("Classifying %d unique %s descriptions "
+             "(from %d resources, %d cached, %d learned, %d near-duplicate)",
+             len(unique_descriptions), rtype, len(ambiguous),
+             len(desc_to_resources) - len(unique_descriptions) - len(learned) - applied,
+             len(learned), applied)
+
+    if unique_descriptions:
+        # Requests for the same condition/drug/type arriving together share one call
+        key = (normalize(condition), normalize(drug), rtype)
+        # This patient's slot is held while waiting; the shared call's chunks
+        # run under a semaphore of their own, so no caller waits on another's
+        async with semaphore:
+            fresh = await _coalescer.submit(
+                key,
+                unique_descriptions,
+                lambda descriptions: _classify_misses(
+                    asyncio.Semaphore(settings.classify_max_concurrency),
+                    rtype, descriptions, condition, drug,
+                ),
+            )
+        similarity.add(similarity_scope, fresh)
+        verdicts.update(fresh)
+
+        for desc, (known, guess, score) in near.items():
+            if desc in fresh and fresh[desc].relevant != guess.relevant:
+                log.warning("Near-duplicate audit: %r ~ %r (%.2f) disagreed with Gemini",
+                            desc, known, score)
+
+    for desc, verdict in verdicts.items():
+        if verdict.relevant:
+            relevant.extend(desc_to_resources[desc])
+    return relevant
 
-        result = BatchClassification.model_validate_json(response.text)
 
-        relevant_ids = {c.id for c in result.classifications if c.relevant}
-        for idx_str in relevant_ids:
-            try:
-                idx = int(idx_str)
-                desc = unique_descriptions[idx]
-                relevant.extend(desc_to_resources[desc])
-            except (ValueError, IndexError):
-                continue
+async def classify_relevance(resources, condition, drug):
+    relevant = []
+    clinical_batches = {}
 
+    for r in resources:
+        rtype = r.resource_type
+        if rtype == "Patient":
+            relevant.append(r)
+        elif rtype in CLINICAL_TYPES:
+            clinical_batches.setdefault(rtype, []).append(r)
+
+    # Resource types (and the chunks within them) are all in flight at once;
+    # the semaphore keeps a single patient from monopolising our Gemini quota.
+    index = get_terminology_index()
+    scope = index.scope(condition, drug) if index is not None else None
+    if scope is not None:
+        log.info("Terminology scope for %s / %s: %s", condition, drug, scope.names or "none")
+
+    semaphore = asyncio.Semaphore(settings.classify_max_concurrency)
+    results = await asyncio.gather(*(
+        _classify_batch(semaphore, rtype, batch, condition, drug, scope)
+        for rtype, batch in clinical_batches.items()
+    ))
+
+    for batch_relevant in results:
+        relevant.extend(batch_relevant)
     return relevant
 
-def to_natural_language(resources):
+class SummaryLine(NamedTuple):
+    resource_type: str
+    date: str | None
+    text: str
+    line_id: str = ""
+    sources: tuple = ()     # FhirRecords the line was written from
+    id_key: str = ""        # what the line ID is derived from, if not its first source
+
+
+class SummaryBudget(NamedTuple):
+    tokens: int
+    lines_dropped: int
+    tokens_dropped: int
+
+
+def _line_id(line):
+    """Short ID from the line's source resource, so it's the same every run."""
+    key = line.id_key
+    if not key:
+        source = next((r for r in line.sources if r.id), None)
+        key = f"{source.resource_type}/{source.id}" if source else line.text
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+
+
+def _with_line_ids(lines):
+    seen = {}
+    out = []
+    for line in lines:
+        base = _line_id(line)
+        # The same resource written into two lines keeps both, suffixed
+        seen[base] = seen.get(base, 0) + 1
+        line_id = base if seen[base] == 1 else f"{base}-{seen[base]}"
+        out.append(line._replace(line_id=line_id))
+    return out
+
+
+def render_line(line):
+    return f"[{line.line_id}] {line.text}" if line.line_id else line.text
+
+
+def render_summary(lines):
+    return "\n".join(render_line(line) for line in lines)
+
+
+def citation_index(lines):
+    """{line ID: [[resource type, id], ...]} for validating and resolving citations.
+
+    Only references, so the index stays small in the records-classified
+    message; cited_resources resolves them against the stored bundle.
+    """
+    return {
+        line.line_id: [[r.resource_type, r.id] for r in line.sources if r.id]
+        for line in lines if line.line_id
+    }
+
+
+_CITED_ID = re.compile(r"^\[?([0-9a-f]{8}(?:-\d+)?)(?:\]|$)")
+
+
+def resolve_citations(index, cited):
+    """(valid line IDs, [(line ID, resource type, id)]) for the IDs an answer cited.
+
+    Each lookup is one dict probe into the request's citation_index.
+    Anything that isn't a line ID from this summary is dropped.
+    """
+    ids = []
+    refs = []
+    for value in cited:
+        m = _CITED_ID.match(value.strip())
+        line_id = m.group(1) if m else None
+        if line_id not in index or line_id in ids:
+            continue
+        ids.append(line_id)
+        refs.extend((line_id, rtype, rid) for rtype, rid in index[line_id])
+    return ids, refs
+
+
+def cited_resources(refs, resources):
+    """The stored FHIR resources for resolve_citations' refs, tagged with the citing line ID.
+
+    resources is {(resourceType, id): resource dict}, as read_bundle_resources
+    returns; refs it doesn't hold are skipped.
+    """
+    return [
+        {"line_id": line_id, "resource_type": rtype, "id": rid,
+         "resource": resources[(rtype, rid)]}
+        for line_id, rtype, rid in refs if (rtype, rid) in resources
+    ]
+
+
+def summary_lines(records):
+    """One SummaryLine per relevant record, with lab series collapsed and stable line IDs."""
+    # Repeated draws of the same lab collapse into one series summary, written
+    # where the series first appears.
+    series = {}
+    for record in records:
+        if record.resource_type == "Observation":
+            series.setdefault(series_key(record), []).append(record)
+    series_lines = {}
+    for key, members in series.items():
+        summary = summarize_series(members, settings.lab_series_min_points)
+        if summary is not None:
+            series_lines[key] = summary
+
     lines = []
-    for resource in resources:
-        rtype = resource["resourceType"]
+    for record in records:
+        rtype = record.resource_type
+
+        if rtype == "Observation" and series_lines:
+            key = series_key(record)
+            if key in series_lines:
+                # Emitted once, then None so the rest of the series is skipped.
+                # The series line cites every draw and takes its ID from the
+                # series, so a new draw doesn't change it; a crossing cites
+                # and is named after the draw that crossed.
+                summary = series_lines[key] or ()
+                for i, (date, text, sources) in enumerate(summary):
+                    id_key = f"series/{key[0]}/{key[1]}" if i == 0 else ""
+                    lines.append(SummaryLine(rtype, date, text, sources=sources, id_key=id_key))
+                series_lines[key] = None
+                continue
 
         if rtype == "Patient":
-            name = resource.get("name", [{}])[0]
-            given = " ".join(name.get("given", []))
-            family = name.get("family", "")
-            birth = resource.get("birthDate", "unknown")
-            gender = resource.get("gender", "unknown")
-            lines.append(f"Patient: {given} {family}, born {birth}, {gender}.")
+            birth = record.birth_date or "unknown"
+            gender = record.gender or "unknown"
+            text = f"Patient: {record.given} {record.family}, born {birth}, {gender}."
 
         elif rtype == "Condition":
-            display = resource.get("code", {}).get("text", "Unknown condition")
-            onset = resource.get("onsetDateTime", "unknown date")
-            lines.append(f"Diagnosis: {display}, onset {onset}.")
+            display = record.description or "Unknown condition"
+            onset = record.date or "unknown date"
+            text = f"Diagnosis: {display}, onset {onset}."
 
         elif rtype == "Observation":
-            display = resource.get("code", {}).get("text", "Unknown observation")
-            value = resource.get("valueQuantity", {})
-            val = value.get("value", "?")
-            unit = value.get("unit", "")
-            date = resource.get("effectiveDateTime", "unknown date")
-            lines.append(f"Lab result: {display}: {val} {unit} (recorded {date}).")
+            display = record.description or "Unknown observation"
+            val = "?" if record.value is None else record.value
+            unit = record.unit or ""
+            date = record.date or "unknown date"
+            text = f"Lab result: {display}: {val} {unit} (recorded {date})."
 
         elif rtype == "MedicationRequest":
-            med = resource.get("medicationCodeableConcept", {})
-            display = med.get("text", "Unknown medication")
-            status = resource.get("status", "unknown")
-            authored = resource.get("authoredOn", "unknown date")
-            lines.append(f"Medication: {display}, status: {status} (prescribed {authored}).")
+            display = record.description or "Unknown medication"
+            status = record.status or "unknown"
+            authored = record.date or "unknown date"
+            text = f"Medication: {display}, status: {status} (prescribed {authored})."
+
+        elif record.description:
+            text = f"{rtype}: {record.description}."
 
         else:
-            display = resource.get("code", {}).get("text", "")
-            if display:
-                lines.append(f"{rtype}: {display}.")
+            continue
 
-    return "\n".join(lines)
\ No newline at end of file
+        lines.append(SummaryLine(rtype, record.date, text, sources=(record,)))
+
+    return _with_line_ids(lines)
+
+
+def to_natural_language(records):
+    return render_summary(summary_lines(records))
+
+
+# Lower ranks are dropped first when a summary is over budget. The Patient
+# line is never dropped.
+_DROP_RANK = {
+    "Procedure": 0,
+    "DiagnosticReport": 0,
+    "CarePlan": 0,
+    "Observation": 1,
+    "MedicationRequest": 2,
+    "AllergyIntolerance": 2,
+    "Condition": 3,
+}
+
+
+def _line_tokens(line):
+    return estimate_tokens(render_line(line)) + 1     # + the newline
+
+
+def _compress_repeats(lines):
+    """Merge identical lines (Synthea repeats many undated procedures) into one."""
+    counts = {}
+    for line in lines:
+        counts[line.text] = counts.get(line.text, 0) + 1
+
+    compressed = []
+    latest = {}
+    for line in lines:
+        if counts[line.text] == 1:
+            compressed.append(line)
+        elif line.text not in latest:
+            # The merged line keeps the first copy's ID and cites every copy
+            latest[line.text] = len(compressed)
+            text = f"{line.text[:-1]} (recorded {counts[line.text]} times)."
+            compressed.append(line._replace(text=text))
+        else:
+            i = latest[line.text]
+            merged = compressed[i]._replace(sources=compressed[i].sources + line.sources)
+            if (line.date or "") > (merged.date or ""):
+                merged = merged._replace(date=line.date)
+            compressed[i] = merged
+    return compressed
+
+
+def fit_summary_to_budget(lines, budget):
+    """Trim summary lines to fit budget tokens, lowest priority and oldest first.
+
+    Returns the kept lines, in their original order, and a SummaryBudget
+    describing how much had to go.
+    """
+    original_tokens = sum(_line_tokens(line) for line in lines)
+    if original_tokens <= budget:
+        return lines, SummaryBudget(original_tokens, 0, 0)
+
+    kept = _compress_repeats(lines)
+    costs = [_line_tokens(line) for line in kept]
+    total = sum(costs)
+
+    candidates = sorted(
+        (i for i, line in enumerate(kept) if line.resource_type != "Patient"),
+        key=lambda i: (_DROP_RANK.get(kept[i].resource_type, 0), kept[i].date or ""),
+    )
+    dropped = set()
+    for i in candidates:
+        if total <= budget:
+            break
+        dropped.add(i)
+        total -= costs[i]
+
+    kept = [line for i, line in enumerate(kept) if i not in dropped]
+    return kept, SummaryBudget(total, len(lines) - len(kept), original_tokens - total)
@@ -0,0 +1,242 @@
+"""FHIR REST client for the hospital EHR.
+
+A patient's chart is fetched as one search per resource type, limited to
+the Patient and CLINICAL_TYPES, so the EHR never sends claims,
+explanations of benefit or document references at all. The type searches
+run concurrently over one pooled HTTP/2 client, each following its own
+`next` links. Each page is decoded with run_cpu, its resources copied out
+as raw JSON rather than built as objects, and written to the bundle store
+on a thread, so a large chart doesn't stall the event loop while it
+downloads.
+
+Each page of a type's results is kept in the bundle store with its ETag.
+When the same patient is fetched again, every page is requested with
+If-None-Match, and a page that comes back 304 is reused without
+downloading it again. A page's ETag only vouches for that page: results
+can land on a later page while page 1 is unchanged. Where the server
+documents its first-page ETag as covering the whole result set, set
+FHIR_ETAG_SCOPE=search and a 304 on page 1 reuses the whole type in one
+request. The pages of every type are then copied into one collection
+bundle, and its ref is what the pipeline publishes. Page blobs that drop
+out of the ETag cache are left for the bundle store sweep (see
+subscribers.sweep_bundle_store).
+"""
+import asyncio
+import io
+import logging
+import tempfile
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple
+
+import httpx
+
+from .bundle_store import get_bundle_store
+from .db import settings
+from .fhir import CLINICAL_TYPES
+from .fhir_structs import read_search_page
+from .offload import run_cpu
+
+log = logging.getLogger(__name__)
+
+FETCH_TYPES = ("Patient", *sorted(CLINICAL_TYPES))
+
+
+class FhirFetchError(RuntimeError):
+    pass
+
+
+class FetchStats(NamedTuple):
+    bundle_ref: str
+    resources: int
+    requests: int
+    not_modified: int
+    bytes_downloaded: int
+    seconds: float
+
+
+class _Page(NamedTuple):
+    url: str
+    etag: str | None
+    ref: str
+    resources: int
+    next_url: str | None
+
+
+class FhirClient:
+    def __init__(self, base_url, client=None, page_size=None, max_concurrency=None,
+                 max_retries=None, etag_cache_size=None, etag_scope=None):
+        self.base_url = base_url.rstrip("/")
+        self.page_size = page_size or settings.fhir_page_size
+        self.max_concurrency = max_concurrency or settings.fhir_max_concurrency
+        self.max_retries = settings.fhir_max_retries if max_retries is None else max_retries
+        self.etag_cache_size = etag_cache_size or settings.fhir_etag_cache_size
+        self.etag_scope = etag_scope or settings.fhir_etag_scope
+        self.client = client or _create_http_client()
+        # (patient id, resource type) -> (_Page, ...) of the last fetch
+        self._validators = OrderedDict()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def cached_refs(self):
+        """Refs of the stored pages the ETag cache may reuse."""
+        return {page.ref for pages in self._validators.values() for page in pages}
+
+    async def _get(self, url, params=None, headers=None, counters=None):
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await self.client.get(url, params=params, headers=headers)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise FhirFetchError(f"GET {url} failed: {e}") from e
+            else:
+                counters["requests"] += 1
+                counters["bytes"] += response.num_bytes_downloaded
+                if response.status_code == 304 or response.is_success:
+                    return response
+                if response.status_code != 429 and response.status_code < 500:
+                    raise FhirFetchError(f"GET {url} returned {response.status_code}")
+                if attempt == self.max_retries:
+                    raise FhirFetchError(f"GET {url} returned {response.status_code}")
+            delay = 0.5 * 2 ** attempt
+            suggested = _retry_after(response) if response is not None else None
+            await asyncio.sleep(max(delay, suggested) if suggested is not None else delay)
+
+    async def _page(self, response, url):
+        """Store one search page's resources as NDJSON."""
+        ndjson, resources, next_url = await run_cpu(_parse_page, response.content)
+        ref = await asyncio.to_thread(_put, ndjson)
+        return _Page(url, response.headers.get("ETag"), ref, resources, next_url)
+
+    async def _search(self, semaphore, patient_id, rtype, counters):
+        """Every page of one type's search, each stored as NDJSON of resources."""
+        key = (patient_id, rtype)
+        cached_pages = self._validators.get(key, ())
+        by_url = {p.url: p for p in cached_pages if p.etag}
+        params = {"_id" if rtype == "Patient" else "patient": patient_id,
+                  "_count": self.page_size}
+
+        pages = []
+        async with semaphore:
+            url, page_params = f"{self.base_url}/{rtype}", params
+            while url is not None:
+                cached = by_url.get(url)
+                headers = {"If-None-Match": cached.etag} if cached else None
+                response = await self._get(url, page_params, headers, counters)
+                if response.status_code == 304:
+                    if cached is None:
+                        raise FhirFetchError(f"GET {url} returned 304 without If-None-Match")
+                    counters["not_modified"] += 1
+                    if self.etag_scope == "search" and not pages:
+                        # The server vouches that page 1's ETag covers every page
+                        self._validators.move_to_end(key)
+                        return cached_pages
+                    page = cached
+                else:
+                    page = await self._page(response, url)
+                pages.append(page)
+                url, page_params = page.next_url, None
+
+        pages = tuple(pages)
+        if any(p.etag for p in pages):
+            self._validators[key] = pages
+            self._validators.move_to_end(key)
+            while len(self._validators) > self.etag_cache_size:
+                self._validators.popitem(last=False)
+        return pages
+
+    async def fetch_patient(self, patient_id):
+        """Fetch the patient's clinical resources into the bundle store."""
+        started = time.perf_counter()
+        counters = {"requests": 0, "not_modified": 0, "bytes": 0}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(
+            self._search(semaphore, patient_id, rtype, counters) for rtype in FETCH_TYPES
+        ))
+        if not sum(p.resources for p in results[0]):
+            raise FhirFetchError(f"Patient {patient_id} not found on {self.base_url}")
+
+        pages = [page for type_pages in results for page in type_pages]
+        bundle_ref = await asyncio.to_thread(_write_bundle, [p.ref for p in pages])
+
+        return FetchStats(
+            bundle_ref=bundle_ref,
+            resources=sum(p.resources for p in pages),
+            requests=counters["requests"],
+            not_modified=counters["not_modified"],
+            bytes_downloaded=counters["bytes"],
+            seconds=time.perf_counter() - started,
+        )
+
+
+def _retry_after(response):
+    """Server-suggested wait in seconds from a Retry-After header, if any."""
+    header = response.headers.get("retry-after")
+    if not header:
+        return None
+    try:
+        return max(0.0, float(header))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_page(content):
+    """(NDJSON bytes, resources, next link) for a searchset page; CPU-bound, see offload."""
+    resources, next_url = read_search_page(content)
+    return b"".join(r + b"\n" for r in resources), len(resources), next_url
+
+
+def _put(data):
+    return get_bundle_store().put(io.BytesIO(data))
+
+
+def _write_bundle(page_refs):
+    """Store the resources of every page as one collection bundle. Returns its ref."""
+    store = get_bundle_store()
+    with tempfile.TemporaryFile() as out:
+        out.write(b'{"resourceType":"Bundle","type":"collection","entry":[')
+        first = True
+        for ref in page_refs:
+            with store.open(ref) as f:
+                ndjson = f.read().rstrip(b"\n")
+            if not ndjson:
+                continue
+            # One replace per page rather than a Python loop per resource, so
+            # the thread this runs on holds the GIL as little as possible
+            out.write(b'{"resource":' if first else b',{"resource":')
+            out.write(ndjson.replace(b"\n", b'},{"resource":'))
+            out.write(b"}")
+            first = False
+        out.write(b"]}")
+        out.seek(0)
+        return store.put(out)
+
+
+def _create_http_client():
+    headers = {"Accept": "application/fhir+json"}
+    if settings.fhir_access_token:
+        headers["Authorization"] = f"Bearer {settings.fhir_access_token}"
+    return httpx.AsyncClient(
+        http2=True,
+        headers=headers,
+        timeout=settings.fhir_timeout_seconds,
+        limits=httpx.Limits(max_connections=settings.fhir_max_connections),
+    )
+
+
+_instance = None
+
+
+def get_fhir_client():
+    """The shared client, or None when no FHIR server is configured."""
+    global _instance
+    if _instance is None and settings.fhir_base_url:
+        _instance = FhirClient(settings.fhir_base_url)
+    return _instance
@@ -0,0 +1,212 @@
+"""Typed msgspec schema for the slice of FHIR R4 the pipeline reads.
+
+Only the resource types in fhir.CLINICAL_TYPES plus Patient are modelled,
+and only the fields FhirRecord is built from. msgspec skips every other
+field while decoding, so narrative text, extensions and identifiers are
+never turned into Python objects, and there is nothing to pop afterwards.
+
+A bundle decodes with each entry's resource left as msgspec.Raw, a slice
+of the input. Its resourceType is read on its own, and only Patient and
+clinical resources are decoded into structs; claims, encounters and the
+rest stay raw bytes. Cited resources are looked up the same way, by
+type and id. The fetcher reads FHIR search pages the same way,
+copying each resource out as raw JSON.
+"""
+from typing import Union
+
+import msgspec
+from msgspec import Raw, Struct
+
+
+class Coding(Struct):
+    system: str = ""
+    code: str = ""
+
+
+class CodeableConcept(Struct):
+    text: str | None = None
+    coding: list[Coding] = []
+
+
+class Quantity(Struct):
+    value: int | float | None = None
+    unit: str | None = None
+
+
+class Period(Struct):
+    start: str | None = None
+
+
+class HumanName(Struct):
+    family: str = ""
+    given: list[str] = []
+
+
+class Meta(Struct):
+    versionId: str | None = None
+    lastUpdated: str | None = None
+
+
+class Resource(Struct, tag_field="resourceType"):
+    id: str | None = None
+    meta: Meta | None = None
+
+
+class Patient(Resource, tag=True):
+    name: list[HumanName] = []
+    birthDate: str | None = None
+    gender: str | None = None
+
+
+class Condition(Resource, tag=True):
+    code: CodeableConcept | None = None
+    category: list[CodeableConcept] = []
+    onsetDateTime: str | None = None
+    recordedDate: str | None = None
+
+
+class Observation(Resource, tag=True):
+    status: str | None = None
+    code: CodeableConcept | None = None
+    category: list[CodeableConcept] = []
+    valueQuantity: Quantity | None = None
+    effectiveDateTime: str | None = None
+    effectivePeriod: Period | None = None
+
+
+class MedicationRequest(Resource, tag=True):
+    status: str | None = None
+    medicationCodeableConcept: CodeableConcept | None = None
+    category: list[CodeableConcept] = []
+    authoredOn: str | None = None
+
+
+class Procedure(Resource, tag=True):
+    status: str | None = None
+    code: CodeableConcept | None = None
+    category: CodeableConcept | None = None     # 0..1 on Procedure, unlike the others
+    performedDateTime: str | None = None
+    performedPeriod: Period | None = None
+
+
+class DiagnosticReport(Resource, tag=True):
+    status: str | None = None
+    code: CodeableConcept | None = None
+    category: list[CodeableConcept] = []
+    effectiveDateTime: str | None = None
+    effectivePeriod: Period | None = None
+
+
+class CarePlan(Resource, tag=True):
+    status: str | None = None
+    category: list[CodeableConcept] = []
+    period: Period | None = None
+
+
+class AllergyIntolerance(Resource, tag=True):
+    code: CodeableConcept | None = None
+    category: list[str] = []                     # codes like "food", not CodeableConcepts
+    onsetDateTime: str | None = None
+    recordedDate: str | None = None
+
+
+RESOURCE_TYPES = (
+    Patient, Condition, Observation, MedicationRequest, Procedure,
+    DiagnosticReport, CarePlan, AllergyIntolerance,
+)
+DECODED_TYPES = frozenset(t.__name__ for t in RESOURCE_TYPES)
+
+
+class _Kind(Struct):
+    resourceType: str = ""
+
+
+class _Ref(Struct):
+    resourceType: str = ""
+    id: str | None = None
+
+
+class _Entry(Struct):
+    resource: Raw = Raw()       # empty when the entry has no resource
+
+
+class _Bundle(Struct):
+    entry: list[_Entry] = []
+
+
+class _Search(Struct):
+    mode: str | None = None
+
+
+class _SearchEntry(Struct):
+    resource: Raw = Raw()
+    search: _Search | None = None
+
+
+class _Link(Struct):
+    relation: str = ""
+    url: str = ""
+
+
+class _SearchPage(Struct):
+    entry: list[_SearchEntry] = []
+    link: list[_Link] = []
+
+
+_bundle_decoder = msgspec.json.Decoder(_Bundle)
+_search_page_decoder = msgspec.json.Decoder(_SearchPage)
+_kind_decoder = msgspec.json.Decoder(_Kind)
+_ref_decoder = msgspec.json.Decoder(_Ref)
+_resource_decoder = msgspec.json.Decoder(Union[RESOURCE_TYPES])
+
+
+def decode_resource(data):
+    """A Patient or clinical resource struct from JSON, or None for any other type."""
+    if _kind_decoder.decode(data).resourceType not in DECODED_TYPES:
+        return None
+    return _resource_decoder.decode(data)
+
+
+def iter_bundle_structs(data):
+    """Patient and clinical resource structs from a Bundle's JSON, in bundle order.
+
+    data is any bytes-like object, e.g. an mmap of the bundle file.
+    """
+    for entry in _bundle_decoder.decode(data).entry:
+        if entry.resource:
+            resource = decode_resource(entry.resource)
+            if resource is not None:
+                yield resource
+
+
+def find_bundle_resources(data, wanted):
+    """{(resourceType, id): resource JSON as a dict} for the wanted entries of a Bundle.
+
+    Only each entry's type and id are read; the full resource is decoded
+    for the wanted ones alone.
+    """
+    found = {}
+    for entry in _bundle_decoder.decode(data).entry:
+        if not entry.resource:
+            continue
+        ref = _ref_decoder.decode(entry.resource)
+        key = (ref.resourceType, ref.id)
+        if key in wanted and key not in found:
+            found[key] = msgspec.json.decode(entry.resource)
+    return found
+
+
+def read_search_page(data):
+    """(compact JSON of each matched resource, next link or None) for a searchset page.
+
+    Resources are copied out as raw bytes with the whitespace stripped,
+    never built as Python objects; OperationOutcome entries are skipped.
+    """
+    page = _search_page_decoder.decode(data)
+    resources = [
+        msgspec.json.format(entry.resource, indent=-1)
+        for entry in page.entry
+        if entry.resource and (entry.search is None or entry.search.mode != "outcome")
+    ]
+    next_url = next((link.url for link in page.link if link.relation == "next"), None)
+    return resources, next_url
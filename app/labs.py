@@ -0,0 +1,112 @@
+"""Collapse repeated lab draws into one summary per series.
+
+A CKD patient can have dozens of eGFR and creatinine results; writing every
+one into the patient summary buries the signal and gets re-sent with every
+question. Each (code, unit) series is reduced to its count, first and
+latest values, range and trend. Individual results are only kept where the
+series crosses a clinically meaningful threshold.
+"""
+import numpy as np
+
+# Decision points per LOINC code. Crossing any of these is worth keeping
+# as a dated individual result.
+THRESHOLDS = {
+    "loinc|33914-3": (15.0, 30.0, 45.0, 60.0, 90.0),    # eGFR, CKD stage boundaries
+    "loinc|2160-0": (1.3, 2.0, 4.0),                    # creatinine, serum
+    "loinc|38483-4": (1.3, 2.0, 4.0),                   # creatinine, blood
+    "loinc|2823-3": (3.5, 5.5),                         # potassium, serum
+    "loinc|6298-4": (3.5, 5.5),                         # potassium, blood
+    "loinc|14959-1": (30.0, 300.0),                     # urine microalbumin
+    "loinc|4548-4": (5.7, 6.5, 8.0, 10.0),              # HbA1c
+    "loinc|2339-0": (100.0, 126.0, 200.0),              # glucose, blood
+    "loinc|2345-7": (100.0, 126.0, 200.0),              # glucose, serum
+    "loinc|1988-5": (3.0, 10.0),                        # C-reactive protein
+    "loinc|30341-2": (20.0, 30.0),                      # ESR
+    "loinc|4537-7": (20.0, 30.0),                       # ESR
+    "loinc|39156-5": (25.0, 30.0, 35.0, 40.0),          # BMI
+    "loinc|718-7": (8.0, 10.0, 12.0),                   # hemoglobin
+}
+
+_SECONDS_PER_YEAR = 365.25 * 24 * 3600
+
+
+def series_key(record):
+    """Group by the first real code (falling back to the description) and unit."""
+    code = next((c for c in record.codes if not c.startswith("obs-category|")), None)
+    return (code or record.description, record.unit)
+
+
+def _fmt(value):
+    return f"{value:g}"
+
+
+def _timestamp(date):
+    if not date:
+        return np.datetime64("NaT")
+    # Synthea timestamps carry a UTC offset, which datetime64 won't parse;
+    # the wall-clock part is plenty for a trend measured in years.
+    return np.datetime64(date[:19], "s")
+
+
+def summarize_series(records, min_points):
+    """(date, text, source records) lines for one lab series, or None to keep the results.
+
+    The series line's sources are every draw in it; a threshold crossing's
+    source is the one draw that crossed.
+    """
+    numeric = [r for r in records if isinstance(r.value, (int, float))]
+    if len(numeric) < min_points or len(numeric) != len(records):
+        return None
+
+    values = np.fromiter((r.value for r in numeric), dtype=np.float64, count=len(numeric))
+    times = np.array([_timestamp(r.date) for r in numeric], dtype="datetime64[s]")
+
+    # Undated results count towards the total and range, but can't be placed
+    # in time: they're left out of first/latest, the trend and crossings.
+    # argsort puts NaT last, so they're dropped from the end.
+    order = np.argsort(times, kind="stable")
+    n_dated = int(np.count_nonzero(~np.isnat(times)))
+    undated = len(numeric) - n_dated
+    all_values = values
+    if n_dated:
+        order = order[:n_dated]
+    values = values[order]
+    times = times[order]
+    ordered = [numeric[i] for i in order]
+
+    first, latest = ordered[0], ordered[-1]
+    display = first.description or "Unknown observation"
+    unit = first.unit or ""
+    unit_suffix = f" {unit}" if unit else ""
+    unit_label = f" ({unit})" if unit else ""
+
+    summary = (
+        f"Lab series: {display}{unit_label}: {len(all_values)} results"
+        f"{f' ({undated} undated)' if undated else ''}; "
+        f"first {_fmt(values[0])} ({first.date or 'unknown date'}), "
+        f"latest {_fmt(values[-1])} ({latest.date or 'unknown date'}), "
+        f"range {_fmt(all_values.min())}-{_fmt(all_values.max())}"
+    )
+    if n_dated >= 2:
+        years = (times - times[0]).astype(np.float64) / _SECONDS_PER_YEAR
+        if np.ptp(years) > 0:
+            slope = np.polyfit(years, values, 1)[0]
+            summary += f", trend {slope:+.2f}{unit_suffix}/year"
+    lines = [(latest.date, summary + ".", tuple(numeric))]
+
+    thresholds = THRESHOLDS.get(series_key(first)[0])
+    if thresholds and n_dated:
+        limits = np.asarray(thresholds)
+        # Which band each result falls in; a band change is a crossing
+        bands = np.searchsorted(limits, values, side="right")
+        for i in np.flatnonzero(np.diff(bands)) + 1:
+            rose = bands[i] > bands[i - 1]
+            limit = limits[bands[i] - 1] if rose else limits[bands[i]]
+            record = ordered[i]
+            lines.append((record.date, (
+                f"Lab result: {display}: {_fmt(values[i])}{unit_suffix} "
+                f"(recorded {record.date or 'unknown date'}), "
+                f"{'rose above' if rose else 'fell below'} {_fmt(limit)}."
+            ), (record,)))
+
+    return lines
@@ -0,0 +1,268 @@
+"""Process-wide gateway for Gemini calls.
+
+Classification and question answering share one long-lived client and one
+view of our quota:
+
+- a token bucket each for requests and tokens per minute, so we run right
+  at the quota instead of finding it with 429s;
+- AIMD concurrency: the in-flight limit grows by about one per window of
+  healthy calls and is cut on 429s or when latency passes the target;
+- jittered exponential retry for 429, 5xx and transport errors, waiting at
+  least as long as the server's Retry-After;
+- admission in priority order, so interactive pipeline work goes ahead of
+  background jobs waiting for the same quota.
+
+Mark background work with `with background():`; everything else is
+interactive.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from google import genai
+from google.genai import errors
+
+from .db import settings
+from .tokens import estimate_tokens
+
+log = logging.getLogger(__name__)
+
+MODEL = "gemini-2.5-flash"
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def at_priority(priority):
+    """Gemini calls made inside this block queue at priority."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def background():
+    """Gemini calls made inside this block queue behind interactive ones."""
+    return at_priority(BACKGROUND)
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute, holding at most one minute's worth."""
+
+    def __init__(self, rate_per_minute, clock=time.monotonic):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.clock = clock
+        self.level = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until amount can be taken (0 if now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        """Spend amount; may go negative when correcting an underestimate."""
+        self._refill()
+        self.level -= amount
+
+
+class AIMDLimiter:
+    """Additive-increase, multiplicative-decrease limit on calls in flight."""
+
+    def __init__(self, initial, minimum, maximum, target_latency,
+                 backoff=0.5, latency_backoff=0.9):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+
+    def on_success(self, latency):
+        if latency > self.target_latency:
+            self.limit = max(self.minimum, self.limit * self.latency_backoff)
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        self.limit = max(self.minimum, self.limit * self.backoff)
+
+
+_RETRY_DELAY = re.compile(r"^([\d.]+)s$")
+
+
+def _retry_after(error):
+    """Server-suggested wait in seconds from a Retry-After header or RetryInfo, if any."""
+    response = getattr(error, "response", None)
+    header = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            m = _RETRY_DELAY.match(str(detail.get("retryDelay", "")))
+            if m:
+                return float(m.group(1))
+    return None
+
+
+def _retryable(error):
+    if isinstance(error, errors.APIError):
+        return error.code == 429 or (error.code or 0) >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class LLMGateway:
+    def __init__(self, client, requests_per_minute, tokens_per_minute, limiter,
+                 max_retries=4, retry_base_seconds=0.5, retry_max_seconds=30.0):
+        self.client = client
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.in_flight = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+
+    async def _admit(self, priority, tokens):
+        """Wait for our turn, a concurrency slot and quota, in priority order."""
+        key = (priority, next(self._seq))
+        async with self._cond:
+            heapq.heappush(self._waiting, key)
+            try:
+                while True:
+                    if self._waiting[0] == key and self.in_flight < int(self.limiter.limit):
+                        wait = max(self.requests.delay(1), self.tokens.delay(tokens))
+                        if wait == 0:
+                            heapq.heappop(self._waiting)
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            self.in_flight += 1
+                            self._cond.notify_all()
+                            return
+                        try:
+                            await asyncio.wait_for(self._cond.wait(), wait)
+                        except asyncio.TimeoutError:
+                            pass
+                    else:
+                        await self._cond.wait()
+            except BaseException:
+                if key in self._waiting:
+                    self._waiting.remove(key)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    async def _release(self, latency=None, throttled=False):
+        async with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limiter.on_throttle()
+            elif latency is not None:
+                self.limiter.on_success(latency)
+            self._cond.notify_all()
+
+    def _backoff(self, attempt, error):
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)    # jitter so retries don't arrive together
+        suggested = _retry_after(error)
+        return max(delay, suggested) if suggested is not None else delay
+
+    async def generate(self, contents, config, expected_output_tokens=0, observe=None, model=MODEL):
+        """client.aio.models.generate_content under the shared quota, with retries.
+
+        observe, if given, is called with the successful call's own latency,
+        excluding time spent queued for quota.
+        """
+        priority = _priority.get()
+        estimate = estimate_tokens(contents) + expected_output_tokens
+
+        for attempt in range(self.max_retries + 1):
+            await self._admit(priority, estimate)
+            start = time.monotonic()
+            try:
+                response = await self.client.aio.models.generate_content(
+                    model=model, contents=contents, config=config,
+                )
+            except Exception as e:
+                throttled = isinstance(e, errors.APIError) and e.code == 429
+                await self._release(throttled=throttled)
+                if not _retryable(e) or attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                log.warning("Gemini call failed (%s), retry %d/%d in %.1fs; limit now %.1f",
+                            e, attempt + 1, self.max_retries, delay, self.limiter.limit)
+                await asyncio.sleep(delay)
+                continue
+
+            latency = time.monotonic() - start
+            await self._release(latency=latency)
+            if observe is not None:
+                observe(latency)
+            usage = getattr(response, "usage_metadata", None)
+            actual = getattr(usage, "total_token_count", None)
+            if isinstance(actual, int):
+                # Charge what the call really used, not our estimate
+                self.tokens.take(actual - estimate)
+            return response
+
+
+def create_gateway(client=None):
+    """A gateway configured from settings, around client or a new genai.Client."""
+    if client is None:
+        # GEMINI_BASE_URL points the SDK somewhere else, e.g. tests/fake_gemini.py
+        http_options = {"base_url": settings.gemini_base_url} if settings.gemini_base_url else None
+        client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options=http_options)
+    return LLMGateway(
+        client,
+        requests_per_minute=settings.llm_requests_per_minute,
+        tokens_per_minute=settings.llm_tokens_per_minute,
+        limiter=AIMDLimiter(
+            initial=settings.llm_initial_concurrency,
+            minimum=settings.llm_min_concurrency,
+            maximum=settings.llm_max_concurrency,
+            target_latency=settings.llm_target_latency_seconds,
+        ),
+        max_retries=settings.llm_max_retries,
+        retry_base_seconds=settings.llm_retry_base_seconds,
+        retry_max_seconds=settings.llm_retry_max_seconds,
+    )
+
+
+_instance = None
+
+
+def get_gateway():
+    global _instance
+    if _instance is None:
+        _instance = create_gateway()
+    return _instance
@@ -0,0 +1,194 @@
+"""Local multi-patient EHR for development and load testing.
+
+Stands in for the hospital EHR with thousands of distinct patients instead
+of one sample bundle. Resources live in a single NDJSON data file, one per
+line, laid out so each patient's resources of one type are contiguous. A
+JSON index next to it maps every patient to the byte range and count of
+each of its types.
+
+The data file is read through mmap: serving a patient copies out just their
+slice, for just the types asked for, without parsing anyone else's
+resources or reading the file into memory. Cases without a patient ID are
+spread over the patients by case ID, so a load test with N cases sees
+min(N, patients) distinct charts.
+
+    python -m app.local_ehr data/ehr/patients.ndjson data/*.json
+    LOCAL_EHR_PATH=data/ehr/patients.ndjson uvicorn app.main:app
+
+benchmarks/local_ehr.py builds a store of synthetic patients.
+"""
+import argparse
+import io
+import json
+import logging
+import mmap
+import os
+import tempfile
+from pathlib import Path
+
+from .bundle_store import get_bundle_store
+from .db import settings
+from .fhir_client import FETCH_TYPES
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+class PatientNotFound(LookupError):
+    pass
+
+
+def index_path(data_path):
+    """patients.ndjson -> patients.idx.json"""
+    data_path = Path(data_path)
+    return data_path.with_name(f"{data_path.stem}.idx.json")
+
+
+def build_ehr(patients, data_path):
+    """Write a store from (patient id, resources) pairs. Returns the number of patients.
+
+    Resources are dicts; a patient's Patient resource, if any, is among them.
+    """
+    data_path = Path(data_path)
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    index = {}
+    fd, tmp = tempfile.mkstemp(dir=data_path.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for patient_id, resources in patients:
+                by_type = {}
+                for resource in resources:
+                    by_type.setdefault(resource["resourceType"], []).append(resource)
+                ranges = index.setdefault(patient_id, {})
+                for rtype, group in sorted(by_type.items()):
+                    start = out.tell()
+                    for resource in group:
+                        out.write(json.dumps(resource, separators=(",", ":")).encode("utf-8"))
+                        out.write(b"\n")
+                    ranges[rtype] = [start, out.tell(), len(group)]
+            size = out.tell()
+        os.replace(tmp, data_path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    index_path(data_path).write_text(json.dumps(
+        {"version": INDEX_VERSION, "data_bytes": size, "patients": index},
+        separators=(",", ":"),
+    ))
+    log.info("Local EHR: wrote %d patients (%d bytes) to %s", len(index), size, data_path)
+    return len(index)
+
+
+class LocalEhr:
+    """Per-patient, per-type slices of an NDJSON store, read through mmap."""
+
+    def __init__(self, data_path):
+        self.data_path = Path(data_path)
+        index = json.loads(index_path(self.data_path).read_text())
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported local EHR index version in {index_path(self.data_path)}")
+        size = self.data_path.stat().st_size
+        if index["data_bytes"] != size:
+            raise ValueError(f"Index for {self.data_path} is stale: "
+                             f"it covers {index['data_bytes']} bytes, the file has {size}")
+        self._index = index["patients"]
+        self.patient_ids = list(self._index)
+        with open(self.data_path, "rb") as f:
+            # An empty store can't be mapped; there's nothing to read from it anyway
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __contains__(self, patient_id):
+        return patient_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def patient_for_case(self, case_id):
+        """The patient a case without a patient ID is served from."""
+        if not self.patient_ids:
+            raise PatientNotFound(f"No patients in {self.data_path}")
+        return self.patient_ids[int(case_id) % len(self.patient_ids)]
+
+    def _ranges(self, patient_id):
+        try:
+            return self._index[patient_id]
+        except KeyError:
+            raise PatientNotFound(patient_id) from None
+
+    def counts(self, patient_id):
+        """{resource type: resources} for a patient."""
+        return {rtype: n for rtype, (_, _, n) in self._ranges(patient_id).items()}
+
+    def raw_resources(self, patient_id, rtype):
+        """A patient's resources of one type as NDJSON bytes, straight from the mapping."""
+        start, end, _ = self._ranges(patient_id).get(rtype, (0, 0, 0))
+        return self._data[start:end]
+
+    def resources(self, patient_id, rtype):
+        """A patient's resources of one type as dicts."""
+        return [json.loads(line) for line in self.raw_resources(patient_id, rtype).splitlines()]
+
+    def write_bundle(self, patient_id, out, types=FETCH_TYPES):
+        """Write a patient's resources of the given types as a collection bundle, Patient first.
+
+        Returns the number of resources written.
+        """
+        self._ranges(patient_id)        # PatientNotFound before anything is written
+        out.write(b'{"resourceType":"Bundle","type":"collection","entry":[')
+        written = 0
+        for rtype in types:
+            for line in self.raw_resources(patient_id, rtype).splitlines():
+                out.write(b'{"resource":' if not written else b',{"resource":')
+                out.write(line)
+                out.write(b"}")
+                written += 1
+        out.write(b"]}")
+        return written
+
+    def put_bundle(self, patient_id, types=FETCH_TYPES):
+        """Store a patient's bundle in the bundle store. Returns its ref."""
+        buf = io.BytesIO()
+        resources = self.write_bundle(patient_id, buf, types)
+        buf.seek(0)
+        ref = get_bundle_store().put(buf)
+        log.info("Local EHR: %d resources for patient %s", resources, patient_id)
+        return ref
+
+
+_instance = None
+
+
+def get_local_ehr():
+    """The store at LOCAL_EHR_PATH, or None when it's unset."""
+    global _instance
+    if _instance is None and settings.local_ehr_path:
+        _instance = LocalEhr(settings.local_ehr_path)
+    return _instance
+
+
+def _patients_from_bundles(paths):
+    for path in paths:
+        resources = [e["resource"] for e in json.loads(Path(path).read_text())["entry"]
+                     if "resource" in e]
+        [patient] = [r for r in resources if r["resourceType"] == "Patient"]
+        yield patient["id"], resources
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Build a local EHR store from one-patient bundles.")
+    parser.add_argument("out", type=Path, help="NDJSON data file; the index is written beside it")
+    parser.add_argument("bundles", nargs="+", type=Path)
+    args = parser.parse_args()
+
+    patients = build_ehr(_patients_from_bundles(args.bundles), args.out)
+    print(f"Wrote {patients} patients to {args.out} (index {index_path(args.out)})")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    _main()
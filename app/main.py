@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
@@ -7,7 +8,9 @@ from fastapi.responses import JSONResponse
 from .auth import require_api_key
 from .routers import intakes, cases, notes, documents, internal
 from .routers import prior_auth
-from .subscribers import setup_pipeline
+from .db import settings
+from .subscribers import setup_pipeline, sweep_bundle_store_periodically
+from . import offload
 
 logging.basicConfig(level=logging.INFO)
 
@@ -18,7 +21,13 @@ log = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     setup_pipeline()
+    sweeper = None
+    if settings.bundle_store_sweep_minutes:
+        sweeper = asyncio.create_task(sweep_bundle_store_periodically())
     yield
+    if sweeper is not None:
+        sweeper.cancel()
+    offload.shutdown()
 
 
 app = FastAPI(
@@ -2,7 +2,7 @@ import enum
 from datetime import datetime
 from typing import Optional, List
 
-from sqlalchemy import DateTime, ForeignKey, String, Text, Float, JSON
+from sqlalchemy import Boolean, DateTime, ForeignKey, String, Text, Float, JSON, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
@@ -28,6 +28,8 @@ class PriorAuthRequest(Base):
     condition: Mapped[str] = mapped_column(String(500))
     drug: Mapped[str] = mapped_column(String(500))
     questions: Mapped[dict] = mapped_column(JSON)
+    # The patient's logical id on the hospital FHIR server
+    patient_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
     status: Mapped[str] = mapped_column(
         String(32),
         default=PriorAuthStatus.ACCEPTED.value,
@@ -37,6 +39,9 @@ class PriorAuthRequest(Base):
     total_records_fetched: Mapped[int | None] = mapped_column(nullable=True)
     relevant_records_count: Mapped[int | None] = mapped_column(nullable=True)
     patient_summary: Mapped[str | None] = mapped_column(Text, nullable=True)
+    summary_tokens: Mapped[int | None] = mapped_column(nullable=True)
+    summary_lines_dropped: Mapped[int | None] = mapped_column(nullable=True)
+    summary_tokens_dropped: Mapped[int | None] = mapped_column(nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=utcnow
     )
@@ -60,9 +65,85 @@ class PriorAuthAnswer(Base):
     question: Mapped[str] = mapped_column(Text)
     answer: Mapped[str] = mapped_column(Text)
     supporting_record_ids: Mapped[dict] = mapped_column(JSON)
+    # The resources behind supporting_record_ids, resolved when the answer was saved
+    cited_resources: Mapped[list | None] = mapped_column(JSON, nullable=True)
     confidence: Mapped[float | None] = mapped_column(Float, nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=utcnow
     )
 
-    request: Mapped["PriorAuthRequest"] = relationship(back_populates="answers")
\ No newline at end of file
+    request: Mapped["PriorAuthRequest"] = relationship(back_populates="answers")
+
+
+class ClassificationCacheEntry(Base):
+    __tablename__ = "classification_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    condition: Mapped[str] = mapped_column(String(500))
+    drug: Mapped[str] = mapped_column(String(500))
+    resource_type: Mapped[str] = mapped_column(String(64))
+    description: Mapped[str] = mapped_column(Text)
+    prompt_version: Mapped[str] = mapped_column(String(16))
+    relevant: Mapped[bool] = mapped_column(Boolean)
+    reasoning: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow
+    )
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), index=True
+    )
+
+
+class RelevanceCorrection(Base):
+    __tablename__ = "relevance_corrections"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    request_id: Mapped[int] = mapped_column(
+        ForeignKey("prior_auth_requests.id", ondelete="CASCADE"), index=True
+    )
+    condition: Mapped[str] = mapped_column(String(500))
+    drug: Mapped[str] = mapped_column(String(500))
+    resource_type: Mapped[str] = mapped_column(String(64))
+    resource_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    description: Mapped[str] = mapped_column(Text)
+    relevant: Mapped[bool] = mapped_column(Boolean)
+    predicted_relevant: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
+    author: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow
+    )
+
+
+class CaseResourceVerdict(Base):
+    """Relevance of one version of one of a case's resources, for incremental re-processing."""
+    __tablename__ = "case_resource_verdicts"
+    __table_args__ = (
+        UniqueConstraint("case_id", "scope", "resource_type", "resource_id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    case_id: Mapped[int] = mapped_column(
+        ForeignKey("cases.id", ondelete="CASCADE"), index=True
+    )
+    # Hash of the condition, drug and classifier prompt version the verdict holds for
+    scope: Mapped[str] = mapped_column(String(64))
+    resource_type: Mapped[str] = mapped_column(String(64))
+    resource_id: Mapped[str] = mapped_column(String(128))
+    version: Mapped[str] = mapped_column(String(128))
+    relevant: Mapped[bool] = mapped_column(Boolean)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, onupdate=utcnow
+    )
+
+
+class PatientBundle(Base):
+    """A patient's clinical resources ingested from a bulk export, read instead of the EHR."""
+    __tablename__ = "patient_bundles"
+
+    patient_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    bundle_ref: Mapped[str] = mapped_column(String(80))
+    resources: Mapped[int]
+    source: Mapped[str] = mapped_column(String(1000))
+    ingested_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, onupdate=utcnow
+    )
@@ -0,0 +1,57 @@
+"""Run CPU-bound pipeline steps off the event loop.
+
+Decoding a stored bundle into records and building the patient summary are
+pure Python, and for a large chart take long enough to stall every API
+request sharing the event loop thread. run_cpu hands them to a shared pool
+chosen by CPU_OFFLOAD:
+
+- "thread": cheap, and arguments aren't copied, but the GIL still lets a
+  step hold the interpreter for a switch interval at a time.
+- "process": steps run in their own interpreters (spawned, not forked from
+  the running server). Arguments and results are pickled, so offloaded
+  steps take and return compact values: refs, records, strings.
+- "off": steps run inline on the event loop.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .db import settings
+
+log = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    """The shared pool, or None when offloading is off."""
+    global _executor
+    if _executor is None and settings.cpu_offload != "off":
+        if settings.cpu_offload == "process":
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.cpu_offload_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.cpu_offload_workers, thread_name_prefix="cpu-offload",
+            )
+        log.info("Offloading CPU-bound pipeline steps to a %d-worker %s pool",
+                 settings.cpu_offload_workers, settings.cpu_offload)
+    return _executor
+
+
+async def run_cpu(fn, *args):
+    """fn(*args) on the offload pool; fn and its arguments must pickle in process mode."""
+    executor = get_executor()
+    if executor is None:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,198 @@
+"""Learned relevance classifier, trained offline from nurse corrections.
+
+A logistic regression over hashed description n-grams, alone and crossed
+with the resource type, condition and drug. Scoring is a few dozen weight
+lookups with no network call, so classify_relevance asks it first and only
+sends descriptions it isn't confident about to Gemini.
+
+Train (or retrain) from the relevance_corrections table, with cached
+Gemini verdicts as weaker labels:
+
+    python -m app.relevance_model data/models/relevance_model.npz
+"""
+import argparse
+import asyncio
+import logging
+import math
+import re
+import zlib
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import select
+
+from .classification_cache import Verdict, normalize
+from .db import SessionLocal, settings
+from .models_prior_auth import ClassificationCacheEntry, RelevanceCorrection
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = Path(__file__).parent.parent / "data" / "models" / "relevance_model.npz"
+N_FEATURES = 2 ** 18
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text):
+    return _WORD.findall(text.casefold())
+
+
+def features(condition, drug, rtype, description, n_features=N_FEATURES):
+    """Sorted hashed feature indices for one (condition, drug, type, description)."""
+    words = _words(description)
+    condition_words = _words(condition)
+    drug_words = _words(drug)
+
+    # Every feature involves the description: context alone (the same
+    # condition on every resource of a request) would only act as a bias and
+    # make the model confident about descriptions it has never seen.
+    names = [f"w={w}" for w in words]
+    names += [f"b={a}_{b}" for a, b in zip(words, words[1:])]
+    names += [f"tw={rtype}|{w}" for w in words]
+    # Relevance depends on the pairing, so cross the request with the resource
+    names += [f"cw={c}|{w}" for c in condition_words for w in words]
+    names += [f"dw={d}|{w}" for d in drug_words for w in words]
+
+    return sorted({zlib.crc32(name.encode("utf-8")) % n_features for name in names})
+
+
+class RelevanceModel:
+    def __init__(self, weights, bias, trained_on=0):
+        self.weights = weights
+        self.bias = float(bias)
+        self.trained_on = trained_on
+
+    @property
+    def n_features(self):
+        return len(self.weights)
+
+    def score(self, condition, drug, rtype, description):
+        """Probability that the description is relevant."""
+        z = self.bias
+        for i in features(condition, drug, rtype, description, self.n_features):
+            z += self.weights[i]
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def classify(self, condition, drug, rtype, descriptions, confidence):
+        """{description: Verdict} for descriptions scored at least `confidence` either way."""
+        verdicts = {}
+        for desc in descriptions:
+            p = self.score(condition, drug, rtype, desc)
+            if p >= confidence:
+                verdicts[desc] = Verdict(True, f"Learned classifier (p={p:.2f})")
+            elif p <= 1 - confidence:
+                verdicts[desc] = Verdict(False, f"Learned classifier (p={p:.2f})")
+        return verdicts
+
+    def save(self, path):
+        np.savez_compressed(
+            path, weights=self.weights, bias=self.bias, trained_on=self.trained_on
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["weights"], data["bias"], int(data["trained_on"]))
+
+
+def train(examples, n_features=N_FEATURES, epochs=300, learning_rate=0.5, l2=1e-4):
+    """Fit a RelevanceModel on (condition, drug, rtype, description, label, weight) tuples.
+
+    Full-batch AdaGrad on the log loss: per-weight step sizes keep rare
+    n-grams learning at the same pace as common ones.
+    """
+    indices = []
+    rows = []
+    labels = np.empty(len(examples), dtype=np.float64)
+    sample_weights = np.empty(len(examples), dtype=np.float64)
+    for row, (condition, drug, rtype, description, label, weight) in enumerate(examples):
+        idx = features(condition, drug, rtype, description, n_features)
+        indices.extend(idx)
+        rows.extend([row] * len(idx))
+        labels[row] = label
+        sample_weights[row] = weight
+    indices = np.asarray(indices, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    sample_weights /= sample_weights.sum()
+
+    weights = np.zeros(n_features, dtype=np.float64)
+    bias = 0.0
+    g2 = np.zeros(n_features, dtype=np.float64)
+    bias_g2 = 0.0
+    for _ in range(epochs):
+        z = np.bincount(rows, weights=weights[indices], minlength=len(examples)) + bias
+        error = (1.0 / (1.0 + np.exp(-z)) - labels) * sample_weights
+        grad = np.bincount(indices, weights=error[rows], minlength=n_features) + l2 * weights
+        bias_grad = error.sum()
+
+        g2 += grad * grad
+        weights -= learning_rate * grad / (np.sqrt(g2) + 1e-8)
+        bias_g2 += bias_grad * bias_grad
+        bias -= learning_rate * bias_grad / (math.sqrt(bias_g2) + 1e-8)
+
+    return RelevanceModel(weights.astype(np.float32), bias, trained_on=len(examples))
+
+
+async def load_examples(session_factory=SessionLocal, cache_weight=0.2):
+    """Nurse corrections, plus cached Gemini verdicts they don't contradict."""
+    async with session_factory() as db:
+        corrections = (await db.execute(select(RelevanceCorrection))).scalars().all()
+        cached = []
+        if cache_weight > 0:
+            cached = (await db.execute(select(ClassificationCacheEntry))).scalars().all()
+
+    examples = {}
+    for row in cached:
+        key = (normalize(row.condition), normalize(row.drug), row.resource_type, normalize(row.description))
+        examples[key] = (row.condition, row.drug, row.resource_type, row.description,
+                         float(row.relevant), cache_weight)
+    # Corrections come last so the nurse's label wins
+    for row in sorted(corrections, key=lambda r: r.created_at):
+        key = (normalize(row.condition), normalize(row.drug), row.resource_type, normalize(row.description))
+        examples[key] = (row.condition, row.drug, row.resource_type, row.description,
+                         float(row.relevant), 1.0)
+    return list(examples.values()), len(corrections)
+
+
+_instance = None
+_loaded = False
+
+
+def get_relevance_model():
+    """The shared model, or None if none has been trained yet."""
+    global _instance, _loaded
+    if not _loaded:
+        _loaded = True
+        path = Path(settings.relevance_model_path or DEFAULT_MODEL_PATH)
+        if path.exists():
+            _instance = RelevanceModel.load(path)
+            log.info("Loaded relevance model %s (trained on %d examples)",
+                     path, _instance.trained_on)
+        else:
+            log.info("No relevance model at %s; every ambiguous resource goes to Gemini", path)
+    return _instance
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Train the learned relevance classifier.")
+    parser.add_argument("out", nargs="?", default=str(DEFAULT_MODEL_PATH))
+    parser.add_argument("--cache-weight", type=float, default=0.2,
+                        help="weight of cached Gemini verdicts relative to corrections (0 to ignore)")
+    parser.add_argument("--epochs", type=int, default=300)
+    args = parser.parse_args()
+
+    examples, corrections = await load_examples(cache_weight=args.cache_weight)
+    if not examples:
+        raise SystemExit("No corrections or cached verdicts to train on")
+
+    model = train(examples, epochs=args.epochs)
+    labels = np.array([e[4] for e in examples])
+    predicted = np.array([model.score(*e[:4]) >= 0.5 for e in examples])
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    model.save(args.out)
+    print(f"Trained on {len(examples)} examples ({corrections} corrections), "
+          f"training accuracy {np.mean(predicted == labels):.3f}; wrote {args.out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
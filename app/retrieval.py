@@ -0,0 +1,121 @@
+"""Per-question retrieval over the patient summary.
+
+A question like "What is the most recent HbA1c?" needs a handful of
+history lines, not the whole chart. LineIndex is a BM25 index over summary
+lines, built once per request; each question gets its top-k lines plus the
+lines every question needs (the Patient line and diagnoses), in summary
+order. Prompt size per question then stays roughly flat as charts grow.
+"""
+import heapq
+import math
+import re
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Question words and summary boilerplate that would otherwise match every line
+_STOPWORDS = {
+    "a", "an", "and", "any", "are", "as", "at", "been", "by", "did", "do", "does", "for",
+    "from", "had", "has", "have", "if", "in", "is", "it", "its", "of", "on", "or", "the",
+    "there", "this", "to", "was", "were", "what", "when", "which", "with", "patient",
+    "patients", "recorded", "status", "date", "unknown",
+}
+
+# Questions use shorthand the chart spells out (LOINC and RxNorm display
+# names). Query terms are expanded with these before scoring.
+_EXPANSIONS = {
+    "hba1c": "hemoglobin a1c",
+    "a1c": "hemoglobin",
+    "inflammatory": "c reactive protein crp erythrocyte sedimentation rate esr",
+    "crp": "c reactive protein",
+    "esr": "erythrocyte sedimentation rate",
+    "bmi": "body mass index",
+    "bp": "blood pressure systolic diastolic",
+    "kidney": "creatinine glomerular filtration egfr",
+    "renal": "creatinine glomerular filtration egfr",
+    "liver": "alanine aminotransferase aspartate alt ast bilirubin",
+    "lipid": "cholesterol ldl hdl triglyceride",
+    "dmard": "methotrexate sulfasalazine hydroxychloroquine leflunomide",
+    "tnf": "adalimumab etanercept infliximab certolizumab golimumab",
+    "biologic": "adalimumab etanercept infliximab certolizumab golimumab tocilizumab abatacept rituximab",
+    "nsaid": "naproxen ibuprofen meloxicam diclofenac celecoxib",
+    "steroid": "prednisone prednisolone methylprednisolone dexamethasone",
+}
+
+# Summary lines every question gets, whatever it asks; see fhir.summary_lines
+PINNED_PREFIXES = ("Patient:", "Diagnosis:")
+# The "[a1b2c3d4] " citation ID fhir.render_line puts in front of each line
+_LINE_ID = re.compile(r"^\[[^\]]*\] ")
+
+
+def tokenize(text):
+    tokens = []
+    for t in _TOKEN.findall(text.casefold()):
+        if len(t) < 2 or t in _STOPWORDS:
+            continue
+        if len(t) > 3 and t.endswith("s") and not t.endswith("ss"):
+            t = t[:-1]      # crude plural folding: "medications" finds "Medication:"
+        tokens.append(t)
+    return tokens
+
+
+class LineIndex:
+    """Okapi BM25 over lines of text."""
+
+    def __init__(self, lines, pinned=PINNED_PREFIXES, k1=1.2, b=0.75):
+        self.lines = list(lines)
+        self.pinned = []
+        self.k1 = k1
+        self.b = b
+
+        self.postings = {}      # term -> [(line index, term frequency)]
+        self.lengths = []
+        for i, line in enumerate(self.lines):
+            text = _LINE_ID.sub("", line, count=1)
+            if text.startswith(pinned):
+                self.pinned.append(i)
+            tokens = tokenize(text)
+            self.lengths.append(len(tokens))
+            counts = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                self.postings.setdefault(t, []).append((i, tf))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def _idf(self, term):
+        n, df = len(self.lines), len(self.postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def scores(self, query):
+        """{line index: BM25 score} for lines sharing at least one term with query."""
+        terms = set(tokenize(query))
+        for term in list(terms):
+            if term in _EXPANSIONS:
+                terms.update(tokenize(_EXPANSIONS[term]))
+        scores = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for i, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def top(self, query, k):
+        """Indices of the k best-matching lines, best first; earlier lines win ties."""
+        scores = self.scores(query)
+        return heapq.nsmallest(k, scores, key=lambda i: (-scores[i], i))
+
+    def select(self, queries, k):
+        """Pinned lines plus each query's top k, in original order.
+
+        None if nothing matched any query, so the caller can fall back to the
+        full text rather than answer from the pinned lines alone.
+        """
+        matched = set()
+        for query in queries:
+            matched.update(self.top(query, k))
+        if not matched:
+            return None
+        return [self.lines[i] for i in sorted(matched.union(self.pinned))]
@@ -5,8 +5,13 @@ from sqlalchemy.orm import selectinload
 
 from ..db import get_db
 from ..models import Case
-from ..models_prior_auth import PriorAuthRequest, PriorAuthStatus
-from ..schemas_prior_auth import PriorAuthCreate, PriorAuthAccepted, PriorAuthOut
+from ..models_prior_auth import (
+    PriorAuthAnswer, PriorAuthRequest, PriorAuthStatus, RelevanceCorrection,
+)
+from ..schemas_prior_auth import (
+    PriorAuthCreate, PriorAuthAccepted, PriorAuthOut, CitedResourceOut,
+    RelevanceCorrectionCreate, RelevanceCorrectionOut,
+)
 from ..pubsub import get_pubsub
 
 router = APIRouter()
@@ -28,6 +33,7 @@ async def create_prior_auth(
         condition=payload.condition,
         drug=payload.drug,
         questions=payload.questions,
+        patient_id=payload.patient_id,
         status=PriorAuthStatus.ACCEPTED.value,
     )
     db.add(pa_request)
@@ -42,6 +48,8 @@ async def create_prior_auth(
         "condition": payload.condition,
         "drug": payload.drug,
         "questions": payload.questions,
+        "patient_id": payload.patient_id,
+        "reauthorization": payload.reauthorization,
     })
 
     return PriorAuthAccepted(
@@ -66,4 +74,75 @@ async def get_prior_auth(
     if not pa_request:
         raise HTTPException(status_code=404, detail="Prior auth request not found")
 
-    return pa_request
\ No newline at end of file
+    return pa_request
+
+
+@router.get(
+    "/prior-auth/{request_id}/answers/{answer_id}/citations",
+    response_model=list[CitedResourceOut],
+)
+async def get_answer_citations(
+    request_id: int,
+    answer_id: int,
+    db: AsyncSession = Depends(get_db),
+):
+    """The FHIR resources an answer cites, as the bundle held them when the answer was saved."""
+    result = await db.execute(
+        select(PriorAuthAnswer).where(
+            PriorAuthAnswer.id == answer_id,
+            PriorAuthAnswer.request_id == request_id,
+        )
+    )
+    answer = result.scalar_one_or_none()
+    if not answer:
+        raise HTTPException(status_code=404, detail="Answer not found")
+    return answer.cited_resources or []
+
+
+@router.post(
+    "/prior-auth/{request_id}/corrections",
+    response_model=RelevanceCorrectionOut,
+    status_code=201,
+)
+async def add_relevance_correction(
+    request_id: int,
+    payload: RelevanceCorrectionCreate,
+    db: AsyncSession = Depends(get_db),
+):
+    """Record a nurse's relevance label for one resource; training data for the learned classifier."""
+    pa_request = await db.get(PriorAuthRequest, request_id)
+    if not pa_request:
+        raise HTTPException(status_code=404, detail="Prior auth request not found")
+
+    correction = RelevanceCorrection(
+        request_id=request_id,
+        condition=pa_request.condition,
+        drug=pa_request.drug,
+        **payload.model_dump(),
+    )
+    db.add(correction)
+    await db.commit()
+    await db.refresh(correction)
+    return correction
+
+
+@router.get(
+    "/prior-auth/{request_id}/corrections",
+    response_model=list[RelevanceCorrectionOut],
+)
+async def list_relevance_corrections(
+    request_id: int,
+    db: AsyncSession = Depends(get_db),
+):
+    exists = await db.execute(
+        select(PriorAuthRequest.id).where(PriorAuthRequest.id == request_id)
+    )
+    if not exists.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Prior auth request not found")
+
+    result = await db.execute(
+        select(RelevanceCorrection)
+        .where(RelevanceCorrection.request_id == request_id)
+        .order_by(RelevanceCorrection.created_at)
+    )
+    return result.scalars().all()
@@ -7,6 +7,9 @@ class PriorAuthCreate(BaseModel):
     condition: str = Field(min_length=1, max_length=500)
     drug: str = Field(min_length=1, max_length=500)
     questions: list[str] = Field(min_length=1)
+    patient_id: str | None = Field(default=None, min_length=1, max_length=128)
+    # Part of the re-authorization batch: a recent bulk export may stand in for the EHR
+    reauthorization: bool = False
 
 
 class PriorAuthAccepted(BaseModel):
@@ -26,6 +29,13 @@ class PriorAuthAnswerOut(BaseModel):
     confidence: float | None = None
 
 
+class CitedResourceOut(BaseModel):
+    line_id: str
+    resource_type: str
+    id: str
+    resource: dict
+
+
 class PriorAuthOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
@@ -33,11 +43,37 @@ class PriorAuthOut(BaseModel):
     case_id: int
     condition: str
     drug: str
+    patient_id: str | None = None
     status: str
     error_message: str | None = None
     total_records_fetched: int | None = None
     relevant_records_count: int | None = None
     patient_summary: str | None = None
+    summary_tokens: int | None = None
+    summary_lines_dropped: int | None = None
+    summary_tokens_dropped: int | None = None
     created_at: datetime
     updated_at: datetime
-    answers: list[PriorAuthAnswerOut] = []
\ No newline at end of file
+    answers: list[PriorAuthAnswerOut] = []
+
+class RelevanceCorrectionCreate(BaseModel):
+    resource_type: str = Field(min_length=1, max_length=64)
+    resource_id: str | None = Field(default=None, max_length=128)
+    description: str = Field(min_length=1, max_length=10_000)
+    relevant: bool
+    predicted_relevant: bool | None = None
+    author: str | None = Field(default=None, max_length=200)
+
+
+class RelevanceCorrectionOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    request_id: int
+    resource_type: str
+    resource_id: str | None = None
+    description: str
+    relevant: bool
+    predicted_relevant: bool | None = None
+    author: str | None = None
+    created_at: datetime
@@ -0,0 +1,152 @@
+"""Near-duplicate matching for resource descriptions.
+
+Exact-string dedup treats "Body mass index (BMI) [Ratio]" and "Body Mass
+Index", or two strengths of the same tablet, as different descriptions that
+each need classifying. This keeps a TF-IDF index of descriptions we already
+have verdicts for, per (condition, drug, resource type, prompt version), and
+finds the nearest known description by cosine similarity.
+"""
+import logging
+import math
+import re
+from collections import Counter, OrderedDict
+
+from .db import settings
+
+log = logging.getLogger(__name__)
+
+# Qualifiers that don't change what a description is about: LOINC property
+# brackets, SNOMED semantic tags and abbreviations in parentheses, doses.
+# Numbers are kept, inside brackets too: "type 1" and "type 2" diabetes, or
+# CKD "stage 1" and "stage 4", are different conditions. Only a number
+# followed by a unit is dropped, as a dose.
+_BRACKETED = re.compile(r"\[[^\]]*\]|\([^)]*\)|\{[^}]*\}")
+_TOKEN = re.compile(r"[a-z]+|\d+(?:\.\d+)?")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_STOPWORDS = {"a", "an", "and", "by", "for", "in", "of", "on", "or", "the", "to", "with"}
+_UNITS = {"mg", "ml", "mcg", "g", "unt", "meq", "hr", "actuat"}
+
+
+def tokenize(description):
+    text = description.casefold()
+    tokens = _TOKEN.findall(_BRACKETED.sub(" ", text))
+    out = []
+    for i, t in enumerate(tokens):
+        if t in _STOPWORDS or t in _UNITS:
+            continue
+        if t[0].isdigit() and i + 1 < len(tokens) and tokens[i + 1] in _UNITS:
+            continue
+        out.append(t)
+    for qualifier in _BRACKETED.findall(text):
+        out.extend(_NUMBER.findall(qualifier))
+    return out
+
+
+class _ScopeIndex:
+    """TF-IDF over sparse term counts with an inverted index.
+
+    Adding or evicting a description touches only its own terms, and a
+    lookup only scores the known descriptions that share a term with it.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()     # description -> ({term: count}, verdict)
+        self._postings = {}              # term -> {descriptions containing it}
+
+    def add(self, description, verdict):
+        if description in self.entries:
+            self.entries.move_to_end(description)
+            return
+        tokens = tokenize(description)
+        if not tokens:
+            return
+        counts = Counter(tokens)
+        self.entries[description] = (counts, verdict)
+        for t in counts:
+            self._postings.setdefault(t, set()).add(description)
+        while len(self.entries) > self.max_entries:
+            old, (old_counts, _) = self.entries.popitem(last=False)
+            for t in old_counts:
+                posting = self._postings[t]
+                posting.discard(old)
+                if not posting:
+                    del self._postings[t]
+
+    def _idf(self, term):
+        df = len(self._postings.get(term, ()))
+        return math.log((1 + len(self.entries)) / (1 + df)) + 1
+
+    def _weights(self, counts):
+        weights = {t: c * self._idf(t) for t, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return weights, norm
+
+    def nearest(self, descriptions):
+        """(known description, verdict, similarity) of the closest entry per description."""
+        matches = {}
+        known_weights = {}      # idf can't change during one lookup
+        for desc in descriptions:
+            # Terms no known description has still count towards the query's norm,
+            # so an unseen "1" keeps "type 1" from matching "type 2"
+            query, query_norm = self._weights(Counter(tokenize(desc)))
+            candidates = set()
+            for t in query:
+                candidates |= self._postings.get(t, set())
+            best = None
+            for known in candidates:
+                if known not in known_weights:
+                    known_weights[known] = self._weights(self.entries[known][0])
+                weights, norm = known_weights[known]
+                score = sum(w * weights.get(t, 0.0) for t, w in query.items()) / (query_norm * norm)
+                if best is None or (score, known) > best:
+                    best = (score, known)
+            if best is not None:
+                score, known = best
+                matches[desc] = (known, self.entries[known][1], score)
+        return matches
+
+
+class SimilarityIndex:
+    """Per-scope indexes; the least recently used scope is dropped past max_scopes."""
+
+    def __init__(self, max_entries_per_scope=2000, max_scopes=256):
+        self.max_entries_per_scope = max_entries_per_scope
+        self.max_scopes = max_scopes
+        self._scopes = OrderedDict()
+
+    def add(self, scope, verdicts):
+        """Remember {description: Verdict} pairs with authoritative verdicts."""
+        if not verdicts:
+            return
+        index = self._scopes.get(scope)
+        if index is None:
+            index = self._scopes[scope] = _ScopeIndex(self.max_entries_per_scope)
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+        self._scopes.move_to_end(scope)
+        for desc, verdict in verdicts.items():
+            index.add(desc, verdict)
+
+    def match(self, scope, descriptions, threshold):
+        """{description: (known description, verdict, similarity)} for matches >= threshold."""
+        index = self._scopes.get(scope)
+        if index is None or not descriptions:
+            return {}
+        self._scopes.move_to_end(scope)
+        return {
+            desc: match
+            for desc, match in index.nearest(list(descriptions)).items()
+            if match[2] >= threshold
+        }
+
+
+_instance = None
+
+
+def get_similarity_index():
+    global _instance
+    if _instance is None:
+        _instance = SimilarityIndex(settings.classify_similarity_max_entries,
+                                    settings.classify_similarity_max_scopes)
+    return _instance
@@ -1,17 +1,29 @@
-import json
+import asyncio
 import logging
-import os
 
+from contextlib import nullcontext
 from pathlib import Path
 from dotenv import load_dotenv
-from google import genai
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 
 from .pubsub import get_pubsub
-from .fhir import strip_plumbing, classify_relevance, to_natural_language
+from .bundle_store import get_bundle_store
+from .bulk_ingest import ingested_bundle_ref, ingested_bundle_refs
+from .fhir_client import get_fhir_client
+from .local_ehr import get_local_ehr
+from .fhir import (
+    read_bundle_records, read_bundle_resources, summary_lines, fit_summary_to_budget,
+    render_summary, citation_index, resolve_citations, cited_resources,
+)
+from .case_history import classify_case
+from .llm import background, get_gateway
+from .offload import run_cpu
+from .retrieval import LineIndex
+from .tokens import RESPONSE_TOKENS_PER_ANSWER, estimate_tokens
 
 from sqlalchemy import select
-from .db import SessionLocal
+from sqlalchemy.exc import SQLAlchemyError
+from .db import SessionLocal, settings
 from .models_prior_auth import PriorAuthRequest, PriorAuthAnswer, PriorAuthStatus
 
 log = logging.getLogger(__name__)
@@ -20,51 +32,291 @@ load_dotenv()
 
 class PriorAuthQA(BaseModel):
     answer: str = Field(description="1-3 sentence answer to the question")
-    supporting_record_ids: list[str] = Field(description="Lines from the patient history that support this answer")
+    supporting_record_ids: list[str] = Field(
+        description="IDs of the patient history lines that support this answer, e.g. 3f2a9c1d"
+    )
     confidence: float = Field(description="Confidence score from 0.0 to 1.0")
 
 
-def _get_gemini_client():
-    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+QA_PROMPT = """You are a clinical documentation specialist assisting with prior authorization.
 
+Given the patient's medical history below, answer the following question.
+Each history line starts with its ID in square brackets; cite supporting lines by ID.
 
-async def fetch_fhir_from_hospital(case_id):
-    """Fetch FHIR records from hospital EHR."""
-    fhir_path = Path(__file__).parent.parent / "data" / "sample_patient.json"
-    with open(fhir_path) as f:
-        return json.load(f)
+PATIENT HISTORY:
+{patient_summary}
 
+QUESTION: {question}"""
 
-async def answer_questions_with_llm(patient_summary, questions):
-    """Answer prior auth questions using Gemini structured output."""
-    client = _get_gemini_client()
 
-    answers = []
-    for question in questions:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=f"""You are a clinical documentation specialist assisting with prior authorization.
+# Recorded for a question that failed every retry, so the rest of the form still completes
+UNANSWERED = "Could not be answered automatically; needs manual review."
+
+
+class NumberedQA(PriorAuthQA):
+    id: str = Field(description="ID of the question being answered")
 
-Given the patient's medical history below, answer the following question.
+
+class BatchQA(BaseModel):
+    answers: list[NumberedQA]
+
+
+QA_BATCH_PROMPT = """You are a clinical documentation specialist assisting with prior authorization.
+
+Given the patient's medical history below, answer each of the following questions.
+Each history line starts with its ID in square brackets; cite supporting lines by ID.
 
 PATIENT HISTORY:
 {patient_summary}
 
-QUESTION: {question}""",
-            config={
-                "response_mime_type": "application/json",
-                "response_json_schema": PriorAuthQA.model_json_schema(),
-            },
+QUESTIONS:
+{question_list}
+
+Answer every question listed above, each on its own, citing the IDs of the history lines that support it."""
+
+
+def _question_chunks(questions):
+    """Split questions into as few batched calls as the output limit allows, evenly."""
+    per_call = max(1, settings.qa_max_output_tokens // RESPONSE_TOKENS_PER_ANSWER)
+    calls = -(-len(questions) // per_call)
+    size = -(-len(questions) // calls) if calls else 0
+    return [questions[i:i + size] for i in range(0, len(questions), size)] if size else []
+
+
+def _question_list(questions):
+    return "\n".join(f"ID: {i} — {q}" for i, q in enumerate(questions))
+
+
+def summary_token_budget(questions):
+    """Tokens left for the patient summary once the QA prompt and question(s) are in."""
+    if settings.qa_batch_questions and len(questions) > 1:
+        overhead = max(
+            estimate_tokens(QA_BATCH_PROMPT.format(
+                patient_summary="", question_list=_question_list(chunk)
+            ))
+            for chunk in _question_chunks(questions)
         )
+    else:
+        longest = max(questions, key=len, default="")
+        overhead = estimate_tokens(QA_PROMPT.format(patient_summary="", question=longest))
+    return settings.qa_prompt_token_budget - overhead
+
 
-        parsed = PriorAuthQA.model_validate_json(response.text)
-        answers.append({
-            "question": question,
-            "answer": parsed.answer,
-            "supporting_record_ids": parsed.supporting_record_ids,
-            "confidence": parsed.confidence,
-        })
+def build_summary(relevant, questions):
+    """(summary text, citation index, SummaryBudget) for the QA stage; CPU-bound, see offload."""
+    lines, budget = fit_summary_to_budget(summary_lines(relevant), summary_token_budget(questions))
+    return render_summary(lines), citation_index(lines), budget
+
+
+def _history_for(index, patient_summary, questions):
+    """The summary lines these questions need, or the whole summary if it's short."""
+    if index is None:
+        return patient_summary
+    lines = index.select(questions, settings.qa_retrieval_top_k)
+    return patient_summary if lines is None else "\n".join(lines)
+
+
+# Stand-in for the hospital EHR when neither FHIR_BASE_URL nor LOCAL_EHR_PATH applies
+SAMPLE_BUNDLE_PATH = Path(__file__).parent.parent / "data" / "sample_patient.json"
+
+
+def _store_sample_bundle():
+    with open(SAMPLE_BUNDLE_PATH, "rb") as f:
+        return get_bundle_store().put(f)
+
+
+async def fetch_bundle_from_hospital(case_id, patient_id=None, reauthorization=False):
+    """Fetch the patient's FHIR bundle from hospital EHR into the bundle store. Returns its ref.
+
+    A bulk-ingested bundle can be days old, so it's only used for the
+    re-authorization batch, or when there's no live FHIR server to ask.
+    """
+    client = get_fhir_client()
+    if patient_id is not None and (reauthorization or client is None):
+        bundle_ref = await ingested_bundle_ref(patient_id, SessionLocal)
+        if bundle_ref is not None:
+            log.info("FHIR Fetcher: using bulk-ingested bundle for patient %s", patient_id)
+            return bundle_ref
+
+    if client is None or patient_id is None:
+        # Copying, hashing and writing a whole chart is blocking file I/O, so it
+        # runs on a thread. Not run_cpu: the local EHR's mapping is per process.
+        ehr = get_local_ehr()
+        if ehr is not None:
+            # Without a patient ID, each case is served one of the store's patients
+            return await asyncio.to_thread(ehr.put_bundle, patient_id if patient_id is not None
+                                           else ehr.patient_for_case(case_id))
+        return await asyncio.to_thread(_store_sample_bundle)
+
+    stats = await client.fetch_patient(patient_id)
+    log.info("FHIR Fetcher: %d resources for patient %s in %.2fs "
+             "(%d requests, %d not modified, %d bytes)",
+             stats.resources, patient_id, stats.seconds, stats.requests,
+             stats.not_modified, stats.bytes_downloaded)
+    return stats.bundle_ref
+
+
+async def sweep_bundle_store():
+    """Delete old stored bundles that neither the ETag cache nor patient_bundles refers to.
+
+    Returns the number deleted. Fetched bundles are only referenced by
+    in-flight messages, so they go once BUNDLE_STORE_RETENTION_HOURS old.
+    """
+    try:
+        keep = await ingested_bundle_refs(SessionLocal)
+    except (SQLAlchemyError, OSError) as e:
+        log.warning("Bundle store: skipping sweep, patient_bundles unavailable: %s", e)
+        return 0
+    client = get_fhir_client()
+    if client is not None:
+        keep |= client.cached_refs()
+    return await asyncio.to_thread(get_bundle_store().sweep, keep,
+                                   settings.bundle_store_retention_hours * 3600)
+
+
+async def sweep_bundle_store_periodically():
+    while True:
+        await asyncio.sleep(settings.bundle_store_sweep_minutes * 60)
+        try:
+            await sweep_bundle_store()
+        except Exception:
+            log.exception("Bundle store: sweep failed")
+
+
+def load_bundle_records(bundle_ref):
+    """Clinical resources of a stored bundle as compact records."""
+    with get_bundle_store().open(bundle_ref) as f:
+        return read_bundle_records(f)
+
+
+def load_cited_resources(bundle_ref, wanted):
+    """The wanted (resourceType, id) resources of a stored bundle, as stored."""
+    with get_bundle_store().open(bundle_ref) as f:
+        return read_bundle_resources(f, wanted)
+
+
+async def fetch_fhir_from_hospital(case_id, patient_id=None, reauthorization=False):
+    """Fetch clinical FHIR resources from hospital EHR as compact records."""
+    bundle_ref = await fetch_bundle_from_hospital(case_id, patient_id, reauthorization)
+    return await run_cpu(load_bundle_records, bundle_ref)
+
+
+def _answer(question, parsed):
+    return {
+        "question": question,
+        "answer": parsed.answer,
+        "supporting_record_ids": parsed.supporting_record_ids,
+        "confidence": parsed.confidence,
+    }
+
+
+def _unanswered(question):
+    return {
+        "question": question,
+        "answer": UNANSWERED,
+        "supporting_record_ids": [],
+        "confidence": None,
+    }
+
+
+async def _answer_one(semaphore, patient_summary, question):
+    """Answer one question, retrying on its own; never raises.
+
+    The gateway has already retried 429s, 5xx and connection errors, so a
+    call that still fails goes straight to manual review. Only an answer
+    that doesn't parse, e.g. truncated JSON, is asked for again.
+    """
+    for attempt in range(settings.qa_max_retries + 1):
+        try:
+            async with semaphore:
+                response = await get_gateway().generate(
+                    contents=QA_PROMPT.format(patient_summary=patient_summary, question=question),
+                    config={
+                        "response_mime_type": "application/json",
+                        "response_json_schema": PriorAuthQA.model_json_schema(),
+                    },
+                    expected_output_tokens=RESPONSE_TOKENS_PER_ANSWER,
+                )
+        except Exception as e:
+            log.error("QA Engine: giving up on %r: %s", question, e)
+            return _unanswered(question)
+        try:
+            return _answer(question, PriorAuthQA.model_validate_json(response.text or ""))
+        except ValidationError as e:
+            if attempt == settings.qa_max_retries:
+                log.error("QA Engine: giving up on %r after %d invalid answers: %s",
+                          question, attempt + 1, e)
+                return _unanswered(question)
+            delay = settings.qa_retry_backoff_seconds * 2 ** attempt
+            log.warning("QA Engine: invalid answer for %r (%s), retrying in %.1fs", question, e, delay)
+            await asyncio.sleep(delay)
+
+
+async def _answer_batch(semaphore, patient_summary, questions):
+    """Answer several questions in one call. Returns {index in questions: answer}."""
+    try:
+        async with semaphore:
+            response = await get_gateway().generate(
+                contents=QA_BATCH_PROMPT.format(
+                    patient_summary=patient_summary, question_list=_question_list(questions)
+                ),
+                config={
+                    "response_mime_type": "application/json",
+                    "response_json_schema": BatchQA.model_json_schema(),
+                },
+                expected_output_tokens=len(questions) * RESPONSE_TOKENS_PER_ANSWER,
+            )
+        batch = BatchQA.model_validate_json(response.text)
+    except Exception as e:
+        log.warning("QA Engine: batch of %d questions failed (%s)", len(questions), e)
+        return {}
+
+    answered = {}
+    for parsed in batch.answers:
+        try:
+            i = int(parsed.id)
+            answered[i] = _answer(questions[i], parsed)
+        except (ValueError, IndexError):
+            continue
+    return answered
+
+
+async def answer_questions_with_llm(patient_summary, questions):
+    """Answer prior auth questions using Gemini structured output, in questionnaire order."""
+    semaphore = asyncio.Semaphore(settings.qa_max_concurrency)
+
+    # Built once per request; each prompt then carries only the lines its
+    # question matches, plus the Patient line and diagnoses.
+    index = None
+    lines = patient_summary.splitlines()
+    if settings.qa_retrieval_top_k and len(lines) > settings.qa_retrieval_top_k:
+        index = LineIndex(lines)
+
+    if not settings.qa_batch_questions or len(questions) < 2:
+        return list(await asyncio.gather(*(
+            _answer_one(semaphore, _history_for(index, patient_summary, [q]), q)
+            for q in questions
+        )))
+
+    # One call per chunk sends the summary once instead of once per question
+    chunks = _question_chunks(questions)
+    batches = await asyncio.gather(*(
+        _answer_batch(semaphore, _history_for(index, patient_summary, chunk), chunk)
+        for chunk in chunks
+    ))
 
+    answers = []
+    for chunk, answered in zip(chunks, batches):
+        missing = [i for i in range(len(chunk)) if i not in answered]
+        if missing:
+            log.warning("QA Engine: batch skipped %d of %d questions, asking individually",
+                        len(missing), len(chunk))
+            retried = await asyncio.gather(*(
+                _answer_one(semaphore, _history_for(index, patient_summary, [chunk[i]]), chunk[i])
+                for i in missing
+            ))
+            answered.update(zip(missing, retried))
+        answers.extend(answered[i] for i in range(len(chunk)))
     return answers
 
 
@@ -72,22 +324,35 @@ async def handle_prior_auth_requested(message):
     data = message.data
     log.info("FHIR Fetcher: processing request %s", data["request_id"])
 
-    bundle = await fetch_fhir_from_hospital(data["case_id"])
-    log.info("FHIR Fetcher: got %d records", len(bundle["entry"]))
+    # Messages carry a reference, not the bundle; the classifier reads it from the store
+    bundle_ref = await fetch_bundle_from_hospital(
+        data["case_id"], data.get("patient_id"), data.get("reauthorization", False),
+    )
+    log.info("FHIR Fetcher: stored bundle %s", bundle_ref)
 
     pubsub = get_pubsub()
-    await pubsub.publish("fhir-records-ready", {**data, "bundle": bundle})
+    await pubsub.publish("fhir-records-ready", {**data, "bundle_ref": bundle_ref})
+
+
+def _llm_priority(data):
+    """Re-authorization batch requests queue for Gemini behind interactive ones."""
+    return background() if data.get("reauthorization") else nullcontext()
 
 
 async def handle_fhir_records_ready(message):
     data = message.data
     log.info("Classifier: processing request %s", data["request_id"])
 
-    resources = strip_plumbing(data["bundle"])
-    relevant = await classify_relevance(resources, data["condition"], data["drug"])
-    patient_summary = to_natural_language(relevant)
+    # Decoding the bundle and building the summary run off the event loop
+    resources = await run_cpu(load_bundle_records, data["bundle_ref"])
+    with _llm_priority(data):
+        relevant = await classify_case(data["case_id"], resources, data["condition"], data["drug"])
+    patient_summary, citations, budget = await run_cpu(build_summary, relevant, data["questions"])
 
     log.info("Classifier: %d resources -> %d relevant", len(resources), len(relevant))
+    if budget.lines_dropped:
+        log.warning("Classifier: summary over budget, dropped %d lines (~%d tokens)",
+                    budget.lines_dropped, budget.tokens_dropped)
 
     pubsub = get_pubsub()
     await pubsub.publish("records-classified", {
@@ -95,6 +360,10 @@ async def handle_fhir_records_ready(message):
         "case_id": data["case_id"],
         "questions": data["questions"],
         "patient_summary": patient_summary,
+        "citations": citations,
+        "bundle_ref": data["bundle_ref"],
+        "reauthorization": data.get("reauthorization", False),
+        "summary_budget": budget._asdict(),
     })
 
 
@@ -102,20 +371,39 @@ async def handle_records_classified(message):
     data = message.data
     log.info("QA Engine: answering %d questions", len(data["questions"]))
 
-    answers = await answer_questions_with_llm(
-        data["patient_summary"],
-        data["questions"],
-    )
+    with _llm_priority(data):
+        answers = await answer_questions_with_llm(
+            data["patient_summary"],
+            data["questions"],
+        )
 
+    refs = []
     for a in answers:
+        cited = a["supporting_record_ids"]
+        a["supporting_record_ids"], answer_refs = resolve_citations(data["citations"], cited)
+        refs.append(answer_refs)
+        if len(a["supporting_record_ids"]) < len(cited):
+            log.warning("QA Engine: dropped %d citations that aren't summary line IDs",
+                        len(cited) - len(a["supporting_record_ids"]))
         log.info("  Q: %s", a["question"])
         log.info("  A: %s", a["answer"])
 
+    # The message carries only (type, id) references; the cited resources
+    # themselves come from the stored bundle, one pass for all answers that
+    # decodes only the cited entries
+    wanted = {(rtype, rid) for answer_refs in refs for _, rtype, rid in answer_refs}
+    resources = {}
+    if wanted:
+        resources = await run_cpu(load_cited_resources, data["bundle_ref"], wanted)
+    for a, answer_refs in zip(answers, refs):
+        a["cited_resources"] = cited_resources(answer_refs, resources)
+
     pubsub = get_pubsub()
     await pubsub.publish("prior-auth-answered", {
         "request_id": data["request_id"],
         "case_id": data["case_id"],
         "answers": answers,
+        "summary_budget": data["summary_budget"],
     })
 
 
@@ -130,6 +418,9 @@ async def handle_prior_auth_answered(message):
         )
         pa_request = result.scalar_one()
         pa_request.status = PriorAuthStatus.COMPLETED.value
+        pa_request.summary_tokens = data["summary_budget"]["tokens"]
+        pa_request.summary_lines_dropped = data["summary_budget"]["lines_dropped"]
+        pa_request.summary_tokens_dropped = data["summary_budget"]["tokens_dropped"]
 
         for a in data["answers"]:
             db.add(PriorAuthAnswer(
@@ -137,6 +428,7 @@ async def handle_prior_auth_answered(message):
                 question=a["question"],
                 answer=a["answer"],
                 supporting_record_ids=a["supporting_record_ids"],
+                cited_resources=a.get("cited_resources"),
                 confidence=a["confidence"],
             ))
 
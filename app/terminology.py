@@ -0,0 +1,185 @@
+"""Local terminology index for deterministic relevance pre-filtering.
+
+Value sets live in data/terminology/value_sets.json: for each condition and
+drug, the SNOMED, ICD-10, LOINC and RxNorm codes that are clearly in scope,
+plus codes that are never relevant to a prior auth (dental work, routine
+encounter procedures, social history). The JSON is compiled into a sorted
+fixed-width index that is memory-mapped and binary searched, so every worker
+shares the same pages and a lookup never parses anything.
+
+Rebuild the index after editing the value sets:
+
+    python -m app.terminology data/terminology/value_sets.json data/terminology/value_sets.idx
+"""
+import json
+import logging
+import mmap
+import re
+import struct
+import sys
+from pathlib import Path
+
+from .db import settings
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"CLVTERM1"
+HEADER = struct.Struct("<II")        # record count, metadata length
+RECORD = struct.Struct("<32sH")      # "system|code", value set id
+KEY_SIZE = 32
+
+DEFAULT_INDEX_PATH = Path(__file__).parent.parent / "data" / "terminology" / "value_sets.idx"
+
+SYSTEM_TAGS = {
+    "http://snomed.info/sct": "sct",
+    "http://loinc.org": "loinc",
+    "http://www.nlm.nih.gov/research/umls/rxnorm": "rxnorm",
+    "http://hl7.org/fhir/sid/icd-10-cm": "icd10",
+    "http://terminology.hl7.org/CodeSystem/observation-category": "obs-category",
+}
+
+
+def code_key(system, code):
+    """Compact "tag|code" key for a coding, e.g. "loinc|4548-4"."""
+    return f"{SYSTEM_TAGS.get(system, system)}|{code}"
+
+
+def _normalize(text):
+    return " " + " ".join(re.sub(r"[^a-z0-9]+", " ", text.casefold()).split()) + " "
+
+
+def build_index(value_sets, path):
+    """Compile a value set document into an index file at path."""
+    sets = []
+    records = []
+
+    def add(kind, name, aliases, codes):
+        set_id = len(sets)
+        sets.append({"name": f"{kind}:{name}", "kind": kind, "aliases": aliases})
+        for key in codes:
+            encoded = key.encode("utf-8")
+            if len(encoded) > KEY_SIZE:
+                raise ValueError(f"Code key too long for index: {key!r}")
+            records.append((encoded, set_id))
+
+    for name, spec in value_sets.get("conditions", {}).items():
+        add("condition", name, spec.get("aliases", [name]), spec["codes"])
+    for name, spec in value_sets.get("drugs", {}).items():
+        add("drug", name, spec.get("aliases", [name]), spec["codes"])
+    for name, codes in value_sets.get("out_of_scope", {}).items():
+        add("out_of_scope", name, [], codes)
+
+    records.sort()
+    meta = json.dumps({"sets": sets}).encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(len(records), len(meta)))
+        f.write(meta)
+        for key, set_id in records:
+            f.write(RECORD.pack(key, set_id))
+
+    return len(records)
+
+
+class Scope:
+    """Value set ids that count as in-scope for one (condition, drug) pair."""
+
+    __slots__ = ("include", "names")
+
+    def __init__(self, include, names):
+        self.include = include
+        self.names = names
+
+
+class TerminologyIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a terminology index")
+        self._count, meta_len = HEADER.unpack_from(self._map, len(MAGIC))
+        meta_start = len(MAGIC) + HEADER.size
+        meta = json.loads(self._map[meta_start:meta_start + meta_len])
+        self._records_start = meta_start + meta_len
+
+        self.sets = meta["sets"]
+        self.out_of_scope = frozenset(
+            i for i, s in enumerate(self.sets) if s["kind"] == "out_of_scope"
+        )
+        self._aliases = [
+            [_normalize(alias) for alias in s["aliases"]] for s in self.sets
+        ]
+
+    def __len__(self):
+        return self._count
+
+    def _key_at(self, i):
+        start = self._records_start + i * RECORD.size
+        return self._map[start:start + KEY_SIZE]
+
+    def lookup(self, key):
+        """Return the ids of every value set containing key."""
+        target = key.encode("utf-8").ljust(KEY_SIZE, b"\0")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        found = set()
+        while lo < self._count and self._key_at(lo) == target:
+            found.add(RECORD.unpack_from(self._map, self._records_start + lo * RECORD.size)[1])
+            lo += 1
+        return found
+
+    def scope(self, condition, drug):
+        """Match free-text condition and drug names against value set aliases."""
+        matched = set()
+        for text, kind in ((condition, "condition"), (drug, "drug")):
+            normalized = _normalize(text)
+            for i, s in enumerate(self.sets):
+                if s["kind"] == kind and any(a in normalized for a in self._aliases[i]):
+                    matched.add(i)
+        return Scope(frozenset(matched), [self.sets[i]["name"] for i in sorted(matched)])
+
+    def triage(self, codes, scope):
+        """True if clearly relevant, False if clearly out of scope, None if the LLM should decide."""
+        hits = set()
+        for key in codes:
+            hits |= self.lookup(key)
+        if hits & scope.include:
+            return True
+        if hits & self.out_of_scope:
+            return False
+        return None
+
+
+_instance = None
+_loaded = False
+
+
+def get_terminology_index():
+    """The shared index, or None if pre-filtering is off or no index is built."""
+    global _instance, _loaded
+    if not _loaded:
+        _loaded = True
+        path = Path(settings.terminology_index_path or DEFAULT_INDEX_PATH)
+        if not settings.terminology_prefilter:
+            log.info("Terminology pre-filter disabled")
+        elif not path.exists():
+            log.warning("Terminology index %s not found; pre-filter disabled", path)
+        else:
+            _instance = TerminologyIndex(path)
+            log.info("Loaded terminology index %s (%d codes)", path, len(_instance))
+    return _instance
+
+
+if __name__ == "__main__":
+    source, target = sys.argv[1], sys.argv[2]
+    with open(source) as f:
+        count = build_index(json.load(f), target)
+    print(f"Wrote {count} codes to {target}")
@@ -0,0 +1,99 @@
+"""Token estimation and latency-aware chunking for Gemini calls.
+
+We don't run a real tokenizer; ~4 characters per token is close enough for
+English clinical text to size prompts and batches.
+"""
+CHARS_PER_TOKEN = 4
+
+# A BatchClassification entry is {"id": "12", "relevant": false, "reasoning": "..."}
+# with a one-line reasoning, which comes out around this many tokens.
+RESPONSE_TOKENS_PER_CLASSIFICATION = 40
+
+# A PriorAuthQA answer: up to three sentences plus a few cited history lines.
+RESPONSE_TOKENS_PER_ANSWER = 250
+
+# Prompt tokens are read roughly an order of magnitude faster than output
+# tokens are generated, so they count for a tenth of the latency budget.
+PROMPT_TOKEN_WEIGHT = 0.1
+
+
+def estimate_tokens(text):
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+class ChunkSizer:
+    """Splits descriptions into chunks sized to finish in roughly target_seconds.
+
+    Each description costs its response tokens plus a weighted share of its
+    prompt tokens. A call's latency is modelled as a fixed overhead plus its
+    cost over a throughput rate, both fitted from real calls by an
+    exponentially weighted least-squares line of latency against cost, and
+    the next chunks are sized from them. Without the overhead term a small
+    chunk looks slow per token, which would shrink the next chunks, which
+    look slower still. No chunk may ask for more than max_output_tokens of
+    response.
+    """
+
+    def __init__(self, target_seconds, max_output_tokens,
+                 tokens_per_second=200.0, overhead_seconds=1.0, min_items=10, smoothing=0.3):
+        self.target_seconds = target_seconds
+        self.max_output_tokens = max_output_tokens
+        self.tokens_per_second = tokens_per_second
+        self.overhead_seconds = overhead_seconds
+        self.min_items = min_items
+        self.smoothing = smoothing
+        self._moments = None    # weighted means of cost, seconds, cost², cost·seconds
+
+    @staticmethod
+    def item_cost(description):
+        """Latency cost of one description, in output-token equivalents."""
+        prompt_tokens = estimate_tokens(f"ID: 0000 — {description}\n")
+        return RESPONSE_TOKENS_PER_CLASSIFICATION + prompt_tokens * PROMPT_TOKEN_WEIGHT
+
+    def budget(self):
+        """Cost units one chunk may spend to land near target_seconds."""
+        return max(0.0, self.target_seconds - self.overhead_seconds) * self.tokens_per_second
+
+    def split(self, descriptions):
+        budget = self.budget()
+        max_items = max(1, self.max_output_tokens // RESPONSE_TOKENS_PER_CLASSIFICATION)
+        chunks = []
+        current = []
+        used = 0.0
+        for desc in descriptions:
+            cost = self.item_cost(desc)
+            over_budget = used + cost > budget and len(current) >= self.min_items
+            if current and (over_budget or len(current) >= max_items):
+                chunks.append(current)
+                current = []
+                used = 0.0
+            current.append(desc)
+            used += cost
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def observe(self, descriptions, seconds):
+        """Fold one completed call into the overhead and throughput estimates."""
+        if not descriptions or seconds <= 0:
+            return
+        cost = sum(self.item_cost(d) for d in descriptions)
+        sample = (cost, seconds, cost * cost, cost * seconds)
+        if self._moments is None:
+            self._moments = sample
+        else:
+            self._moments = tuple(m + self.smoothing * (x - m)
+                                  for m, x in zip(self._moments, sample))
+        mean_cost, mean_seconds, mean_cost2, mean_cross = self._moments
+
+        variance = mean_cost2 - mean_cost * mean_cost
+        slope = (mean_cross - mean_cost * mean_seconds) / variance if variance > 0 else 0.0
+        # Only trust the fitted line once recent calls spread over a range of
+        # sizes (±10%) and agree that bigger calls take longer
+        if variance > (0.1 * mean_cost) ** 2 and slope > 0:
+            self.tokens_per_second = 1.0 / slope
+            self.overhead_seconds = max(0.0, mean_seconds - slope * mean_cost)
+        else:
+            # One size only: keep the overhead, attribute the rest to throughput
+            spent = max(seconds - self.overhead_seconds, 0.1 * seconds)
+            self.tokens_per_second += self.smoothing * (cost / spent - self.tokens_per_second)
@@ -0,0 +1,120 @@
+"""Bundle decode time and resident memory, per decoder.
+
+Compares turning a bundle file into FhirRecords two ways:
+
+- json_load: json.load of the whole bundle, then strip_plumbing
+- typed: the msgspec schema in app/fhir_structs, fhir.read_bundle_records
+
+Each decoder runs in a fresh interpreter so peak resident memory (RSS
+above the post-import baseline) isn't shared between them.
+
+    python -m benchmarks.decode data/ckd_patient.json
+    python -m benchmarks.decode --size 50000     # a synthetic bundle of that many resources
+"""
+import argparse
+import gc
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DECODERS = ("json_load", "typed")
+
+
+def _decoder(name):
+    from app.fhir import read_bundle_records, strip_plumbing
+
+    def json_load(fp):
+        return strip_plumbing(json.load(fp))
+
+    return {"json_load": json_load, "typed": read_bundle_records}[name]
+
+
+def _status_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024     # kB
+    raise KeyError(field)
+
+
+def _reset_peak_rss():
+    """Current RSS in MB, with the peak reset to it so only what follows counts."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _status_mb("VmRSS")
+    except OSError:
+        # No procfs: the lifetime peak, which may hide anything below it
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _peak_rss():
+    try:
+        return _status_mb("VmHWM")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(name, path, repeat):
+    """Run one decoder in this process: {"ms": best of repeat, "peak_rss_mb": ..., "records": n}."""
+    decode = _decoder(name)
+    gc.collect()
+    baseline = _reset_peak_rss()
+    times = []
+    records = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with open(path, "rb") as fp:
+            records = len(decode(fp))
+        times.append((time.perf_counter() - started) * 1000)
+    return {
+        "ms": round(min(times), 2),
+        "peak_rss_mb": round(_peak_rss() - baseline, 1),
+        "records": records,
+    }
+
+
+def run(path, decoders=DECODERS, repeat=5):
+    results = {}
+    for name in decoders:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.decode", str(path), "--child", name,
+             "--repeat", str(repeat)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results[name] = json.loads(out)
+    return {"bundle": str(path), "bytes": Path(path).stat().st_size, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bundle decode time and memory per decoder.")
+    parser.add_argument("bundle", nargs="?", type=Path, default=Path("data/ckd_patient.json"))
+    parser.add_argument("--size", type=int, help="decode a synthetic bundle of this many resources")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--decoders", nargs="+", choices=DECODERS, default=list(DECODERS))
+    parser.add_argument("--child", choices=DECODERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.bundle, args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.bundle
+        if args.size:
+            from benchmarks.synthetic import write_bundle
+            path = write_bundle(args.size, Path(tmp) / "bundle.json")
+        report = run(path, args.decoders, args.repeat)
+
+    print(f"{report['bundle']} ({report['bytes'] / 2**20:.1f} MB)")
+    print(f"{'decoder':<11}{'records':>8}{'ms':>10}{'peak RSS MB':>13}")
+    for name, r in report["results"].items():
+        print(f"{name:<11}{r['records']:>8}{r['ms']:>10.2f}{r['peak_rss_mb']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
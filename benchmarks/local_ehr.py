@@ -0,0 +1,94 @@
+"""Per-patient read latency from the local EHR store, by store size.
+
+Builds a store of synthetic patients (benchmarks.synthetic, limited to the
+types the fetcher requests), then writes the bundles of randomly chosen
+patients as the fetcher would. Reports build time, store size, time to
+open the store (load the index and map the data file) and p50/p99 per-
+patient bundle time. Only a patient's own slice is read, so bundle time
+should stay flat as the store grows.
+
+    python -m benchmarks.local_ehr --patients 100 1000
+    python -m benchmarks.local_ehr --patients 2000 --keep data/ehr/patients.ndjson
+"""
+import argparse
+import io
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.fhir_client import FETCH_TYPES
+from app.local_ehr import LocalEhr, build_ehr
+from benchmarks.synthetic import synthetic_patients
+
+
+def measure(data_path, reads=200, seed=0):
+    """Open the store at data_path and time reads of random patients' bundles."""
+    started = time.perf_counter()
+    ehr = LocalEhr(data_path)
+    open_ms = (time.perf_counter() - started) * 1000
+
+    rng = random.Random(seed)
+    times = []
+    resources = 0
+    try:
+        for _ in range(reads):
+            patient_id = rng.choice(ehr.patient_ids)
+            started = time.perf_counter()
+            resources += ehr.write_bundle(patient_id, io.BytesIO())
+            times.append((time.perf_counter() - started) * 1000)
+    finally:
+        ehr.close()
+    times = np.asarray(times)
+    return {
+        "patients": len(ehr.patient_ids),
+        "open_ms": round(open_ms, 2),
+        "bundle_p50_ms": round(float(np.percentile(times, 50)), 3),
+        "bundle_p99_ms": round(float(np.percentile(times, 99)), 3),
+        "resources_per_bundle": resources // reads,
+    }
+
+
+def run(sizes, reads=200, keep=None):
+    """{size: build and read figures} for stores of each number of patients."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = Path(keep) if keep else Path(tmp) / f"ehr_{size}.ndjson"
+            started = time.perf_counter()
+            build_ehr(synthetic_patients(size, types=FETCH_TYPES), path)
+            build_s = time.perf_counter() - started
+            results[size] = {
+                "build_s": round(build_s, 2),
+                "data_mb": round(path.stat().st_size / 2**20, 1),
+                **measure(path, reads),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local EHR store read latency by size.")
+    parser.add_argument("--patients", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--reads", type=int, default=200, help="patient bundles read per size")
+    parser.add_argument("--keep", type=Path,
+                        help="write the (last) store here instead of a temp dir, for LOCAL_EHR_PATH")
+    parser.add_argument("--out", default="benchmarks/results/local_ehr.json")
+    args = parser.parse_args()
+
+    results = run(args.patients, args.reads, args.keep)
+    print(f"{'patients':>9}{'data MB':>9}{'build s':>9}{'open ms':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    for size, r in results.items():
+        print(f"{size:>9}{r['data_mb']:>9.1f}{r['build_s']:>9.2f}{r['open_ms']:>9.2f}"
+              f"{r['bundle_p50_ms']:>9.3f}{r['bundle_p99_ms']:>9.3f}")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
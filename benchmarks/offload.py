@@ -0,0 +1,198 @@
+"""API latency during a pipeline run, with and without CPU offload.
+
+Probes GET /health through the ASGI app at a fixed interval while the
+classifier stage (decode the stored bundle, classify, build the summary)
+runs on a large synthetic patient, once per CPU_OFFLOAD mode, and reports
+probe latency percentiles and stage wall time. Gemini is mocked as in
+benchmarks/pipeline.py.
+
+With FHIR_BASE_URL set, the runs first fetch the patient from that server
+through FhirClient, probed separately, so page decoding and the bundle
+store writes of the fetch stage are measured too. Serve the same synthetic
+bundle there:
+
+    python -m benchmarks.offload --size 20000 --modes off thread process
+
+    python -m benchmarks.synthetic 20000 /tmp/bundle.json
+    python -m tests.fake_fhir /tmp/bundle.json &
+    FHIR_BASE_URL=http://127.0.0.1:8091 python -m benchmarks.offload --size 20000
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.subscribers
+from app import bundle_store, fhir_client, llm, offload, pubsub
+from app.case_history import classify_case
+from app.db import Base, settings
+from app.main import app as api
+from app.pubsub import LocalPubSub, PubSubMessage
+from benchmarks.pipeline import CONDITION, DRUG, QUESTIONS, MockGemini, _meta, _reset_shared_state
+from benchmarks.synthetic import write_bundle
+
+MODES = ("off", "thread", "process")
+
+
+async def _probe(client, stop, interval):
+    """GET /health on a fixed schedule until stop is set; latencies in ms.
+
+    Latency is measured from when each probe was due, not when it was sent,
+    so a stalled loop counts against every probe it held up rather than
+    one (coordinated omission).
+    """
+    latencies = []
+    due = time.perf_counter()
+    while not stop.is_set():
+        await client.get("/health")
+        done = time.perf_counter()
+        while due <= done:
+            latencies.append((done - due) * 1000)
+            due += interval
+        await asyncio.sleep(due - done)
+    return latencies
+
+
+def _percentiles(latencies):
+    values = np.asarray(latencies)
+    return {
+        "probes": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+async def _probed(client, interval, *aws):
+    """(probe latencies, wall seconds) while the awaitables run together."""
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(client, stop, interval))
+    started = time.perf_counter()
+    results = await asyncio.gather(*aws)
+    wall = time.perf_counter() - started
+    stop.set()
+    return await probe, wall, results
+
+
+async def run_mode(mode, bundle_ref, mock, runs, interval, case_ids, patient_id=None):
+    offload.shutdown()
+    settings.cpu_offload = mode
+    os.environ["CPU_OFFLOAD"] = mode
+    await offload.run_cpu(int)      # start the pool before timing
+    _reset_shared_state()
+    llm._instance = llm.create_gateway(client=mock)
+    cases = [next(case_ids) for _ in range(runs)]
+    refs = [bundle_ref] * runs
+
+    result = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api),
+                                 base_url="http://bench") as client:
+        if patient_id is not None:
+            # A fresh ETag cache, so every mode downloads and decodes every page
+            fhir_client._instance = fhir_client.FhirClient(settings.fhir_base_url)
+            try:
+                latencies, wall, refs = await _probed(client, interval, *(
+                    app.subscribers.fetch_bundle_from_hospital(case_id, patient_id)
+                    for case_id in cases
+                ))
+            finally:
+                await fhir_client._instance.aclose()
+                fhir_client._instance = None
+            result["fetch"] = {**_percentiles(latencies), "wall_s": round(wall, 3)}
+
+        latencies, wall, _ = await _probed(client, interval, *(
+            app.subscribers.handle_fhir_records_ready(PubSubMessage({
+                "request_id": 0, "case_id": case_id, "condition": CONDITION, "drug": DRUG,
+                "questions": QUESTIONS, "bundle_ref": ref,
+            }))
+            for case_id, ref in zip(cases, refs)
+        ))
+
+    return {**_percentiles(latencies), "pipeline_wall_s": round(wall, 3), **result}
+
+
+async def run(size, modes=MODES, runs=2, interval=0.005, latency_ms=20.0, patient_id=None):
+    """{"meta": ..., "results": {mode: probe percentiles and stage wall time}}.
+
+    patient_id, with FHIR_BASE_URL set, is fetched from that server on every run.
+    """
+    mock = MockGemini(latency_ms=latency_ms)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        # Spawned worker processes read settings from the environment
+        os.environ["BUNDLE_STORE_PATH"] = settings.bundle_store_path = str(workdir / "bundles")
+        bundle_store._instance = None
+        with open(write_bundle(size, workdir / "bundle.json"), "rb") as f:
+            bundle_ref = bundle_store.get_bundle_store().put(f)
+        if settings.fhir_base_url and patient_id is None:
+            patient_id = _patient_id(workdir / "bundle.json")
+
+        engine = create_async_engine(f"sqlite+aiosqlite:///{workdir / 'bench.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        app.subscribers.classify_case = functools.partial(
+            classify_case, session_factory=async_sessionmaker(engine, expire_on_commit=False),
+        )
+        pubsub._instance = LocalPubSub()
+        pubsub._instance.create_topic("records-classified")     # published to, not consumed
+
+        case_ids = iter(range(1, 1_000_000))
+        try:
+            for mode in modes:
+                results[mode] = await run_mode(mode, bundle_ref, mock, runs, interval, case_ids,
+                                               patient_id if settings.fhir_base_url else None)
+        finally:
+            offload.shutdown()
+            await engine.dispose()
+
+    meta = _meta(latency_ms, 0.0, mock.relevant_rate)
+    meta.update(size=size, runs=runs, probe_interval_ms=interval * 1000,
+                offload_workers=settings.cpu_offload_workers,
+                fhir_base_url=settings.fhir_base_url or None)
+    return {"meta": meta, "results": results}
+
+
+def _patient_id(bundle_path):
+    with open(bundle_path, "rb") as f:
+        return json.load(f)["entry"][0]["resource"]["id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API latency with and without CPU offload.")
+    parser.add_argument("--size", type=int, default=20_000, help="resources in the bundle")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--runs", type=int, default=2, help="concurrent pipeline runs per mode")
+    parser.add_argument("--interval-ms", type=float, default=5.0, help="time between probes")
+    parser.add_argument("--latency-ms", type=float, default=20.0,
+                        help="mocked Gemini latency per call")
+    parser.add_argument("--patient-id",
+                        help="patient to fetch when FHIR_BASE_URL is set (default: the synthetic one)")
+    parser.add_argument("--out", default="benchmarks/results/offload.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.size, args.modes, args.runs, args.interval_ms / 1000,
+                             args.latency_ms, args.patient_id))
+    print(f"{'mode':<9}{'stage':<10}{'probes':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'wall s':>9}")
+    for mode, r in report["results"].items():
+        stages = [("fetch", r["fetch"], r["fetch"]["wall_s"])] if "fetch" in r else []
+        for stage, m, wall in stages + [("classify", r, r["pipeline_wall_s"])]:
+            print(f"{mode:<9}{stage:<10}{m['probes']:>8}{m['p50_ms']:>9.2f}{m['p99_ms']:>9.2f}"
+                  f"{m['max_ms']:>9.2f}{wall:>9.3f}")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
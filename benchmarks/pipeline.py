@@ -0,0 +1,279 @@
+"""End-to-end benchmark of the prior auth pipeline stages.
+
+For each bundle size, runs every stage on a synthetic patient (see
+benchmarks/synthetic.py) through the functions the pub/sub handlers call,
+and records wall time, CPU time, peak traced memory and LLM call count per
+stage. The CPU-bound stages are called directly rather than through
+run_cpu, so their time and memory are counted here. Gemini is replaced by an in-process
+double with configurable latency, so runs are repeatable and free.
+
+    python -m benchmarks.pipeline --sizes 1000 10000 50000 --out benchmarks/results/pipeline.json
+
+Compare against a saved run and fail on regressions:
+
+    python -m benchmarks.pipeline --baseline benchmarks/results/main.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import gc
+import inspect
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.subscribers
+from app import bundle_store, classification_cache, llm, relevance_model, similarity
+from app.db import Base, settings
+from app.case_history import classify_case
+from app.models import Applicant, Case
+from app.models_prior_auth import PriorAuthRequest
+from app.pubsub import PubSubMessage
+from app.subscribers import (
+    answer_questions_with_llm, build_summary, fetch_bundle_from_hospital,
+    handle_prior_auth_answered, load_bundle_records,
+)
+from benchmarks.gemini_responses import respond
+from benchmarks.synthetic import write_bundle
+
+DEFAULT_SIZES = (1000, 10_000, 50_000)
+STAGES = (
+    "fetch_bundle_from_hospital",
+    "load_bundle_records",
+    "classify_case",
+    "build_summary",
+    "answer_questions_with_llm",
+    "handle_prior_auth_answered",
+)
+METRICS = ("wall_s", "cpu_s", "peak_mem_mb", "llm_calls")
+# Differences below these are noise, whatever the ratio
+NOISE_FLOOR = {"wall_s": 0.01, "cpu_s": 0.01, "peak_mem_mb": 1.0, "llm_calls": 0}
+
+CONDITION = "Rheumatoid arthritis"
+DRUG = "Humira (adalimumab)"
+QUESTIONS = [
+    "Does the patient have a documented diagnosis of rheumatoid arthritis?",
+    "Has the patient tried and failed methotrexate or another conventional DMARD?",
+    "Are there recent inflammatory markers supporting active disease?",
+]
+
+
+class MockGemini:
+    """Stands in for genai.Client's async generate_content."""
+
+    def __init__(self, latency_ms=0.0, latency_per_item_ms=0.0, relevant_rate=0.3):
+        self.latency_ms = latency_ms
+        self.latency_per_item_ms = latency_per_item_ms
+        self.relevant_rate = relevant_rate
+        self.calls = 0
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self._agenerate))
+
+    def _respond(self, contents, config):
+        self.calls += 1
+        payload, items = respond(contents, config.get("response_json_schema"), self.relevant_rate)
+        delay = (self.latency_ms + self.latency_per_item_ms * items) / 1000
+        return SimpleNamespace(text=json.dumps(payload)), delay
+
+    async def _agenerate(self, model, contents, config):
+        response, delay = self._respond(contents, config)
+        await asyncio.sleep(delay)
+        return response
+
+
+async def _measure(results, name, mock, trace_memory, fn, *args):
+    """Run one stage, recording its metrics under results[name]."""
+    gc.collect()
+    if trace_memory:
+        # Tracing slows allocation-heavy stages down; it's off for timing-only runs
+        tracemalloc.start()
+    calls = mock.calls
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    out = fn(*args)
+    if inspect.isawaitable(out):
+        out = await out
+
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    peak = None
+    if trace_memory:
+        peak = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        tracemalloc.stop()
+    results[name] = {
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "peak_mem_mb": peak,
+        "llm_calls": mock.calls - calls,
+    }
+    return out
+
+
+def _reset_shared_state():
+    """Fresh caches per run, so one size doesn't warm the next."""
+    classification_cache._instance = classification_cache.ClassificationCache(session_factory=None)
+    similarity._instance = None
+    relevance_model._instance = None
+    relevance_model._loaded = True
+
+
+async def _seed_request(session_factory):
+    async with session_factory() as db:
+        applicant = Applicant(full_name="Benchmark Patient")
+        case = Case(applicant=applicant, narrative="Benchmark run.")
+        db.add(case)
+        await db.flush()
+        request = PriorAuthRequest(
+            case_id=case.id, condition=CONDITION, drug=DRUG, questions=QUESTIONS,
+        )
+        db.add(request)
+        await db.commit()
+        return request.id, case.id
+
+
+async def run_size(size, workdir, mock, trace_memory=True):
+    bundle_path = write_bundle(size, workdir / f"bundle_{size}.json")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{workdir / f'bench_{size}.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    request_id, case_id = await _seed_request(session_factory)
+
+    _reset_shared_state()
+    app.subscribers.SAMPLE_BUNDLE_PATH = bundle_path
+    app.subscribers.SessionLocal = session_factory
+    bundle_store._instance = bundle_store.LocalBundleStore(workdir / "bundles")
+    llm._instance = llm.create_gateway(client=mock)
+
+    results = {}
+
+    async def measure(name, fn, *args):
+        return await _measure(results, name, mock, trace_memory, fn, *args)
+
+    bundle_ref = await measure("fetch_bundle_from_hospital", fetch_bundle_from_hospital, case_id)
+    records = await measure("load_bundle_records", load_bundle_records, bundle_ref)
+    relevant = await measure("classify_case", classify_case, case_id, records, CONDITION, DRUG,
+                             session_factory)
+    summary, _, budget = await measure("build_summary", build_summary, relevant, QUESTIONS)
+    answers = await measure("answer_questions_with_llm", answer_questions_with_llm,
+                            summary, QUESTIONS)
+
+    message = PubSubMessage({
+        "request_id": request_id,
+        "case_id": case_id,
+        "answers": answers,
+        "summary_budget": budget._asdict(),
+    })
+    await measure("handle_prior_auth_answered", handle_prior_auth_answered, message)
+
+    await engine.dispose()
+    results["_counts"] = {"records": len(records), "relevant": len(relevant)}
+    return results
+
+
+async def run(sizes, latency_ms=0.0, latency_per_item_ms=0.0, relevant_rate=0.3,
+              trace_memory=True):
+    """{"meta": ..., "results": {size: {stage: metrics}}} for each bundle size."""
+    mock = MockGemini(latency_ms, latency_per_item_ms, relevant_rate)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            results[str(size)] = await run_size(size, Path(tmp), mock, trace_memory)
+    meta = _meta(latency_ms, latency_per_item_ms, relevant_rate)
+    meta["trace_memory"] = trace_memory
+    meta["qa_batch_questions"] = settings.qa_batch_questions
+    return {"meta": meta, "results": results}
+
+
+def _meta(latency_ms, latency_per_item_ms, relevant_rate):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "llm": {
+            "latency_ms": latency_ms,
+            "latency_per_item_ms": latency_per_item_ms,
+            "relevant_rate": relevant_rate,
+        },
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Human-readable regressions of current against baseline, beyond tolerance and noise."""
+    regressions = []
+    for size, stages in current["results"].items():
+        base_stages = baseline.get("results", {}).get(size)
+        if base_stages is None:
+            continue
+        for stage in STAGES:
+            for metric in METRICS:
+                new = stages.get(stage, {}).get(metric)
+                old = base_stages.get(stage, {}).get(metric)
+                if new is None or old is None:
+                    continue
+                if new > old * (1 + tolerance) and new - old > NOISE_FLOOR[metric]:
+                    regressions.append(f"{size} resources, {stage}: {metric} {old} -> {new}")
+    return regressions
+
+
+def _print_table(report):
+    print(f"{'size':>7}  {'stage':<28}{'wall s':>9}{'cpu s':>9}{'peak MB':>10}{'llm':>6}")
+    for size, stages in report["results"].items():
+        for stage in STAGES:
+            m = stages[stage]
+            peak = "-" if m["peak_mem_mb"] is None else f"{m['peak_mem_mb']:.1f}"
+            print(f"{size:>7}  {stage:<28}{m['wall_s']:>9.3f}{m['cpu_s']:>9.3f}"
+                  f"{peak:>10}{m['llm_calls']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prior auth pipeline stages.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--latency-ms", type=float, default=200.0,
+                        help="mocked Gemini latency per call")
+    parser.add_argument("--latency-per-item-ms", type=float, default=5.0,
+                        help="extra mocked latency per classified description")
+    parser.add_argument("--relevant-rate", type=float, default=0.3)
+    parser.add_argument("--qa-batch", action="store_true",
+                        help="answer all questions in one call (QA_BATCH_QUESTIONS)")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip tracemalloc; timings are closer to production but peak memory isn't reported")
+    parser.add_argument("--out", default="benchmarks/results/pipeline.json")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed fractional increase before a metric counts as a regression")
+    args = parser.parse_args()
+    settings.qa_batch_questions = args.qa_batch
+
+    report = asyncio.run(run(args.sizes, args.latency_ms, args.latency_per_item_ms,
+                             args.relevant_rate, trace_memory=not args.no_memory))
+    _print_table(report)
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Scale the Synthea bundles in data/ up to benchmark-sized patients.
+
+Entries from every source bundle are replayed until the target count is
+reached. Each copy gets fresh ids and fullUrls, is shifted back in time by
+a whole number of years per pass, and has numeric values jittered, so lab
+series grow longer instead of repeating the same draw. One Patient resource
+is kept; the resource mix otherwise follows the sources.
+
+    python -m benchmarks.synthetic 10000 /tmp/bundle_10k.json
+"""
+import argparse
+import copy
+import json
+import random
+import re
+import uuid
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+DEFAULT_SOURCES = sorted(DATA_DIR.glob("*.json"))
+
+_DATE = re.compile(r"^(\d{4})(-\d{2}-\d{2}.*)?$")
+_DATE_KEYS = {
+    "effectiveDateTime", "issued", "onsetDateTime", "recordedDate", "abatementDateTime",
+    "authoredOn", "performedDateTime", "start", "end", "date",
+}
+
+
+def _load_entries(sources):
+    patient = None
+    entries = []
+    for path in sources:
+        with open(path, "rb") as f:
+            bundle = json.load(f)
+        for entry in bundle.get("entry", []):
+            if entry.get("resource", {}).get("resourceType") == "Patient":
+                patient = patient or entry
+            else:
+                entries.append(entry)
+    return patient, entries
+
+
+def _shift_dates(node, years):
+    """Move every date-ish value back `years` years, in place."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if isinstance(value, str) and key in _DATE_KEYS:
+                m = _DATE.match(value)
+                if m:
+                    node[key] = f"{int(m.group(1)) - years:04d}{m.group(2) or ''}"
+            else:
+                _shift_dates(value, years)
+    elif isinstance(node, list):
+        for item in node:
+            _shift_dates(item, years)
+
+
+def scale_bundle(total_resources, sources=DEFAULT_SOURCES, seed=0):
+    """A transaction Bundle with exactly total_resources entries, Patient first."""
+    rng = random.Random(seed)
+    patient, entries = _load_entries(sources)
+    if patient is None or not entries:
+        raise ValueError("Source bundles need a Patient and at least one other resource")
+
+    out = [patient]
+    generation = 0
+    while len(out) < total_resources:
+        for entry in entries:
+            if len(out) >= total_resources:
+                break
+            if generation == 0:
+                out.append(entry)
+                continue
+
+            entry = copy.deepcopy(entry)
+            resource = entry["resource"]
+            new_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            resource["id"] = new_id
+            entry["fullUrl"] = f"urn:uuid:{new_id}"
+            _shift_dates(resource, generation)
+            quantity = resource.get("valueQuantity")
+            if isinstance(quantity, dict) and isinstance(quantity.get("value"), (int, float)):
+                quantity["value"] = round(quantity["value"] * rng.uniform(0.9, 1.1), 2)
+            out.append(entry)
+        generation += 1
+
+    return {"resourceType": "Bundle", "type": "transaction", "entry": out}
+
+
+_UUID = re.compile(r"([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-)([0-9a-f]{12})")
+
+
+def synthetic_patients(count, sources=DEFAULT_SOURCES, types=None):
+    """(patient id, resources) for count distinct patients, cycling through the sources.
+
+    Copy i of a source has every UUID in it (resource ids and the references
+    between them) XORed with i in its last 48 bits, so ids stay unique across
+    patients and references still resolve. types limits the resource types kept.
+    """
+    charts = []
+    for path in sources:
+        with open(path, "rb") as f:
+            resources = [e["resource"] for e in json.load(f).get("entry", []) if "resource" in e]
+        if types is not None:
+            resources = [r for r in resources if r["resourceType"] in types]
+        charts.append(json.dumps(resources, separators=(",", ":")))
+
+    for i in range(count):
+        def reid(m, i=i):
+            return f"{m.group(1)}{int(m.group(2), 16) ^ i:012x}"
+        resources = json.loads(_UUID.sub(reid, charts[i % len(charts)]))
+        [patient] = [r for r in resources if r["resourceType"] == "Patient"]
+        yield patient["id"], resources
+
+
+def write_bundle(total_resources, path, sources=DEFAULT_SOURCES, seed=0):
+    with open(path, "w") as f:
+        json.dump(scale_bundle(total_resources, sources, seed), f)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a scaled synthetic FHIR bundle.")
+    parser.add_argument("resources", type=int)
+    parser.add_argument("out")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_bundle(args.resources, args.out, seed=args.seed)
+    print(f"Wrote {args.resources} resources to {args.out}")
@@ -1,3 +1,5 @@
+from unittest.mock import MagicMock
+
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
@@ -6,6 +8,7 @@ from sqlalchemy.pool import StaticPool
 
 from app.main import app
 from app.db import Base, get_db, settings
+from app import bundle_store, classification_cache, llm, relevance_model, similarity
 
 settings.api_key = "test-api-key"   # override before any tests run
 
@@ -99,4 +102,51 @@ def auth_headers():
     Returns headers with a valid API key.
     Tests that need auth request this fixture.
     """
-    return {"X-API-Key": "test-api-key"}
\ No newline at end of file
+    return {"X-API-Key": "test-api-key"}
+
+
+@pytest.fixture(autouse=True)
+def memory_classification_cache(monkeypatch):
+    """
+    Gives every test its own memory-only classification cache.
+    Without this, verdicts cached by one test would leak into the next,
+    and the Postgres tier would try to reach a real database.
+    """
+    cache = classification_cache.ClassificationCache(session_factory=None)
+    monkeypatch.setattr(classification_cache, "_instance", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_similarity_index(monkeypatch):
+    """Gives every test an empty near-duplicate index."""
+    index = similarity.SimilarityIndex()
+    monkeypatch.setattr(similarity, "_instance", index)
+    return index
+
+
+@pytest.fixture(autouse=True)
+def no_relevance_model(monkeypatch):
+    """Keeps a locally trained model file from changing what reaches Gemini."""
+    monkeypatch.setattr(relevance_model, "_instance", None)
+    monkeypatch.setattr(relevance_model, "_loaded", True)
+
+
+@pytest.fixture(autouse=True)
+def gemini_gateway(monkeypatch):
+    """
+    Gives every test its own LLM gateway, with no real Gemini client and
+    no retry backoff. Tests swap in a fake with gateway.client = ...
+    """
+    monkeypatch.setattr(llm.settings, "llm_retry_base_seconds", 0)
+    gateway = llm.create_gateway(client=MagicMock())
+    monkeypatch.setattr(llm, "_instance", gateway)
+    return gateway
+
+
+@pytest.fixture(autouse=True)
+def temp_bundle_store(monkeypatch, tmp_path):
+    """Keeps bundles written by the pipeline out of data/bundles."""
+    store = bundle_store.LocalBundleStore(tmp_path / "bundles")
+    monkeypatch.setattr(bundle_store, "_instance", store)
+    return store
@@ -0,0 +1,188 @@
+"""Local stand-in for a hospital FHIR R4 server.
+
+Serves the Synthea bundles in data/ as per-type searches
+(`GET /Observation?patient=<id>&_count=50`), paged with `next` links and
+answering If-None-Match with 304 when a search's results are unchanged,
+so the EHR client can be exercised and measured without a network.
+
+    python -m tests.fake_fhir --port 8091 --latency-ms 40
+    FHIR_BASE_URL=http://127.0.0.1:8091 uvicorn app.main:app
+
+With --ehr it serves a local EHR store (app/local_ehr.py) instead, so
+thousands of patients can be fetched without loading them all:
+
+    python -m tests.fake_fhir --ehr data/ehr/patients.ndjson
+
+GET /_stats reports requests, statuses and bytes served.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+from pathlib import Path
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from pydantic import BaseModel
+
+from app.local_ehr import LocalEhr
+from tests.fake_gemini import serve_app
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+DEFAULT_BUNDLES = (DATA_DIR / "sample_patient.json", DATA_DIR / "ckd_patient.json")
+
+
+class FakeFhirConfig(BaseModel):
+    latency_ms: float = 0.0         # added to every request
+    etags: bool = True
+    # "search": page 1's ETag covers the whole result set, and only page 1
+    # answers If-None-Match. "page": every page has its own ETag.
+    etag_scope: str = "search"
+
+
+class _Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.statuses = {}
+        self.bytes_sent = 0
+        self.types = {}
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "bytes_sent": self.bytes_sent,
+            "types": dict(sorted(self.types.items())),
+        }
+
+
+def load_patients(paths=DEFAULT_BUNDLES):
+    """{patient id: {resource type: [resources]}} from Synthea bundles, one patient each."""
+    patients = {}
+    for path in paths:
+        by_type = {}
+        for entry in json.loads(Path(path).read_text())["entry"]:
+            resource = entry["resource"]
+            by_type.setdefault(resource["resourceType"], []).append(resource)
+        [patient] = by_type["Patient"]
+        patients[patient["id"]] = by_type
+    return patients
+
+
+class EhrPatients:
+    """load_patients-shaped view of a LocalEhr; a type is read when it's searched."""
+
+    def __init__(self, ehr):
+        self.ehr = ehr
+
+    def get(self, patient_id, default=None):
+        return _EhrPatient(self.ehr, patient_id) if patient_id in self.ehr else default
+
+
+class _EhrPatient:
+    def __init__(self, ehr, patient_id):
+        self.ehr = ehr
+        self.patient_id = patient_id
+
+    def get(self, rtype, default=None):
+        return self.ehr.resources(self.patient_id, rtype) or default
+
+
+def _etag(resources):
+    raw = json.dumps(resources, sort_keys=True).encode("utf-8")
+    return f'W/"{hashlib.sha1(raw).hexdigest()}"'
+
+
+def create_app(config=None, patients=None):
+    app = FastAPI(title="Fake FHIR")
+    app.state.config = config or FakeFhirConfig()
+    app.state.patients = load_patients() if patients is None else patients
+    app.state.stats = _Stats()
+
+    def _send(status, body=None, headers=None):
+        stats = app.state.stats
+        content = b"" if body is None else json.dumps(body).encode("utf-8")
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        stats.bytes_sent += len(content)
+        return Response(content, status_code=status, headers=headers,
+                        media_type=None if body is None else "application/fhir+json")
+
+    @app.get("/_stats")
+    async def get_stats():
+        return app.state.stats.as_dict()
+
+    @app.get("/{rtype}")
+    async def search(rtype: str, request: Request):
+        stats = app.state.stats
+        stats.requests += 1
+        stats.types[rtype] = stats.types.get(rtype, 0) + 1
+        if app.state.config.latency_ms:
+            await asyncio.sleep(app.state.config.latency_ms / 1000)
+
+        params = request.query_params
+        patient_id = params.get("_id" if rtype == "Patient" else "patient", "")
+        if patient_id.startswith("Patient/"):
+            patient_id = patient_id.removeprefix("Patient/")
+        count = int(params.get("_count", 50))
+        offset = int(params.get("_offset", 0))
+
+        resources = app.state.patients.get(patient_id, {}).get(rtype, [])
+        page = resources[offset:offset + count]
+        headers = {}
+        if app.state.config.etags:
+            if app.state.config.etag_scope == "page":
+                # The page's entries and whether it links to a next page
+                headers["ETag"] = _etag([offset, page, offset + count < len(resources)])
+                conditional = True
+            else:
+                # Covers the whole result set, so it only changes when some page does
+                headers["ETag"] = _etag(resources)
+                conditional = offset == 0
+            if conditional and request.headers.get("If-None-Match") == headers["ETag"]:
+                return _send(304, headers=headers)
+
+        bundle = {
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "total": len(resources),
+            "link": [{"relation": "self", "url": str(request.url)}],
+            "entry": [
+                {"fullUrl": f"{request.base_url}{rtype}/{r['id']}", "resource": r,
+                 "search": {"mode": "match"}}
+                for r in page
+            ],
+        }
+        if offset + count < len(resources):
+            next_url = request.url.include_query_params(_offset=offset + count)
+            bundle["link"].append({"relation": "next", "url": str(next_url)})
+        return _send(200, bundle, headers)
+
+    return app
+
+
+def serve(config=None, patients=None, host="127.0.0.1", port=0):
+    """Run a fake FHIR server on a background thread; yields (base_url, app)."""
+    return serve_app(create_app(config, patients), host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--no-etags", dest="etags", action="store_false")
+    parser.add_argument("--etag-scope", choices=("search", "page"), default="search")
+    parser.add_argument("--ehr", type=Path, help="serve this local EHR store instead of bundles")
+    parser.add_argument("bundles", nargs="*", type=Path, default=list(DEFAULT_BUNDLES))
+    args = vars(parser.parse_args())
+
+    host, port, bundles, ehr = (args.pop(k) for k in ("host", "port", "bundles", "ehr"))
+    patients = EhrPatients(LocalEhr(ehr)) if ehr else load_patients(bundles)
+    uvicorn.run(create_app(FakeFhirConfig(**args), patients), host=host, port=port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Local stand-in for Gemini's generateContent endpoint.
+
+Answers with schema-valid BatchClassification and PriorAuthQA JSON so
+classify_relevance and answer_questions_with_llm can run at scale without
+a network, and injects the failure modes we need to tune concurrency,
+retries and backpressure against: latency, 429s, 5xx and truncated JSON.
+
+Point the app at it with GEMINI_BASE_URL:
+
+    python -m tests.fake_gemini --port 8090 --latency lognormal --latency-ms 800 --rate-429 0.05
+    GEMINI_BASE_URL=http://127.0.0.1:8090 uvicorn app.main:app
+
+Fault settings can be changed while it runs with PUT /_config, and
+GET /_stats reports what it has served.
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+from app.tokens import estimate_tokens
+from benchmarks.gemini_responses import respond
+
+
+class FakeGeminiConfig(BaseModel):
+    latency: str = Field("fixed", pattern="^(fixed|uniform|lognormal)$")
+    latency_ms: float = 0.0             # fixed value, uniform midpoint or lognormal median
+    latency_spread: float = 0.5         # uniform +/- fraction, or lognormal sigma
+    latency_per_item_ms: float = 0.0    # extra per classified resource, like output generation
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    truncate_rate: float = 0.0
+    max_concurrency: int = 0            # more requests in flight than this get 429 (0 = unlimited)
+    requests_per_minute: int = 0        # rolling quota; over it gets 429 (0 = unlimited)
+    relevant_rate: float = 0.3          # share of descriptions classified relevant
+    token_scale: float = 1.0            # multiplier on reported token counts
+    retry_after_seconds: float = 0.0    # suggested on 429s, as Retry-After and RetryInfo (0 = none)
+    seed: int | None = None
+
+
+class _Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.statuses = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.items = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "items": self.items,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+
+def _error(status, code_name, message, retry_after=0.0):
+    error = {"code": status, "message": message, "status": code_name}
+    headers = None
+    if retry_after:
+        error["details"] = [{
+            "@type": "type.googleapis.com/google.rpc.RetryInfo",
+            "retryDelay": f"{retry_after:g}s",
+        }]
+        headers = {"Retry-After": f"{retry_after:g}"}
+    return JSONResponse(status_code=status, content={"error": error}, headers=headers)
+
+
+def create_app(config=None):
+    app = FastAPI(title="Fake Gemini")
+    app.state.config = config or FakeGeminiConfig()
+    app.state.stats = stats = _Stats()
+    app.state.rng = random.Random(app.state.config.seed)
+    recent = []     # request start times, for the rolling quota
+
+    def latency(items):
+        cfg, rng = app.state.config, app.state.rng
+        if cfg.latency == "uniform":
+            base = rng.uniform(cfg.latency_ms * (1 - cfg.latency_spread),
+                               cfg.latency_ms * (1 + cfg.latency_spread))
+        elif cfg.latency == "lognormal":
+            base = cfg.latency_ms * rng.lognormvariate(0.0, cfg.latency_spread)
+        else:
+            base = cfg.latency_ms
+        return max(0.0, base + cfg.latency_per_item_ms * items) / 1000
+
+    @app.post("/{version}/models/{target}")
+    async def generate_content(version: str, target: str, request: Request):
+        model, _, method = target.partition(":")
+        if method != "generateContent":
+            raise HTTPException(status_code=404, detail=f"Unsupported method {method!r}")
+
+        cfg, rng = app.state.config, app.state.rng
+        stats.requests += 1
+        now = time.monotonic()
+        recent[:] = [t for t in recent if now - t < 60]
+        recent.append(now)
+
+        status = 200
+        stats.in_flight += 1
+        stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+        try:
+            if cfg.max_concurrency and stats.in_flight > cfg.max_concurrency:
+                status = 429
+                return _error(429, "RESOURCE_EXHAUSTED", "Too many concurrent requests",
+                              cfg.retry_after_seconds)
+            if cfg.requests_per_minute and len(recent) > cfg.requests_per_minute:
+                status = 429
+                return _error(429, "RESOURCE_EXHAUSTED", "Quota exceeded for requests per minute",
+                              cfg.retry_after_seconds)
+            if rng.random() < cfg.rate_429:
+                status = 429
+                return _error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted",
+                              cfg.retry_after_seconds)
+
+            body = await request.json()
+            prompt = "\n".join(
+                part.get("text", "")
+                for content in body.get("contents", [])
+                for part in content.get("parts", [])
+            )
+            schema = body.get("generationConfig", {}).get("responseJsonSchema")
+            payload, items = respond(prompt, schema, cfg.relevant_rate)
+
+            await asyncio.sleep(latency(items))
+
+            if rng.random() < cfg.rate_5xx:
+                status = rng.choice((500, 503))
+                name = "INTERNAL" if status == 500 else "UNAVAILABLE"
+                return _error(status, name, "The model is overloaded. Please try again later.")
+
+            text = json.dumps(payload)
+            if rng.random() < cfg.truncate_rate:
+                text = text[:len(text) // 2]
+
+            prompt_tokens = int(estimate_tokens(prompt) * cfg.token_scale)
+            output_tokens = int(estimate_tokens(text) * cfg.token_scale)
+            stats.items += items
+            stats.prompt_tokens += prompt_tokens
+            stats.output_tokens += output_tokens
+            return {
+                "candidates": [{
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "MAX_TOKENS" if len(text) < len(json.dumps(payload)) else "STOP",
+                    "index": 0,
+                }],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_tokens,
+                    "candidatesTokenCount": output_tokens,
+                    "totalTokenCount": prompt_tokens + output_tokens,
+                },
+                "modelVersion": model,
+            }
+        finally:
+            stats.in_flight -= 1
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    @app.get("/_config")
+    async def get_config():
+        return app.state.config
+
+    @app.put("/_config")
+    async def put_config(config: FakeGeminiConfig):
+        app.state.config = config
+        app.state.rng = random.Random(config.seed)
+        return config
+
+    @app.get("/_stats")
+    async def get_stats():
+        return stats.as_dict()
+
+    @app.post("/_reset")
+    async def reset():
+        stats.reset()
+        recent.clear()
+        return stats.as_dict()
+
+    return app
+
+
+@contextmanager
+def serve(config=None, host="127.0.0.1", port=0):
+    """Run a fake Gemini on a background thread; yields (base_url, app)."""
+    with serve_app(create_app(config), host, port) as served:
+        yield served
+
+
+@contextmanager
+def serve_app(app, host="127.0.0.1", port=0):
+    """Run an ASGI app with uvicorn on a background thread; yields (base_url, app)."""
+    if port == 0:
+        with socket.socket() as s:
+            s.bind((host, 0))
+            port = s.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://{host}:{port}", app
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", choices=("fixed", "uniform", "lognormal"), default="fixed")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--latency-per-item-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    parser.add_argument("--requests-per-minute", type=int, default=0)
+    parser.add_argument("--relevant-rate", type=float, default=0.3)
+    parser.add_argument("--token-scale", type=float, default=1.0)
+    parser.add_argument("--retry-after-seconds", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = vars(parser.parse_args())
+
+    host, port = args.pop("host"), args.pop("port")
+    uvicorn.run(create_app(FakeGeminiConfig(**args)), host=host, port=port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+
+import app.fhir
+import app.subscribers
+from app import bundle_store, classification_cache, llm, offload, pubsub, relevance_model, similarity
+from benchmarks import decode as decode_benchmark
+from benchmarks import offload as offload_benchmark
+from benchmarks.pipeline import STAGES, compare, run
+from benchmarks.synthetic import DATA_DIR, scale_bundle, synthetic_patients
+
+
+def test_scale_bundle_reaches_target_with_unique_ids():
+    bundle = scale_bundle(3000)
+
+    entries = bundle["entry"]
+    assert len(entries) == 3000
+    assert entries[0]["resource"]["resourceType"] == "Patient"
+    assert sum(e["resource"]["resourceType"] == "Patient" for e in entries) == 1
+    ids = [e["resource"]["id"] for e in entries]
+    assert len(set(ids)) == len(ids)
+
+
+def test_scale_bundle_shifts_copies_back_in_time():
+    source = DATA_DIR / "sample_patient.json"
+    originals = len(json.loads(source.read_text())["entry"]) - 1    # minus the Patient
+
+    entries = scale_bundle(1 + 2 * originals, sources=[source])["entry"]
+    i = next(i for i, e in enumerate(entries) if "effectiveDateTime" in e["resource"])
+    original, copy = entries[i]["resource"], entries[i + originals]["resource"]
+
+    assert int(copy["effectiveDateTime"][:4]) == int(original["effectiveDateTime"][:4]) - 1
+    assert copy["effectiveDateTime"][4:] == original["effectiveDateTime"][4:]
+    assert copy["id"] != original["id"]
+
+
+def test_synthetic_patients_are_distinct_and_keep_their_references():
+    patients = list(synthetic_patients(4, types={"Patient", "Condition", "Encounter"}))
+
+    assert len({pid for pid, _ in patients}) == 4
+    ids = [r["id"] for _, resources in patients for r in resources]
+    assert len(ids) == len(set(ids))
+    for patient_id, resources in patients:
+        assert {r["resourceType"] for r in resources} <= {"Patient", "Condition", "Encounter"}
+        encounters = {f"urn:uuid:{r['id']}" for r in resources if r["resourceType"] == "Encounter"}
+        for condition in (r for r in resources if r["resourceType"] == "Condition"):
+            assert condition["subject"]["reference"] == f"urn:uuid:{patient_id}"
+            assert condition["encounter"]["reference"] in encounters
+
+def test_compare_flags_regressions_beyond_tolerance_and_noise():
+    baseline = {"results": {"1000": {
+        "classify_case": {"wall_s": 1.0, "cpu_s": 0.5, "peak_mem_mb": 10.0, "llm_calls": 4},
+        "load_bundle_records": {"wall_s": 0.001, "cpu_s": 0.001, "peak_mem_mb": 0.1, "llm_calls": 0},
+    }}}
+    current = {"results": {"1000": {
+        "classify_case": {"wall_s": 1.1, "cpu_s": 0.5, "peak_mem_mb": 10.0, "llm_calls": 9},
+        "load_bundle_records": {"wall_s": 0.004, "cpu_s": 0.001, "peak_mem_mb": 0.1, "llm_calls": 0},
+    }}}
+
+    regressions = compare(current, baseline, tolerance=0.25)
+
+    assert regressions == ["1000 resources, classify_case: llm_calls 4 -> 9"]
+
+
+async def test_pipeline_benchmark_reports_every_stage(monkeypatch):
+    # run() rewires module globals; register them so they're restored afterwards
+    for module, name in [
+        (app.subscribers, "SAMPLE_BUNDLE_PATH"), (app.subscribers, "SessionLocal"),
+        (llm, "_instance"), (bundle_store, "_instance"),
+        (classification_cache, "_instance"), (similarity, "_instance"),
+        (relevance_model, "_instance"), (relevance_model, "_loaded"),
+    ]:
+        monkeypatch.setattr(module, name, getattr(module, name))
+    monkeypatch.setattr(app.fhir._coalescer, "window_seconds", 0)
+
+    report = await run([300])
+
+    stages = report["results"]["300"]
+    assert set(STAGES) <= set(stages)
+    assert all(stages[s]["wall_s"] > 0 and stages[s]["peak_mem_mb"] > 0 for s in STAGES)
+    assert stages["load_bundle_records"]["llm_calls"] == 0
+    assert stages["classify_case"]["llm_calls"] > 0
+    assert stages["build_summary"]["llm_calls"] == 0
+    assert stages["answer_questions_with_llm"]["llm_calls"] == 3
+    assert 0 < report["results"]["300"]["_counts"]["relevant"] < 300
+
+
+async def test_offload_benchmark_reports_probe_latency_per_mode(monkeypatch):
+    for module, name in [
+        (app.subscribers, "classify_case"), (pubsub, "_instance"), (llm, "_instance"),
+        (bundle_store, "_instance"),
+        (classification_cache, "_instance"), (similarity, "_instance"),
+        (relevance_model, "_instance"), (relevance_model, "_loaded"),
+        (offload.settings, "cpu_offload"), (offload.settings, "bundle_store_path"),
+    ]:
+        monkeypatch.setattr(module, name, getattr(module, name))
+    for var in ("BUNDLE_STORE_PATH", "CPU_OFFLOAD"):
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setattr(app.fhir._coalescer, "window_seconds", 0)
+
+    report = await offload_benchmark.run(300, modes=("off", "thread"), runs=1, latency_ms=0)
+
+    assert set(report["results"]) == {"off", "thread"}
+    for result in report["results"].values():
+        assert result["probes"] > 0
+        assert result["p99_ms"] >= result["p50_ms"]
+
+
+def test_decode_benchmark_decoders_agree_on_record_count():
+    report = decode_benchmark.run(DATA_DIR / "sample_patient.json", repeat=1)
+
+    results = report["results"]
+    assert set(results) == set(decode_benchmark.DECODERS)
+    assert len({r["records"] for r in results.values()}) == 1
+    assert all(r["ms"] > 0 for r in results.values())
@@ -0,0 +1,130 @@
+import json
+from unittest.mock import AsyncMock, MagicMock
+from datetime import timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import app.subscribers
+from app.bulk_ingest import (
+    INGESTED_TYPES, ingest_export, ingested_bundle_ref, parse_chunk, record_bundles,
+)
+from app.fhir_client import FetchStats
+from app.models import utcnow
+from app.models_prior_auth import PatientBundle
+from tests.fake_fhir import DEFAULT_BUNDLES, load_patients
+
+
+def _write_export(export_dir):
+    """A Bulk Data export of the Synthea patients: one NDJSON file per type, patients mixed."""
+    by_type = {}
+    for patient in load_patients().values():
+        for rtype, resources in patient.items():
+            by_type.setdefault(rtype, []).extend(resources)
+    for rtype, resources in by_type.items():
+        # Bulk exports reference patients as Patient/<id>, not urn:uuid
+        lines = [json.dumps(r).replace('"urn:uuid:', '"Patient/') for r in resources]
+        (export_dir / f"{rtype}.ndjson").write_text("\n".join(lines) + "\n")
+
+
+def _expected(path):
+    bundle = json.loads(path.read_text())
+    return sorted(e["resource"]["id"] for e in bundle["entry"]
+                  if e["resource"]["resourceType"] in INGESTED_TYPES)
+
+
+def test_chunks_split_on_line_boundaries(tmp_path):
+    path = tmp_path / "Condition.ndjson"
+    lines = [json.dumps({"resourceType": "Condition", "id": f"c{i}",
+                         "subject": {"reference": "Patient/p1"}}) for i in range(50)]
+    path.write_text("\n".join(lines) + "\n")
+    size = path.stat().st_size
+
+    parts = [parse_chunk(path, start, min(start + 97, size)) for start in range(0, size, 97)]
+
+    assert sum(p[1] for p in parts) == 50
+    ids = [json.loads(line)["id"] for p in parts for line in p[0].get("p1", b"").splitlines()]
+    assert ids == [f"c{i}" for i in range(50)]
+
+
+def test_groups_an_export_by_patient_across_processes(tmp_path, temp_bundle_store):
+    _write_export(tmp_path)
+
+    bundles, stats = ingest_export(tmp_path, workers=2, chunk_bytes=64 * 1024)
+
+    patients = load_patients()
+    assert stats.patients == len(patients) == len(bundles)
+    assert stats.files_skipped > 0          # Claim, ExplanationOfBenefit, ...
+    assert stats.unattributed == 0
+    for path, patient_id in zip(DEFAULT_BUNDLES, patients):
+        ref, count = bundles[patient_id]
+        with temp_bundle_store.open(ref) as f:
+            resources = [e["resource"] for e in json.load(f)["entry"]]
+        assert resources[0]["resourceType"] == "Patient"
+        assert sorted(r["id"] for r in resources) == _expected(path)
+        assert count == len(resources)
+        assert all("text" not in r and "subject" not in r for r in resources)
+
+
+async def test_fetcher_prefers_a_recent_ingested_bundle(
+    monkeypatch, tmp_path, test_engine, temp_bundle_store,
+):
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    monkeypatch.setattr(app.subscribers, "SessionLocal", session_factory)
+    _write_export(tmp_path)
+    bundles, _ = ingest_export(tmp_path, workers=1)
+    await record_bundles(bundles, tmp_path, session_factory)
+    patient_id = next(iter(bundles))
+
+    records = await app.subscribers.fetch_fhir_from_hospital(1, patient_id)
+
+    assert records[0].id == patient_id
+    assert len(records) == bundles[patient_id][1]
+
+
+async def test_live_fhir_server_wins_over_the_snapshot_outside_the_batch(
+    monkeypatch, tmp_path, test_engine, temp_bundle_store,
+):
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    monkeypatch.setattr(app.subscribers, "SessionLocal", session_factory)
+    _write_export(tmp_path)
+    bundles, _ = ingest_export(tmp_path, workers=1)
+    await record_bundles(bundles, tmp_path, session_factory)
+    patient_id = next(iter(bundles))
+    client = MagicMock(fetch_patient=AsyncMock(return_value=FetchStats(
+        bundle_ref="sha256:" + "1" * 64, resources=1, requests=1, not_modified=0,
+        bytes_downloaded=1, seconds=0.0,
+    )))
+    monkeypatch.setattr(app.subscribers, "get_fhir_client", lambda: client)
+
+    live = await app.subscribers.fetch_bundle_from_hospital(1, patient_id)
+    batch = await app.subscribers.fetch_bundle_from_hospital(1, patient_id, reauthorization=True)
+
+    assert live == "sha256:" + "1" * 64
+    assert batch == bundles[patient_id][0]
+    client.fetch_patient.assert_awaited_once_with(patient_id)
+
+
+async def test_stale_ingested_bundles_are_ignored(test_engine):
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    async with session_factory() as db:
+        db.add(PatientBundle(patient_id="stale-patient", bundle_ref="sha256:" + "0" * 64,
+                             resources=1, source="old export",
+                             ingested_at=utcnow() - timedelta(days=30)))
+        await db.commit()
+
+    assert await ingested_bundle_ref("stale-patient", session_factory) is None
+    assert await ingested_bundle_ref("never-ingested", session_factory) is None
+
+
+async def test_record_bundles_replaces_a_patients_previous_bundle(test_engine):
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    old, new = "sha256:" + "0" * 64, "sha256:" + "1" * 64
+
+    await record_bundles({"p1": (old, 3), "p2": (old, 5)}, "week 1", session_factory)
+    await record_bundles({"p1": (new, 4)}, "week 2", session_factory)
+
+    async with session_factory() as db:
+        rows = {r.patient_id: r for r in (await db.execute(select(PatientBundle))).scalars()}
+    assert (rows["p1"].bundle_ref, rows["p1"].resources, rows["p1"].source) == (new, 4, "week 2")
+    assert (rows["p2"].bundle_ref, rows["p2"].source) == (old, "week 1")
@@ -0,0 +1,51 @@
+import io
+import os
+import time
+
+import pytest
+
+from app.bundle_store import BundleNotFound, LocalBundleStore
+
+
+def test_round_trips_a_bundle_in_chunks(tmp_path):
+    store = LocalBundleStore(tmp_path, chunk_size=4)
+    data = b'{"resourceType": "Bundle", "entry": []}'
+
+    ref = store.put(io.BytesIO(data))
+
+    assert ref.startswith("sha256:")
+    with store.open(ref) as f:
+        assert f.read() == data
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_same_bundle_is_stored_once(tmp_path):
+    store = LocalBundleStore(tmp_path)
+
+    first = store.put(io.BytesIO(b"{}"))
+    second = store.put(io.BytesIO(b"{}"))
+
+    assert first == second
+    assert len(list(tmp_path.rglob("*.json"))) == 1
+
+
+def test_rejects_refs_that_are_not_digests(tmp_path):
+    store = LocalBundleStore(tmp_path)
+
+    with pytest.raises(ValueError):
+        store.open("sha256:../../etc/passwd")
+    with pytest.raises(BundleNotFound):
+        store.open("sha256:" + "0" * 64)
+
+
+def test_sweep_deletes_only_old_unreferenced_bundles(tmp_path):
+    store = LocalBundleStore(tmp_path)
+    kept, old, young = (store.put(io.BytesIO(data)) for data in (b"[1]", b"[2]", b"[3]"))
+    for ref in (kept, old):
+        path = store._path(ref)
+        os.utime(path, (path.stat().st_atime, time.time() - 7200))
+
+    assert store.sweep({kept}, max_age_seconds=3600) == 1
+
+    assert store.exists(kept) and store.exists(young)
+    assert not store.exists(old)
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import app.case_history
+from app.case_history import classify_case, record_version
+from app.fhir import FhirRecord
+
+CASE_ID = 9191     # rows aren't rolled back; keep clear of other tests' cases
+
+
+def _records(*extra):
+    resources = [
+        {"resourceType": "Patient", "id": "pat-1", "name": [{"family": "Beal"}]},
+        {"resourceType": "Condition", "id": "cond-1", "code": {"text": "Rheumatoid arthritis"}},
+        {"resourceType": "Procedure", "id": "proc-1", "code": {"text": "Dental cleaning"}},
+        {"resourceType": "Observation", "id": "obs-1", "code": {"text": "C reactive protein"},
+         "valueQuantity": {"value": 12, "unit": "mg/L"}, "meta": {"versionId": "1"}},
+        *extra,
+    ]
+    return [FhirRecord.from_resource(r) for r in resources]
+
+
+@pytest.fixture
+def classified(monkeypatch):
+    """Stands in for classify_relevance; records what reaches it."""
+    seen = []
+
+    async def classify_relevance(resources, condition, drug):
+        seen.append(sorted(r.id for r in resources))
+        return [r for r in resources if "arthritis" in r.description or "protein" in r.description]
+
+    monkeypatch.setattr(app.case_history, "classify_relevance", classify_relevance)
+    return seen
+
+
+async def test_second_request_only_classifies_new_and_changed_resources(test_engine, classified):
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+
+    first = await classify_case(CASE_ID, _records(), "RA", "Humira", session_factory)
+    changed = _records({"resourceType": "Observation", "id": "obs-2",
+                        "code": {"text": "C reactive protein"}, "valueQuantity": {"value": 8}})
+    changed[3] = FhirRecord.from_resource({
+        "resourceType": "Observation", "id": "obs-1", "code": {"text": "C reactive protein"},
+        "valueQuantity": {"value": 12, "unit": "mg/L"}, "meta": {"versionId": "2"},
+    })
+    second = await classify_case(CASE_ID, changed, "RA", "Humira", session_factory)
+
+    assert classified == [["cond-1", "obs-1", "proc-1"], ["obs-1", "obs-2"]]
+    assert [r.id for r in first] == ["pat-1", "cond-1", "obs-1"]
+    assert [r.id for r in second] == ["pat-1", "cond-1", "obs-1", "obs-2"]
+
+
+async def test_verdicts_are_scoped_to_condition_and_drug(test_engine, classified):
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+
+    await classify_case(CASE_ID + 1, _records(), "RA", "Humira", session_factory)
+    await classify_case(CASE_ID + 1, _records(), "Psoriasis", "Otezla", session_factory)
+
+    assert classified[1] == classified[0]
+
+
+async def test_without_a_database_everything_is_classified(classified):
+    def broken():
+        raise OSError("database unreachable")
+
+    relevant = await classify_case(CASE_ID, _records(), "RA", "Humira", broken)
+
+    assert classified == [["cond-1", "obs-1", "proc-1"]]
+    assert [r.id for r in relevant] == ["pat-1", "cond-1", "obs-1"]
+
+
+def test_version_falls_back_to_a_content_fingerprint():
+    [_, _, _, versioned] = _records()
+    a = FhirRecord.from_resource({"resourceType": "Observation", "id": "o", "valueQuantity": {"value": 1}})
+    b = FhirRecord.from_resource({"resourceType": "Observation", "id": "o", "valueQuantity": {"value": 2}})
+
+    assert record_version(versioned) == "1"
+    assert record_version(a) != record_version(b)
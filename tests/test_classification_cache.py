@@ -0,0 +1,87 @@
+import time
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.classification_cache import ClassificationCache, Verdict, cache_key
+
+
+def test_cache_key_normalizes_case_and_whitespace():
+    a = cache_key("Rheumatoid Arthritis", "Humira", "Observation", "C-reactive  protein", "v1")
+    b = cache_key("rheumatoid arthritis", " humira", "Observation", "c-reactive protein", "v1")
+    assert a == b
+
+
+def test_cache_key_changes_with_prompt_version():
+    a = cache_key("RA", "Humira", "Observation", "CRP", "v1")
+    b = cache_key("RA", "Humira", "Observation", "CRP", "v2")
+    assert a != b
+
+
+async def test_memory_tier_round_trip():
+    cache = ClassificationCache(session_factory=None)
+    await cache.put_many("RA", "Humira", "Condition", {
+        "Rheumatoid arthritis": Verdict(True, "diagnosis"),
+    }, "v1")
+
+    found = await cache.get_many("RA", "Humira", "Condition",
+                                 ["Rheumatoid arthritis", "Gingivitis"], "v1")
+
+    assert found == {"Rheumatoid arthritis": Verdict(True, "diagnosis")}
+
+
+async def test_lru_evicts_least_recently_used():
+    cache = ClassificationCache(maxsize=2, session_factory=None)
+    await cache.put_many("RA", "Humira", "Condition", {"a": Verdict(True, "")}, "v1")
+    await cache.put_many("RA", "Humira", "Condition", {"b": Verdict(True, "")}, "v1")
+    await cache.get_many("RA", "Humira", "Condition", ["a"], "v1")   # touch a
+    await cache.put_many("RA", "Humira", "Condition", {"c": Verdict(True, "")}, "v1")
+
+    found = await cache.get_many("RA", "Humira", "Condition", ["a", "b", "c"], "v1")
+
+    assert set(found) == {"a", "c"}
+    assert len(cache) == 2
+
+
+async def test_expired_entries_are_misses(monkeypatch):
+    import app.classification_cache as module
+
+    clock = [1000.0]
+    monkeypatch.setattr(module.time, "time", lambda: clock[0])
+
+    cache = ClassificationCache(ttl_seconds=60, session_factory=None)
+    await cache.put_many("RA", "Humira", "Condition", {"a": Verdict(True, "")}, "v1")
+
+    clock[0] += 61
+    found = await cache.get_many("RA", "Humira", "Condition", ["a"], "v1")
+
+    assert found == {}
+
+
+async def test_database_tier_survives_process_restart(test_engine):
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    first = ClassificationCache(session_factory=session_factory)
+    await first.put_many("Psoriasis-cache-test", "Otezla", "Condition", {
+        "Plaque psoriasis": Verdict(True, "diagnosis"),
+    }, "v1")
+
+    # A fresh instance has an empty LRU, so this must come from the table
+    second = ClassificationCache(session_factory=session_factory)
+    found = await second.get_many("Psoriasis-cache-test", "Otezla", "Condition",
+                                  ["Plaque psoriasis"], "v1")
+
+    assert found == {"Plaque psoriasis": Verdict(True, "diagnosis")}
+    assert len(second) == 1
+
+
+async def test_database_hit_keeps_the_rows_expiry(test_engine):
+    session_factory = async_sessionmaker(test_engine, expire_on_commit=False)
+    writer = ClassificationCache(ttl_seconds=60, session_factory=session_factory)
+    await writer.put_many("Psoriasis-expiry-test", "Otezla", "Condition", {
+        "Plaque psoriasis": Verdict(True, "diagnosis"),
+    }, "v1")
+
+    # A reader with a longer TTL must not extend the row's
+    reader = ClassificationCache(ttl_seconds=3600, session_factory=session_factory)
+    await reader.get_many("Psoriasis-expiry-test", "Otezla", "Condition", ["Plaque psoriasis"], "v1")
+
+    [(_, expires_at)] = reader._lru.values()
+    assert abs(expires_at - (time.time() + 60)) < 5
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from app import llm
+from app.coalescer import Coalescer
+
+
+async def test_submissions_in_one_window_share_a_call():
+    calls = []
+
+    async def run(items):
+        calls.append(sorted(items))
+        return {item: item.upper() for item in items}
+
+    coalescer = Coalescer(window_seconds=0.02)
+    a, b = await asyncio.gather(
+        coalescer.submit("k", ["x", "y"], run),
+        coalescer.submit("k", ["y", "z"], run),
+    )
+
+    assert calls == [["x", "y", "z"]]
+    assert a == {"x": "X", "y": "Y"}
+    assert b == {"y": "Y", "z": "Z"}
+
+
+async def test_different_keys_are_not_merged():
+    calls = []
+
+    async def run(items):
+        calls.append(items)
+        return {item: True for item in items}
+
+    coalescer = Coalescer(window_seconds=0.01)
+    await asyncio.gather(
+        coalescer.submit("ra", ["x"], run),
+        coalescer.submit("ckd", ["x"], run),
+    )
+
+    assert len(calls) == 2
+
+
+async def test_late_arrivals_open_a_new_window():
+    calls = []
+
+    async def run(items):
+        calls.append(items)
+        return {item: True for item in items}
+
+    coalescer = Coalescer(window_seconds=0.01)
+    await coalescer.submit("k", ["x"], run)
+    await coalescer.submit("k", ["y"], run)
+
+    assert calls == [["x"], ["y"]]
+
+
+async def test_failure_reaches_every_caller():
+    async def run(items):
+        raise RuntimeError("quota exceeded")
+
+    coalescer = Coalescer(window_seconds=0.01)
+    results = await asyncio.gather(
+        coalescer.submit("k", ["x"], run),
+        coalescer.submit("k", ["y"], run),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+async def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def run(items):
+        await asyncio.sleep(0.02)
+        return {item: True for item in items}
+
+    coalescer = Coalescer(window_seconds=0.01)
+    impatient = asyncio.create_task(coalescer.submit("k", ["x"], run))
+    patient = asyncio.create_task(coalescer.submit("k", ["y"], run))
+    await asyncio.sleep(0.015)
+    impatient.cancel()
+
+    assert await patient == {"y": True}
+    with pytest.raises(asyncio.CancelledError):
+        await impatient
+
+
+async def test_zero_window_calls_straight_through():
+    async def run(items):
+        return {item: len(item) for item in items}
+
+    assert await Coalescer(window_seconds=0).submit("k", ["abc"], run) == {"abc": 3}
+
+
+async def test_shared_call_runs_at_the_highest_priority_among_callers():
+    priorities = []
+
+    async def run(items):
+        priorities.append(llm.current_priority())
+        return {item: True for item in items}
+
+    async def background_submit(key, items):
+        with llm.background():
+            return await coalescer.submit(key, items, run)
+
+    coalescer = Coalescer(window_seconds=0.02)
+    await asyncio.gather(background_submit("batch", ["x"]), background_submit("batch", ["y"]))
+    # An interactive request joining a window a background one opened
+    await asyncio.gather(background_submit("mixed", ["x"]), coalescer.submit("mixed", ["y"], run))
+
+    assert priorities == [llm.BACKGROUND, llm.INTERACTIVE]
@@ -0,0 +1,108 @@
+import json
+from contextlib import ExitStack
+
+import httpx
+import pytest
+from google.genai import errors
+
+import app.fhir
+from app.fhir import FhirRecord, classify_relevance
+from app.subscribers import answer_questions_with_llm
+from app.tokens import estimate_tokens
+from benchmarks.gemini_responses import is_relevant
+from tests.fake_gemini import FakeGeminiConfig, serve
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    """Starts a fake Gemini and points the app's clients at it."""
+    monkeypatch.setenv("GEMINI_API_KEY", "fake-key")
+    monkeypatch.setattr(app.fhir.settings, "terminology_prefilter", False)
+    monkeypatch.setattr("app.terminology._instance", None)
+    monkeypatch.setattr("app.terminology._loaded", True)
+    monkeypatch.setattr(app.fhir._coalescer, "window_seconds", 0)
+
+    with ExitStack() as servers:
+        def start(**config):
+            base_url, fake = servers.enter_context(serve(FakeGeminiConfig(seed=0, **config)))
+            monkeypatch.setattr(app.fhir.settings, "gemini_base_url", base_url)
+            monkeypatch.setattr("app.llm._instance", None)     # rebuilt against base_url
+            return base_url, fake
+
+        yield start
+
+
+def _conditions(*descriptions):
+    return [
+        FhirRecord.from_resource({"resourceType": "Condition", "id": f"c{i}", "code": {"text": d}})
+        for i, d in enumerate(descriptions)
+    ]
+
+
+async def test_classify_relevance_against_fake_gemini(fake_gemini):
+    _, fake = fake_gemini(relevant_rate=0.5)
+    descriptions = [f"Condition number {i}" for i in range(20)]
+
+    result = await classify_relevance(_conditions(*descriptions), "Psoriasis", "Otezla")
+
+    expected = {d for d in descriptions if is_relevant(d, 0.5)}
+    assert {r.description for r in result} == expected
+    assert fake.state.stats.items == 20
+
+
+async def test_answer_questions_against_fake_gemini(fake_gemini):
+    fake_gemini()
+
+    answers = await answer_questions_with_llm(
+        "Patient: Jane Doe\nDiagnosis: Psoriasis (since 2019)", ["Has the patient tried topicals?"]
+    )
+
+    assert answers[0]["supporting_record_ids"] == ["Patient: Jane Doe", "Diagnosis: Psoriasis (since 2019)"]
+    assert 0.0 <= answers[0]["confidence"] <= 1.0
+
+
+async def test_injected_rate_limit_reaches_the_client(fake_gemini):
+    fake_gemini(rate_429=1.0)
+
+    with pytest.raises(errors.ClientError) as exc:
+        await classify_relevance(_conditions("Plaque psoriasis"), "Psoriasis", "Otezla")
+
+    assert exc.value.code == 429
+
+
+def test_truncated_json_and_stats(fake_gemini):
+    base_url, _ = fake_gemini(truncate_rate=1.0, token_scale=2.0)
+    body = {
+        "contents": [{"role": "user", "parts": [{"text": "ID: 0 — Plaque psoriasis"}]}],
+        "generationConfig": {"responseJsonSchema": {"properties": {"classifications": {}}}},
+    }
+
+    response = httpx.post(f"{base_url}/v1beta/models/gemini-2.5-flash:generateContent", json=body)
+    text = response.json()["candidates"][0]["content"]["parts"][0]["text"]
+
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(text)
+    stats = httpx.get(f"{base_url}/_stats").json()
+    assert stats["statuses"] == {"200": 1}
+    assert stats["prompt_tokens"] == 2 * estimate_tokens("ID: 0 — Plaque psoriasis")
+
+
+def test_config_can_change_while_running(fake_gemini):
+    base_url, fake = fake_gemini()
+
+    httpx.put(f"{base_url}/_config", json={"rate_5xx": 1.0})
+    response = httpx.post(f"{base_url}/v1beta/models/gemini-2.5-flash:generateContent", json={})
+
+    assert response.status_code in (500, 503)
+    assert fake.state.config.rate_5xx == 1.0
+
+
+async def test_batched_answers_against_fake_gemini(fake_gemini, monkeypatch):
+    _, fake = fake_gemini()
+    monkeypatch.setattr(app.fhir.settings, "qa_batch_questions", True)
+    questions = ["Has the patient tried topicals?", "Is there a PASI score?"]
+
+    answers = await answer_questions_with_llm("Diagnosis: Psoriasis (since 2019)", questions)
+
+    assert [a["question"] for a in answers] == questions
+    assert fake.state.stats.requests == 1
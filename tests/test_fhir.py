@@ -1,5 +1,15 @@
+import io
+import json
+import logging
+
 import pytest
-from app.fhir import strip_plumbing, classify_relevance, to_natural_language
+from app.fhir import (
+    FhirRecord, strip_plumbing, classify_relevance, to_natural_language, read_bundle_records,
+)
+
+
+def _records(resources):
+    return [FhirRecord.from_resource(r) for r in resources]
 
 def test_strip_plumbing_extracts_resources():
     bundle = {
@@ -30,11 +40,12 @@ def test_strip_plumbing_extracts_resources():
     result = strip_plumbing(bundle)
 
     assert len(result) == 2
-    assert result[0]["resourceType"] == "Patient"
-    assert result[1]["resourceType"] == "Condition"
+    assert result[0].resource_type == "Patient"
+    assert result[1].resource_type == "Condition"
+    assert result[1].description == "Type 2 diabetes"
     # fullUrl and request should NOT be in the results
-    assert "fullUrl" not in result[0]
-    assert "request" not in result[0]
+    assert not hasattr(result[0], "fullUrl")
+    assert not hasattr(result[0], "request")
 
 def test_strip_plumbing_removes_meta():
     bundle = {
@@ -55,13 +66,123 @@ def test_strip_plumbing_removes_meta():
 
     result = strip_plumbing(bundle)
 
-    assert "meta" not in result[0]
-    assert result[0]["name"] == [{"family": "Doe"}]
+    assert not hasattr(result[0], "meta")
+    assert result[0].family == "Doe"
+
+
+def test_strip_plumbing_drops_non_clinical_resources():
+    bundle = {
+        "resourceType": "Bundle",
+        "entry": [
+            {"resource": {"resourceType": "Patient", "id": "p1"}},
+            {"resource": {"resourceType": "ExplanationOfBenefit", "id": "eob-1"}},
+            {"resource": {"resourceType": "Observation", "id": "o1", "code": {"text": "eGFR"}}},
+        ],
+    }
+
+    assert [r.id for r in strip_plumbing(bundle)] == ["p1", "o1"]
+
+
+def test_fhir_record_interns_repeated_descriptions():
+    a = FhirRecord.from_resource({"resourceType": "Observation", "code": {"text": "".join(["Creat", "inine"])}})
+    b = FhirRecord.from_resource({"resourceType": "Observation", "code": {"text": "".join(["Creati", "nine"])}})
+
+    assert a.description is b.description
+    assert not hasattr(a, "__dict__")
+
+def test_fhir_record_reads_single_and_plain_code_categories():
+    procedure = FhirRecord.from_resource({
+        "resourceType": "Procedure", "id": "proc-1", "code": {"text": "Dialysis"},
+        "category": {"coding": [{"system": "http://snomed.info/sct", "code": "387713003"}]},
+    })
+    allergy = FhirRecord.from_resource({
+        "resourceType": "AllergyIntolerance", "id": "allergy-1", "code": {"text": "Peanut"},
+        "category": ["food"],
+    })
+
+    assert list(procedure.codes) == ["sct|387713003"]
+    assert allergy.codes == ()
+    assert allergy.description == "Peanut"
+
+
+def test_read_bundle_records_filters_while_reading():
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {"fullUrl": "urn:uuid:1", "resource": {
+                "resourceType": "Patient", "id": "p1", "meta": {"profile": []},
+                "name": [{"family": "Müller"}],
+            }},
+            {"fullUrl": "urn:uuid:2", "resource": {"resourceType": "Claim", "id": "claim-1"}},
+            {"fullUrl": "urn:uuid:3", "resource": {
+                "resourceType": "Observation", "id": "o1", "text": {"div": "<div/>"},
+                "code": {"text": "CRP"},
+                "valueQuantity": {"value": 12.5, "unit": "mg/L"},
+            }},
+            {"fullUrl": "urn:uuid:4", "resource": {"resourceType": "Encounter", "id": "enc-1"}},
+        ],
+    }
+    raw = json.dumps(bundle, ensure_ascii=False).encode("utf-8")
+
+    result = read_bundle_records(io.BytesIO(raw))
+
+    assert [r.id for r in result] == ["p1", "o1"]
+    assert result[0].family == "Müller"
+    assert result[1].value == 12.5
+    assert result[1].unit == "mg/L"
+
+
+def test_read_bundle_records_rejects_truncated_bundle():
+    raw = b'{"resourceType": "Bundle", "entry": [{"resource": {"resourceType": "Patient"'
+
+    with pytest.raises(ValueError):
+        read_bundle_records(io.BytesIO(raw))
+
+
+@pytest.mark.parametrize("name", ["sample_patient.json", "ckd_patient.json"])
+def test_read_bundle_records_matches_from_resource(name):
+    from pathlib import Path
+
+    path = Path(__file__).parent.parent / "data" / name
+    with open(path, "rb") as f:
+        expected = [r.as_dict() for r in strip_plumbing(json.load(f))]
+    with open(path, "rb") as f:
+        assert [r.as_dict() for r in read_bundle_records(f)] == expected
+
+
+def test_read_bundle_records_handles_per_type_shapes_and_skips_the_rest():
+    bundle = {"resourceType": "Bundle", "entry": [
+        {"resource": {"resourceType": "Claim", "id": "claim-1", "total": {"value": 10}}},
+        {"request": {"method": "DELETE", "url": "Condition/gone"}},
+        {"resource": {
+            "resourceType": "Procedure", "id": "proc-1", "status": "completed",
+            "category": {"coding": [{"system": "http://snomed.info/sct", "code": "387713003"}]},
+            "code": {"text": "Dialysis", "coding": [{"system": "http://snomed.info/sct", "code": "265764009"}]},
+            "text": {"div": "<div>narrative</div>"},
+        }},
+        {"resource": {
+            "resourceType": "AllergyIntolerance", "id": "allergy-1", "category": ["food"],
+            "code": {"text": "Peanut"}, "recordedDate": "2020-01-01",
+        }},
+    ]}
+    raw = io.BytesIO(json.dumps(bundle).encode("utf-8"))
+
+    records = read_bundle_records(raw)
+
+    with_resources = {"entry": [e for e in bundle["entry"] if "resource" in e]}
+    assert [r.as_dict() for r in records] == [
+        r.as_dict() for r in strip_plumbing(with_resources)
+    ]
+    assert [r.resource_type for r in records] == ["Procedure", "AllergyIntolerance"]
+    assert list(records[0].codes) == ["sct|265764009", "sct|387713003"]
+    assert records[1].date == "2020-01-01"
+
 
 @pytest.mark.asyncio
 async def test_classify_relevance_ankylosing_spondylitis(monkeypatch):
     """Unit test with mocked Gemini response."""
-    from unittest.mock import MagicMock
+    from unittest.mock import AsyncMock, MagicMock
     from app.fhir import classify_relevance
 
     # Fake Gemini response — indices match unique descriptions
@@ -74,11 +195,11 @@ async def test_classify_relevance_ankylosing_spondylitis(monkeypatch):
     fake_response.text = fake_json
 
     fake_client = MagicMock()
-    fake_client.models.generate_content.return_value = fake_response
+    fake_client.aio.models.generate_content = AsyncMock(return_value=fake_response)
 
     # Patch genai.Client to return our fake
     import app.fhir
-    monkeypatch.setattr(app.fhir, "_get_gemini_client", lambda: fake_client)
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
     
     resources = [
         {"resourceType": "Patient", "id": "p1", "name": [{"family": "Beal", "given": ["Jeremy"]}]},
@@ -86,8 +207,8 @@ async def test_classify_relevance_ankylosing_spondylitis(monkeypatch):
         {"resourceType": "Condition", "id": "cond-2", "code": {"text": "Seasonal allergies"}},
     ]
 
-    result = await classify_relevance(resources, "Ankylosing spondylitis", "Humira (adalimumab)")
-    result_ids = [r["id"] for r in result]
+    result = await classify_relevance(_records(resources), "Ankylosing spondylitis", "Humira (adalimumab)")
+    result_ids = [r.id for r in result]
 
     assert "p1" in result_ids       # Patient — always kept
     assert "cond-1" in result_ids   # AS — mock said relevant
@@ -101,9 +222,417 @@ def test_to_natural_language():
         {"resourceType": "MedicationRequest", "medicationCodeableConcept": {"text": "Celebrex 200mg"}, "status": "active", "authoredOn": "2019-06-01"},
     ]
 
-    result = to_natural_language(resources)
+    result = to_natural_language(_records(resources))
 
     assert "Jeremy Beal" in result
     assert "Ankylosing spondylitis" in result
     assert "15.2" in result
-    assert "Celebrex" in result
\ No newline at end of file
+    assert "Celebrex" in result
+
+@pytest.mark.asyncio
+async def test_classify_relevance_only_sends_cache_misses(monkeypatch):
+    from unittest.mock import AsyncMock, MagicMock
+    import app.fhir
+
+    responses = [
+        '{"classifications": [{"id": "0", "relevant": true, "reasoning": "AS diagnosis"}]}',
+        '{"classifications": [{"id": "0", "relevant": false, "reasoning": "Not related"}]}',
+    ]
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = AsyncMock(side_effect=[
+        MagicMock(text=text) for text in responses
+    ])
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
+
+    first = [{"resourceType": "Condition", "id": "c1", "code": {"text": "Ankylosing spondylitis"}}]
+    await classify_relevance(_records(first), "Ankylosing spondylitis", "Humira")
+
+    # Second patient repeats the cached description and adds one new one
+    second = [
+        {"resourceType": "Condition", "id": "c2", "code": {"text": "Ankylosing spondylitis"}},
+        {"resourceType": "Condition", "id": "c3", "code": {"text": "Seasonal allergies"}},
+    ]
+    result = await classify_relevance(_records(second), "Ankylosing spondylitis", "Humira")
+
+    assert [r.id for r in result] == ["c2"]
+    assert fake_client.aio.models.generate_content.await_count == 2
+    prompt = fake_client.aio.models.generate_content.call_args.kwargs["contents"]
+    assert "Seasonal allergies" in prompt
+    assert "Ankylosing spondylitis —" not in prompt
+
+
+
+@pytest.mark.asyncio
+async def test_classify_relevance_runs_resource_types_concurrently(monkeypatch):
+    import asyncio
+    from unittest.mock import MagicMock
+    import app.fhir
+
+    in_flight = 0
+    peak = 0
+
+    async def slow_generate(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return MagicMock(text='{"classifications": [{"id": "0", "relevant": true, "reasoning": ""}]}')
+
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = slow_generate
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
+    monkeypatch.setattr(app.fhir.settings, "classify_max_concurrency", 2)
+    monkeypatch.setattr(app.fhir._coalescer, "window_seconds", 0)
+
+    resources = [
+        {"resourceType": "Condition", "id": "c1", "code": {"text": "Rheumatoid arthritis"}},
+        {"resourceType": "Observation", "id": "o1", "code": {"text": "C reactive protein"}},
+        {"resourceType": "Procedure", "id": "p1", "code": {"text": "Joint aspiration"}},
+    ]
+
+    result = await classify_relevance(_records(resources), "Rheumatoid arthritis", "Humira")
+
+    assert {r.id for r in result} == {"c1", "o1", "p1"}
+    assert peak == 2            # concurrent, but capped by the semaphore
+
+
+@pytest.mark.asyncio
+async def test_classify_relevance_sends_only_ambiguous_codes_to_gemini(monkeypatch, tmp_path):
+    from unittest.mock import AsyncMock, MagicMock
+    import app.fhir
+    from app import terminology
+
+    path = tmp_path / "value_sets.idx"
+    terminology.build_index({
+        "conditions": {"rheumatoid arthritis": {"codes": ["sct|69896004"]}},
+        "out_of_scope": {"dental": ["sct|34043003"]},
+    }, path)
+    monkeypatch.setattr(terminology, "_instance", terminology.TerminologyIndex(path))
+    monkeypatch.setattr(terminology, "_loaded", True)
+
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = AsyncMock(return_value=MagicMock(
+        text='{"classifications": [{"id": "0", "relevant": false, "reasoning": ""}]}'
+    ))
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
+
+    sct = "http://snomed.info/sct"
+    resources = _records([
+        {"resourceType": "Condition", "id": "ra", "code": {
+            "text": "Rheumatoid arthritis", "coding": [{"system": sct, "code": "69896004"}]}},
+        {"resourceType": "Condition", "id": "dental", "code": {
+            "text": "Dental consultation", "coding": [{"system": sct, "code": "34043003"}]}},
+        {"resourceType": "Condition", "id": "sinus", "code": {
+            "text": "Viral sinusitis", "coding": [{"system": sct, "code": "444814009"}]}},
+    ])
+
+    result = await classify_relevance(resources, "Rheumatoid arthritis", "Humira")
+
+    assert [r.id for r in result] == ["ra"]
+    prompt = fake_client.aio.models.generate_content.call_args.kwargs["contents"]
+    assert "ID: 0 — Viral sinusitis" in prompt
+    assert "Dental" not in prompt
+    assert "ID: 1" not in prompt
+
+
+@pytest.mark.asyncio
+async def test_classify_relevance_merges_chunked_results(monkeypatch):
+    import re
+    from unittest.mock import MagicMock
+    import app.fhir
+    from app.tokens import ChunkSizer, RESPONSE_TOKENS_PER_CLASSIFICATION
+
+    monkeypatch.setattr(app.fhir, "_chunk_sizer", ChunkSizer(
+        target_seconds=60, max_output_tokens=3 * RESPONSE_TOKENS_PER_CLASSIFICATION,
+    ))
+
+    prompts = []
+
+    async def generate(**kwargs):
+        prompts.append(kwargs["contents"])
+        # Relevant iff the lab number is even
+        items = re.findall(r"ID: (\d+) — Lab (\d+)", kwargs["contents"])
+        body = ", ".join(
+            f'{{"id": "{i}", "relevant": {str(int(n) % 2 == 0).lower()}, "reasoning": ""}}'
+            for i, n in items
+        )
+        return MagicMock(text=f'{{"classifications": [{body}]}}')
+
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = generate
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
+
+    resources = _records([
+        {"resourceType": "Observation", "id": f"o{i}", "code": {"text": f"Lab {i}"}}
+        for i in range(8)
+    ])
+
+    result = await classify_relevance(resources, "CKD", "Farxiga")
+
+    assert len(prompts) == 3                 # 3 + 3 + 2
+    assert sorted(r.id for r in result) == ["o0", "o2", "o4", "o6"]
+
+
+def test_fit_summary_to_budget_keeps_everything_under_budget():
+    from app.fhir import SummaryLine, fit_summary_to_budget
+
+    lines = [SummaryLine("Patient", None, "Patient: Ada Lovelace, born 1815-12-10, female.")]
+
+    kept, budget = fit_summary_to_budget(lines, 1000)
+
+    assert kept == lines
+    assert budget.lines_dropped == 0
+    assert budget.tokens_dropped == 0
+
+
+def test_fit_summary_to_budget_drops_lowest_priority_and_oldest_first():
+    from app.fhir import SummaryLine, fit_summary_to_budget
+
+    lines = [
+        SummaryLine("Patient", None, "Patient: Ada Lovelace, born 1815-12-10, female."),
+        SummaryLine("Procedure", "2010-01-01", "Procedure: Knee injection, left side."),
+        SummaryLine("Condition", "2009-05-01", "Diagnosis: Rheumatoid arthritis, onset 2009-05-01."),
+        SummaryLine("Observation", "2011-01-01", "Lab result: CRP: 14 mg/L (recorded 2011-01-01)."),
+        SummaryLine("Observation", "2024-01-01", "Lab result: CRP: 4 mg/L (recorded 2024-01-01)."),
+        SummaryLine("MedicationRequest", "2012-01-01", "Medication: Methotrexate, status: stopped."),
+        SummaryLine("Procedure", "2023-01-01", "Procedure: Joint aspiration, right knee."),
+    ]
+    full = sum(len(line.text) // 4 + 2 for line in lines)
+
+    # Room for everything except roughly three lines
+    kept, budget = fit_summary_to_budget(lines, full - 30)
+
+    texts = [line.text for line in kept]
+    assert texts[0].startswith("Patient:")
+    assert "Procedure: Knee injection, left side." not in texts      # oldest procedure
+    assert "Procedure: Joint aspiration, right knee." not in texts   # then the other procedure
+    assert "Lab result: CRP: 14 mg/L (recorded 2011-01-01)." not in texts  # then oldest lab
+    assert "Lab result: CRP: 4 mg/L (recorded 2024-01-01)." in texts
+    assert any(t.startswith("Diagnosis:") for t in texts)
+    assert any(t.startswith("Medication:") for t in texts)
+    assert budget.lines_dropped == 3
+    assert budget.tokens <= full - 30
+
+
+def test_fit_summary_to_budget_compresses_repeated_lines_before_dropping():
+    from app.fhir import SummaryLine, fit_summary_to_budget
+
+    lines = [SummaryLine("Patient", None, "Patient: Ada Lovelace, born 1815-12-10, female.")]
+    lines += [SummaryLine("Procedure", f"2020-01-{d:02d}", "Procedure: Auscultation of the fetal heart.")
+              for d in range(1, 28)]
+    compressed_size = 40
+
+    kept, budget = fit_summary_to_budget(lines, compressed_size)
+
+    assert [line.text for line in kept] == [
+        "Patient: Ada Lovelace, born 1815-12-10, female.",
+        "Procedure: Auscultation of the fetal heart (recorded 27 times).",
+    ]
+    assert kept[1].date == "2020-01-27"
+    assert budget.lines_dropped == 26
+
+
+def test_summary_token_budget_reserves_room_for_prompt_and_question(monkeypatch):
+    from app import subscribers
+
+    monkeypatch.setattr(subscribers.settings, "qa_prompt_token_budget", 1000)
+
+    short = subscribers.summary_token_budget(["Is it RA?"])
+    long = subscribers.summary_token_budget(["Is it RA?", "x" * 400])
+
+    assert 900 < short < 1000
+    assert 95 <= short - long <= 100   # the longer question costs ~100 more tokens
+
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_classification_call(monkeypatch):
+    import asyncio
+    import re
+    from unittest.mock import MagicMock
+    import app.fhir
+
+    prompts = []
+
+    async def generate(**kwargs):
+        prompts.append(kwargs["contents"])
+        items = re.findall(r"ID: (\d+) — (.+)", kwargs["contents"])
+        body = ", ".join(
+            f'{{"id": "{i}", "relevant": {str("arthritis" in d).lower()}, "reasoning": ""}}'
+            for i, d in items
+        )
+        return MagicMock(text=f'{{"classifications": [{body}]}}')
+
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = generate
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
+
+    nurse_a = _records([
+        {"resourceType": "Condition", "id": "a1", "code": {"text": "Rheumatoid arthritis"}},
+        {"resourceType": "Condition", "id": "a2", "code": {"text": "Viral sinusitis"}},
+    ])
+    nurse_b = _records([
+        {"resourceType": "Condition", "id": "b1", "code": {"text": "Rheumatoid arthritis"}},
+        {"resourceType": "Condition", "id": "b2", "code": {"text": "Psoriatic arthritis"}},
+    ])
+
+    result_a, result_b = await asyncio.gather(
+        classify_relevance(nurse_a, "Rheumatoid arthritis", "Humira"),
+        classify_relevance(nurse_b, "rheumatoid arthritis", "humira"),
+    )
+
+    assert len(prompts) == 1
+    assert len(re.findall(r"ID: \d+ — ", prompts[0])) == 3      # deduplicated across requests
+    assert [r.id for r in result_a] == ["a1"]
+    assert sorted(r.id for r in result_b) == ["b1", "b2"]
+
+
+@pytest.mark.asyncio
+async def test_classify_relevance_reuses_verdict_for_near_duplicate(monkeypatch):
+    from unittest.mock import AsyncMock, MagicMock
+    import app.fhir
+
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = AsyncMock(return_value=MagicMock(
+        text='{"classifications": [{"id": "0", "relevant": true, "reasoning": "Weight-based dosing"}]}'
+    ))
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
+    monkeypatch.setattr(app.fhir.settings, "classify_similarity_audit", False)
+
+    first = [{"resourceType": "Observation", "id": "o1",
+              "code": {"text": "Body mass index (BMI) [Ratio]"}}]
+    await classify_relevance(_records(first), "Rheumatoid arthritis", "Humira")
+
+    second = [{"resourceType": "Observation", "id": "o2", "code": {"text": "Body Mass Index"}}]
+    result = await classify_relevance(_records(second), "Rheumatoid arthritis", "Humira")
+
+    assert [r.id for r in result] == ["o2"]
+    assert fake_client.aio.models.generate_content.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_similarity_audit_still_asks_gemini(monkeypatch, caplog):
+    from unittest.mock import AsyncMock, MagicMock
+    import app.fhir
+
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = AsyncMock(return_value=MagicMock(
+        text='{"classifications": [{"id": "0", "relevant": true, "reasoning": "Weight-based dosing"}]}'
+    ))
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
+    monkeypatch.setattr(app.fhir.settings, "classify_similarity_audit", True)
+
+    first = [{"resourceType": "Observation", "id": "o1",
+              "code": {"text": "Body mass index (BMI) [Ratio]"}}]
+    await classify_relevance(_records(first), "Rheumatoid arthritis", "Humira")
+    second = [{"resourceType": "Observation", "id": "o2", "code": {"text": "Body Mass Index"}}]
+    with caplog.at_level(logging.INFO, logger="app.fhir"):
+        await classify_relevance(_records(second), "Rheumatoid arthritis", "Humira")
+
+    assert fake_client.aio.models.generate_content.await_count == 2
+    [*_, second_log] = [r.getMessage() for r in caplog.records if "Classifying" in r.getMessage()]
+    assert second_log.endswith("(from 1 resources, 0 cached, 0 learned, 0 near-duplicate)")
+
+
+def test_summary_lines_get_stable_ids_from_their_resources():
+    from app.fhir import summary_lines
+
+    resources = [
+        {"resourceType": "Patient", "id": "pat-1", "name": [{"family": "Beal", "given": ["Jeremy"]}]},
+        {"resourceType": "Condition", "id": "cond-1", "code": {"text": "Ankylosing spondylitis"}},
+    ]
+
+    first = summary_lines(_records(resources))
+    again = summary_lines(_records(list(reversed(resources))))
+
+    assert len({line.line_id for line in first}) == 2
+    assert {line.text: line.line_id for line in first} == {line.text: line.line_id for line in again}
+    assert to_natural_language(_records(resources)).startswith(f"[{first[0].line_id}] Patient:")
+
+
+def test_resolve_citations_keeps_known_ids_and_their_resources():
+    from app.fhir import cited_resources, citation_index, resolve_citations, summary_lines
+
+    resources = [
+        {"resourceType": "Condition", "id": "cond-1", "code": {"text": "Ankylosing spondylitis"}},
+        {"resourceType": "MedicationRequest", "id": "med-1", "status": "active",
+         "medicationCodeableConcept": {"text": "Naproxen 500 MG Oral Tablet"}},
+    ]
+    lines = summary_lines(_records(resources))
+    index = citation_index(lines)
+    med_id = lines[1].line_id
+
+    ids, refs = resolve_citations(index, [f"[{med_id}]", med_id, "deadbeef", "Medication: Naproxen"])
+
+    assert ids == [med_id]
+    assert index[med_id] == [["MedicationRequest", "med-1"]]
+    stored = {("MedicationRequest", "med-1"): resources[1]}
+    assert cited_resources(refs, stored) == [{"line_id": med_id, "resource_type": "MedicationRequest",
+                                              "id": "med-1", "resource": resources[1]}]
+
+
+def test_read_bundle_resources_returns_only_the_wanted_resources_as_stored():
+    from app.fhir import read_bundle_resources
+
+    med = {"resourceType": "MedicationRequest", "id": "med-1", "status": "active",
+           "text": {"div": "<div>narrative</div>"}}
+    bundle = {"resourceType": "Bundle", "entry": [
+        {"resource": {"resourceType": "Condition", "id": "cond-1"}},
+        {"resource": med},
+        {"resource": {"resourceType": "Claim", "id": "med-1"}},
+    ]}
+    fp = io.BytesIO(json.dumps(bundle).encode("utf-8"))
+
+    assert read_bundle_resources(fp, {("MedicationRequest", "med-1")}) == {
+        ("MedicationRequest", "med-1"): med,
+    }
+
+
+def test_longer_hex_token_does_not_cite_its_prefix():
+    from app.fhir import resolve_citations
+
+    index = {"3f2a9c1d": [["Condition", "cond-1"]]}
+
+    ids, refs = resolve_citations(index, ["3f2a9c1d0b", "[3f2a9c1d0b]", "3f2a9c1d-x"])
+
+    assert (ids, refs) == ([], [])
+
+
+def test_merged_repeat_lines_cite_every_copy():
+    from app.fhir import citation_index, fit_summary_to_budget, summary_lines
+
+    resources = [{"resourceType": "Patient", "id": "pat-1", "name": [{"family": "Beal"}]}]
+    resources += [
+        {"resourceType": "Procedure", "id": f"proc-{i}", "code": {"text": "Auscultation of the fetal heart"}}
+        for i in range(20)
+    ]
+
+    kept, _ = fit_summary_to_budget(summary_lines(_records(resources)), 40)
+    [merged] = [line for line in kept if line.resource_type == "Procedure"]
+
+    assert "(recorded 20 times)" in merged.text
+    assert len(citation_index(kept)[merged.line_id]) == 20
+
+
+def test_lab_crossing_lines_cite_and_are_named_after_the_crossing_draw():
+    from app.fhir import summary_lines
+
+    def egfr(i, value, year):
+        return {"resourceType": "Observation", "id": f"egfr-{i}",
+                "code": {"text": "eGFR", "coding": [{"system": "http://loinc.org", "code": "33914-3"}]},
+                "valueQuantity": {"value": value, "unit": "mL/min"},
+                "effectiveDateTime": f"{year}-01-01"}
+
+    draws = [egfr(1, 75, 2021), egfr(2, 62, 2022), egfr(3, 44, 2023)]
+    lines = summary_lines(_records(draws))
+    series, crossing = lines
+
+    assert [r.id for r in series.sources] == ["egfr-1", "egfr-2", "egfr-3"]
+    assert [r.id for r in crossing.sources] == ["egfr-3"]
+
+    # An earlier draw showing up changes neither ID
+    again = summary_lines(_records([egfr(0, 80, 2020)] + draws))
+    assert again[0].line_id == series.line_id
+    assert again[-1].line_id == crossing.line_id
+    assert [r.id for r in again[-1].sources] == ["egfr-3"]
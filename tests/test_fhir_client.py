@@ -0,0 +1,206 @@
+import json
+import time
+
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import app.subscribers
+from app import fhir_client as fhir_client_module
+from app.fhir import CLINICAL_TYPES
+from app.fhir_client import FETCH_TYPES, FhirClient, FhirFetchError
+from tests.fake_fhir import DATA_DIR, FakeFhirConfig, load_patients, serve
+
+PATIENT_ID = "a88dc42a-ddc2-1304-a912-17d05955f43d"   # data/sample_patient.json
+
+
+@pytest.fixture
+def fake_fhir():
+    with serve(FakeFhirConfig()) as (base_url, fake):
+        yield base_url, fake
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def fhir_client(fake_fhir):
+    # The fake's default page-1 ETag covers the whole result set
+    client = FhirClient(fake_fhir[0], page_size=25, max_retries=0, etag_scope="search")
+    yield client
+    await client.aclose()
+
+
+@pytest.fixture
+def page_etag_fhir():
+    with serve(FakeFhirConfig(etag_scope="page")) as (base_url, fake):
+        yield base_url, fake
+
+
+def _stored(store, ref):
+    with store.open(ref) as f:
+        return [e["resource"] for e in json.load(f)["entry"]]
+
+
+async def test_fetches_only_clinical_types_across_pages(fake_fhir, fhir_client, temp_bundle_store):
+    _, fake = fake_fhir
+
+    stats = await fhir_client.fetch_patient(PATIENT_ID)
+
+    bundle = json.loads((DATA_DIR / "sample_patient.json").read_text())
+    expected = [e["resource"]["id"] for e in bundle["entry"]
+                if e["resource"]["resourceType"] in {"Patient", *CLINICAL_TYPES}]
+    resources = _stored(temp_bundle_store, stats.bundle_ref)
+    assert sorted(r["id"] for r in resources) == sorted(expected)
+    assert stats.resources == len(expected)
+    assert set(fake.state.stats.types) == set(FETCH_TYPES)      # never asked for Claim & co.
+    assert stats.requests > len(FETCH_TYPES)                    # followed next links
+    assert stats.bytes_downloaded > 0
+
+
+async def test_repeat_fetch_of_an_unchanged_patient_is_all_304s(fake_fhir, fhir_client):
+    first = await fhir_client.fetch_patient(PATIENT_ID)
+    second = await fhir_client.fetch_patient(PATIENT_ID)
+
+    assert second.bundle_ref == first.bundle_ref
+    assert second.requests == second.not_modified == len(FETCH_TYPES)
+    assert second.bytes_downloaded < first.bytes_downloaded / 100
+
+
+async def test_only_changed_types_are_downloaded_again(fake_fhir, fhir_client, temp_bundle_store):
+    _, fake = fake_fhir
+    await fhir_client.fetch_patient(PATIENT_ID)
+    fake.state.patients[PATIENT_ID]["Observation"].append({
+        "resourceType": "Observation", "id": "new-crp", "status": "final",
+        "code": {"text": "C reactive protein"}, "valueQuantity": {"value": 14, "unit": "mg/L"},
+    })
+
+    stats = await fhir_client.fetch_patient(PATIENT_ID)
+
+    assert stats.not_modified == len(FETCH_TYPES) - 1
+    assert "new-crp" in {r["id"] for r in _stored(temp_bundle_store, stats.bundle_ref)}
+
+
+async def test_per_page_etags_revalidate_every_page(page_etag_fhir, temp_bundle_store):
+    base_url, fake = page_etag_fhir
+    client = FhirClient(base_url, page_size=25, max_retries=0, etag_scope="page")
+    try:
+        first = await client.fetch_patient(PATIENT_ID)
+        again = await client.fetch_patient(PATIENT_ID)
+        # Lands on the last page; page 1 and its ETag are unchanged
+        fake.state.patients[PATIENT_ID]["Observation"].append({
+            "resourceType": "Observation", "id": "new-crp", "status": "final",
+            "code": {"text": "C reactive protein"},
+        })
+        changed = await client.fetch_patient(PATIENT_ID)
+    finally:
+        await client.aclose()
+
+    assert again.bundle_ref == first.bundle_ref
+    assert again.requests == again.not_modified == first.requests
+    assert changed.not_modified == first.requests - 1
+    assert "new-crp" in {r["id"] for r in _stored(temp_bundle_store, changed.bundle_ref)}
+
+
+async def test_stores_each_page_once_and_the_bundle_built_from_them(
+    page_etag_fhir, temp_bundle_store,
+):
+    client = FhirClient(page_etag_fhir[0], page_size=25, max_retries=0, etag_scope="page")
+    try:
+        stats = await client.fetch_patient(PATIENT_ID)
+    finally:
+        await client.aclose()
+
+    stored = {f"sha256:{p.stem}" for p in temp_bundle_store.root.glob("*/*.json")}
+    assert stored == client.cached_refs() | {stats.bundle_ref}
+
+
+async def test_sweep_keeps_cached_pages_and_drops_old_fetched_bundles(
+    monkeypatch, page_etag_fhir, test_engine, temp_bundle_store,
+):
+    monkeypatch.setattr(app.subscribers, "SessionLocal",
+                        async_sessionmaker(test_engine, expire_on_commit=False))
+    monkeypatch.setattr(app.subscribers.settings, "bundle_store_retention_hours", 0)
+    client = FhirClient(page_etag_fhir[0], page_size=25, max_retries=0, etag_scope="page")
+    monkeypatch.setattr(fhir_client_module, "_instance", client)
+    try:
+        stats = await client.fetch_patient(PATIENT_ID)
+    finally:
+        await client.aclose()
+    time.sleep(0.01)
+
+    assert await app.subscribers.sweep_bundle_store() == 1
+    assert not temp_bundle_store.exists(stats.bundle_ref)
+    assert all(temp_bundle_store.exists(ref) for ref in client.cached_refs())
+
+
+def _mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def test_retries_wait_at_least_retry_after(temp_bundle_store):
+    statuses = iter([429, 200])
+
+    def handler(request):
+        status = next(statuses)
+        if status == 429:
+            return httpx.Response(429, headers={"Retry-After": "1"})
+        return httpx.Response(200, json={"resourceType": "Bundle", "entry": []})
+
+    client = FhirClient("http://ehr", client=_mock_client(handler), max_retries=1)
+    counters = {"requests": 0, "bytes": 0}
+    started = time.monotonic()
+    try:
+        response = await client._get("http://ehr/Patient", counters=counters)
+    finally:
+        await client.aclose()
+
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 1.0        # not the 0.5s first backoff
+    assert counters["requests"] == 2
+
+
+async def test_not_modified_without_a_cached_page_fails_the_fetch(temp_bundle_store):
+    client = FhirClient("http://ehr", client=_mock_client(lambda request: httpx.Response(304)),
+                        max_retries=0)
+    try:
+        with pytest.raises(FhirFetchError, match="304"):
+            await client.fetch_patient(PATIENT_ID)
+    finally:
+        await client.aclose()
+
+
+def test_search_pages_are_copied_out_compact_without_outcomes():
+    from app.fhir_structs import read_search_page
+
+    page = b"""{"resourceType": "Bundle", "type": "searchset",
+      "link": [{"relation": "self", "url": "http://ehr/Condition?page=1"},
+               {"relation": "next", "url": "http://ehr/Condition?page=2"}],
+      "entry": [
+        {"resource": {"resourceType": "Condition", "id": "c1",
+                      "code": {"text": "Rheumatoid arthritis"}}, "search": {"mode": "match"}},
+        {"resource": {"resourceType": "OperationOutcome", "id": "oo"}, "search": {"mode": "outcome"}},
+        {"fullUrl": "urn:uuid:none"}
+      ]}"""
+
+    resources, next_url = read_search_page(page)
+
+    assert resources == [b'{"resourceType":"Condition","id":"c1","code":{"text":"Rheumatoid arthritis"}}']
+    assert next_url == "http://ehr/Condition?page=2"
+
+
+async def test_unknown_patient_fails_the_fetch(fhir_client):
+    with pytest.raises(FhirFetchError):
+        await fhir_client.fetch_patient("no-such-patient")
+
+
+async def test_fetcher_uses_the_ehr_when_the_request_names_a_patient(
+    monkeypatch, fake_fhir, fhir_client, test_engine,
+):
+    monkeypatch.setattr(app.subscribers, "get_fhir_client", lambda: fhir_client)
+    monkeypatch.setattr(app.subscribers, "SessionLocal",
+                        async_sessionmaker(test_engine, expire_on_commit=False))
+    ckd_patient = next(pid for pid in load_patients() if pid != PATIENT_ID)
+
+    records = await app.subscribers.fetch_fhir_from_hospital(1, ckd_patient)
+
+    assert records[0].resource_type == "Patient"
+    assert records[0].id == ckd_patient
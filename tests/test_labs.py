@@ -0,0 +1,88 @@
+from app.fhir import FhirRecord, to_natural_language
+from app.labs import summarize_series
+
+LOINC = "http://loinc.org"
+
+
+def _egfr(value, date):
+    return FhirRecord.from_resource({
+        "resourceType": "Observation",
+        "code": {"text": "eGFR", "coding": [{"system": LOINC, "code": "33914-3"}]},
+        "valueQuantity": {"value": value, "unit": "mL/min"},
+        "effectiveDateTime": date,
+    })
+
+
+def test_short_series_keeps_individual_results():
+    records = [_egfr(70, "2023-01-01"), _egfr(65, "2024-01-01")]
+
+    assert summarize_series(records, min_points=3) is None
+
+
+def test_series_summary_has_count_endpoints_range_and_trend():
+    records = [
+        _egfr(62, "2022-01-01T08:00:00-05:00"),
+        _egfr(75, "2021-01-01T08:00:00-05:00"),   # out of order on purpose
+        _egfr(49, "2023-01-01T08:00:00-05:00"),
+    ]
+
+    date, summary, _ = summarize_series(records, min_points=3)[0]
+
+    assert date == "2023-01-01T08:00:00-05:00"
+    assert summary.startswith("Lab series: eGFR (mL/min): 3 results;")
+    assert "first 75 (2021-01-01T08:00:00-05:00)" in summary
+    assert "latest 49 (2023-01-01T08:00:00-05:00)" in summary
+    assert "range 49-75" in summary
+    assert "trend -13.0" in summary
+
+
+def test_threshold_crossings_are_kept_as_dated_points():
+    records = [
+        _egfr(75, "2021-01-01"),
+        _egfr(62, "2022-01-01"),
+        _egfr(44, "2023-01-01"),   # crosses 60 and 45 at once
+        _egfr(52, "2024-01-01"),   # back above 45
+    ]
+
+    lines = [text for _, text, _ in summarize_series(records, min_points=3)[1:]]
+
+    assert lines == [
+        "Lab result: eGFR: 44 mL/min (recorded 2023-01-01), fell below 45.",
+        "Lab result: eGFR: 52 mL/min (recorded 2024-01-01), rose above 45.",
+    ]
+
+
+def test_undated_results_are_not_first_latest_or_crossings():
+    records = [_egfr(80, "2020-01-01"), _egfr(20, None), _egfr(50, "2021-01-01")]
+
+    lines = summarize_series(records, min_points=3)
+
+    date, summary, _ = lines[0]
+    assert date == "2021-01-01"
+    assert summary.startswith("Lab series: eGFR (mL/min): 3 results (1 undated);")
+    assert "first 80 (2020-01-01)" in summary
+    assert "latest 50 (2021-01-01)" in summary
+    assert "range 20-80" in summary
+    assert [text for _, text, _ in lines[1:]] == [
+        "Lab result: eGFR: 50 mL/min (recorded 2021-01-01), fell below 60.",
+    ]
+
+
+def test_non_numeric_series_is_left_alone():
+    records = [_egfr(70, "2021-01-01"), _egfr(65, "2022-01-01"), _egfr(None, "2023-01-01")]
+
+    assert summarize_series(records, min_points=3) is None
+
+
+def test_to_natural_language_replaces_series_in_place():
+    patient = FhirRecord.from_resource({"resourceType": "Patient", "name": [{"given": ["Ada"], "family": "Lovelace"}]})
+    condition = FhirRecord.from_resource({"resourceType": "Condition", "code": {"text": "CKD stage 3"}})
+    draws = [_egfr(50 - i, f"202{i}-01-01") for i in range(4)]
+
+    summary = to_natural_language([patient, draws[0], condition, *draws[1:]])
+    lines = [line.split("] ", 1)[1] for line in summary.splitlines()]    # drop line IDs
+
+    assert lines[0].startswith("Patient: Ada Lovelace")
+    assert lines[1].startswith("Lab series: eGFR (mL/min): 4 results;")
+    assert lines[2] == "Diagnosis: CKD stage 3, onset unknown date."
+    assert "Lab result: eGFR" not in summary
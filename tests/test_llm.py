@@ -0,0 +1,189 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+from google.genai import errors
+
+from app.llm import AIMDLimiter, LLMGateway, TokenBucket, _retry_after, background
+
+
+def _gateway(client, limit=8, maximum=32, requests_per_minute=10_000,
+             tokens_per_minute=10_000_000, **kw):
+    limiter = AIMDLimiter(initial=limit, minimum=1, maximum=maximum, target_latency=5.0)
+    return LLMGateway(client, requests_per_minute, tokens_per_minute, limiter,
+                      retry_base_seconds=0, **kw)
+
+
+def _client(*results):
+    client = MagicMock()
+    client.aio.models.generate_content = AsyncMock(side_effect=list(results))
+    return client
+
+
+def _throttled(retry_delay=None):
+    body = {"error": {"code": 429, "message": "Resource has been exhausted",
+                      "status": "RESOURCE_EXHAUSTED"}}
+    if retry_delay:
+        body["error"]["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo",
+                                     "retryDelay": retry_delay}]
+    return errors.ClientError(429, body)
+
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    bucket = TokenBucket(60, clock=lambda: now[0])   # one per second
+
+    assert bucket.delay(60) == 0
+    bucket.take(60)
+    assert bucket.delay(1) == pytest.approx(1.0)
+    now[0] = 10.0
+    assert bucket.delay(10) == 0
+    assert bucket.delay(15) == pytest.approx(5.0)
+
+
+def test_token_bucket_waits_at_most_for_a_full_bucket():
+    bucket = TokenBucket(60, clock=lambda: 0.0)
+    bucket.take(60)
+
+    # A single oversized call waits for a full minute's quota, not forever
+    assert bucket.delay(1000) == pytest.approx(60.0)
+
+
+def test_aimd_grows_slowly_and_backs_off_fast():
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=8, target_latency=5.0)
+
+    for _ in range(4):
+        limiter.on_success(latency=1.0)
+    assert 4.9 < limiter.limit < 5.0
+
+    limiter.on_throttle()
+    assert limiter.limit < 2.5
+
+    limiter.on_success(latency=10.0)   # slower than target also shrinks it
+    assert limiter.limit < 2.25
+
+    for _ in range(10):
+        limiter.on_throttle()
+    assert limiter.limit == 1
+
+
+def test_retry_after_from_header_or_retry_info():
+    assert _retry_after(_throttled("7s")) == 7.0
+    assert _retry_after(_throttled()) is None
+
+    error = _throttled()
+    error.response = SimpleNamespace(headers=httpx.Headers({"Retry-After": "3"}))
+    assert _retry_after(error) == 3.0
+
+
+async def test_retries_throttled_calls_and_backs_off():
+    ok = SimpleNamespace(text="{}")
+    client = _client(_throttled(), httpx.ConnectError("reset"), ok)
+    gateway = _gateway(client)
+
+    assert await gateway.generate("prompt", {}) is ok
+    assert client.aio.models.generate_content.call_count == 3
+    assert gateway.limiter.limit < 8
+    assert gateway.in_flight == 0
+
+
+async def test_waits_at_least_the_suggested_retry_delay(monkeypatch):
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr("app.llm.asyncio.sleep", sleep)
+    gateway = _gateway(_client(_throttled("2s"), SimpleNamespace(text="{}")))
+
+    await gateway.generate("prompt", {})
+
+    assert slept == [2.0]
+
+
+async def test_client_errors_are_not_retried():
+    bad_request = errors.ClientError(400, {"error": {"code": 400, "message": "Bad schema"}})
+    client = _client(bad_request)
+
+    with pytest.raises(errors.ClientError):
+        await _gateway(client).generate("prompt", {})
+    assert client.aio.models.generate_content.call_count == 1
+
+
+async def test_gives_up_after_max_retries():
+    client = _client(*[_throttled()] * 3)
+
+    with pytest.raises(errors.ClientError):
+        await _gateway(client, max_retries=2).generate("prompt", {})
+    assert client.aio.models.generate_content.call_count == 3
+
+
+async def test_charges_actual_token_usage():
+    usage = SimpleNamespace(total_token_count=5000)
+    gateway = _gateway(_client(SimpleNamespace(text="{}", usage_metadata=usage)),
+                       tokens_per_minute=60_000)
+
+    await gateway.generate("short prompt", {}, expected_output_tokens=10)
+
+    assert gateway.tokens.level == pytest.approx(55_000, abs=5)
+
+
+async def test_observe_gets_call_latency():
+    seen = []
+    gateway = _gateway(_client(SimpleNamespace(text="{}")))
+
+    await gateway.generate("prompt", {}, observe=seen.append)
+
+    assert len(seen) == 1 and seen[0] >= 0
+
+
+async def test_concurrency_is_capped_by_the_limit():
+    in_flight = peak = 0
+
+    async def generate_content(model, contents, config):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return SimpleNamespace(text="{}")
+
+    client = MagicMock()
+    client.aio.models.generate_content = generate_content
+    gateway = _gateway(client, limit=3, maximum=3)
+
+    await asyncio.gather(*(gateway.generate(f"prompt {i}", {}) for i in range(10)))
+
+    assert peak == 3
+
+
+async def test_interactive_calls_go_ahead_of_queued_background_work():
+    order = []
+    release = asyncio.Event()
+
+    async def generate_content(model, contents, config):
+        order.append(contents)
+        if contents == "first":
+            await release.wait()
+        return SimpleNamespace(text="{}")
+
+    client = MagicMock()
+    client.aio.models.generate_content = generate_content
+    gateway = _gateway(client, limit=1)
+
+    async def in_background(contents):
+        with background():
+            return await gateway.generate(contents, {})
+
+    first = asyncio.create_task(gateway.generate("first", {}))
+    await asyncio.sleep(0)
+    queued = [asyncio.create_task(in_background(f"bulk {i}")) for i in range(2)]
+    await asyncio.sleep(0)
+    urgent = asyncio.create_task(gateway.generate("urgent", {}))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(first, urgent, *queued)
+
+    assert order == ["first", "urgent", "bulk 0", "bulk 1"]
@@ -0,0 +1,104 @@
+import io
+import json
+import threading
+
+import pytest
+
+import app.subscribers
+from app import local_ehr
+from app.fhir import read_bundle_records
+from app.fhir_client import FETCH_TYPES, FhirClient
+from app.local_ehr import LocalEhr, PatientNotFound, _patients_from_bundles, build_ehr, index_path
+from tests.fake_fhir import DEFAULT_BUNDLES, EhrPatients, FakeFhirConfig, load_patients, serve
+
+PATIENT_ID = "a88dc42a-ddc2-1304-a912-17d05955f43d"   # data/sample_patient.json
+
+
+@pytest.fixture
+def ehr(tmp_path):
+    path = tmp_path / "patients.ndjson"
+    build_ehr(_patients_from_bundles(DEFAULT_BUNDLES), path)
+    store = LocalEhr(path)
+    yield store
+    store.close()
+
+
+def test_serves_each_patients_types_from_their_own_slice(ehr):
+    patients = load_patients()
+
+    assert ehr.patient_ids == list(patients)
+    for patient_id, by_type in patients.items():
+        assert ehr.counts(patient_id) == {t: len(rs) for t, rs in by_type.items()}
+        for rtype, resources in by_type.items():
+            assert ehr.resources(patient_id, rtype) == resources
+        assert ehr.resources(patient_id, "Specimen") == []
+
+
+def test_bundle_holds_only_fetched_types_patient_first(ehr):
+    buf = io.BytesIO()
+    written = ehr.write_bundle(PATIENT_ID, buf)
+
+    buf.seek(0)
+    bundle = json.load(buf)
+    types = [e["resource"]["resourceType"] for e in bundle["entry"]]
+    assert written == len(types)
+    assert types[0] == "Patient"
+    assert set(types) == set(FETCH_TYPES) & set(load_patients()[PATIENT_ID])
+    buf.seek(0)
+    stored = sorted(r.id for r in read_bundle_records(buf))
+    with open(DEFAULT_BUNDLES[0], "rb") as f:
+        assert stored == sorted(r.id for r in read_bundle_records(f))
+
+
+def test_unknown_patient_and_stale_index_are_errors(ehr, tmp_path):
+    with pytest.raises(PatientNotFound):
+        ehr.write_bundle("nobody", io.BytesIO())
+
+    with open(ehr.data_path, "ab") as f:
+        f.write(b'{"resourceType":"Patient","id":"late"}\n')
+    with pytest.raises(ValueError, match="stale"):
+        LocalEhr(ehr.data_path)
+    assert index_path(ehr.data_path).name == "patients.idx.json"
+
+
+async def test_fetcher_serves_cases_from_the_local_ehr(ehr, monkeypatch, temp_bundle_store):
+    monkeypatch.setattr(local_ehr, "_instance", ehr)
+
+    refs = [await app.subscribers.fetch_bundle_from_hospital(case_id) for case_id in range(4)]
+    named = await app.subscribers.fetch_bundle_from_hospital(99, PATIENT_ID)
+
+    patients = [app.subscribers.load_bundle_records(ref)[0].id for ref in refs]
+    assert patients == [ehr.patient_for_case(case_id) for case_id in range(4)]
+    assert len(set(patients)) == len(ehr) == 2
+    assert app.subscribers.load_bundle_records(named)[0].id == PATIENT_ID
+
+
+async def test_fetcher_stores_the_bundle_off_the_event_loop(ehr, monkeypatch, temp_bundle_store):
+    monkeypatch.setattr(local_ehr, "_instance", ehr)
+    threads = []
+    put_bundle = ehr.put_bundle
+
+    def recording_put(patient_id):
+        threads.append(threading.get_ident())
+        return put_bundle(patient_id)
+
+    monkeypatch.setattr(ehr, "put_bundle", recording_put)
+
+    ref = await app.subscribers.fetch_bundle_from_hospital(1, PATIENT_ID)
+
+    assert threads and threads[0] != threading.get_ident()
+    assert app.subscribers.load_bundle_records(ref)[0].id == PATIENT_ID
+
+
+async def test_fake_fhir_serves_a_local_ehr(ehr, temp_bundle_store):
+    with serve(FakeFhirConfig(), EhrPatients(ehr)) as (base_url, fake):
+        client = FhirClient(base_url, page_size=25, max_retries=0)
+        try:
+            stats = await client.fetch_patient(PATIENT_ID)
+        finally:
+            await client.aclose()
+
+    with temp_bundle_store.open(stats.bundle_ref) as f:
+        fetched = sorted(r.id for r in read_bundle_records(f))
+    with open(DEFAULT_BUNDLES[0], "rb") as f:
+        assert fetched == sorted(r.id for r in read_bundle_records(f))
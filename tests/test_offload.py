@@ -0,0 +1,55 @@
+import os
+import pickle
+
+import pytest
+
+from app import offload
+from app.fhir import read_bundle_records
+from app.subscribers import SAMPLE_BUNDLE_PATH, build_summary
+
+QUESTIONS = ["Is there an RA diagnosis?"]
+
+
+@pytest.fixture
+def offload_mode(monkeypatch):
+    def use(mode):
+        offload.shutdown()
+        monkeypatch.setattr(offload.settings, "cpu_offload", mode)
+    yield use
+    offload.shutdown()
+
+
+def _records():
+    with open(SAMPLE_BUNDLE_PATH, "rb") as f:
+        return read_bundle_records(f)
+
+
+def test_records_pickle_as_compact_tuples():
+    records = _records()
+
+    copies = pickle.loads(pickle.dumps(records))
+
+    assert [r.as_dict() for r in copies] == [r.as_dict() for r in records]
+    assert b"resource_type" not in pickle.dumps(records[1])
+
+
+@pytest.mark.parametrize("mode", ["off", "thread", "process"])
+async def test_summary_is_the_same_wherever_it_is_built(offload_mode, mode):
+    records = _records()
+    expected = build_summary(records, QUESTIONS)
+    offload_mode(mode)
+
+    assert await offload.run_cpu(build_summary, records, QUESTIONS) == expected
+
+
+async def test_process_mode_runs_steps_in_another_process(offload_mode):
+    offload_mode("process")
+
+    assert await offload.run_cpu(os.getpid) != os.getpid()
+
+
+async def test_off_mode_has_no_pool(offload_mode):
+    offload_mode("off")
+
+    assert offload.get_executor() is None
+    assert await offload.run_cpu(os.getpid) == os.getpid()
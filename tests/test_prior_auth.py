@@ -0,0 +1,102 @@
+from app.models_prior_auth import PriorAuthAnswer, PriorAuthRequest
+
+
+async def _prior_auth(client, db_session, auth_headers):
+    create = await client.post(
+        "/intakes",
+        json={"full_name": "Jeremy Beal", "narrative": "Humira denied for my AS."},
+        headers=auth_headers,
+    )
+    request = PriorAuthRequest(
+        case_id=create.json()["case_id"],
+        condition="Ankylosing spondylitis",
+        drug="Humira",
+        questions=["Has the patient tried NSAIDs?"],
+    )
+    db_session.add(request)
+    await db_session.commit()
+    return request.id
+
+
+class TestRelevanceCorrections:
+
+    async def test_happy_path(self, client, db_session, auth_headers):
+        """A nurse flips a verdict; the correction carries the request's condition and drug."""
+        request_id = await _prior_auth(client, db_session, auth_headers)
+
+        response = await client.post(
+            f"/prior-auth/{request_id}/corrections",
+            json={
+                "resource_type": "Observation",
+                "resource_id": "obs-1",
+                "description": "C reactive protein",
+                "relevant": True,
+                "predicted_relevant": False,
+                "author": "Jeremy",
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == 201
+        assert response.json()["relevant"] is True
+
+        listed = await client.get(f"/prior-auth/{request_id}/corrections", headers=auth_headers)
+        assert [c["description"] for c in listed.json()] == ["C reactive protein"]
+
+    async def test_request_not_found_returns_404(self, client, auth_headers):
+        response = await client.post(
+            "/prior-auth/99999/corrections",
+            json={"resource_type": "Condition", "description": "Gingivitis", "relevant": False},
+            headers=auth_headers,
+        )
+        assert response.status_code == 404
+
+    async def test_missing_label_returns_422(self, client, db_session, auth_headers):
+        request_id = await _prior_auth(client, db_session, auth_headers)
+
+        response = await client.post(
+            f"/prior-auth/{request_id}/corrections",
+            json={"resource_type": "Condition", "description": "Gingivitis"},
+            headers=auth_headers,
+        )
+        assert response.status_code == 422
+
+
+class TestAnswerCitations:
+
+    async def test_returns_the_cited_resources(self, client, db_session, auth_headers):
+        request_id = await _prior_auth(client, db_session, auth_headers)
+        answer = PriorAuthAnswer(
+            request_id=request_id,
+            question="Has the patient tried NSAIDs?",
+            answer="Yes, naproxen since 2020.",
+            supporting_record_ids=["3f2a9c1d"],
+            cited_resources=[{
+                "line_id": "3f2a9c1d", "resource_type": "MedicationRequest", "id": "med-1",
+                "resource": {"resourceType": "MedicationRequest", "id": "med-1", "status": "active"},
+            }],
+            confidence=0.9,
+        )
+        db_session.add(answer)
+        await db_session.commit()
+
+        response = await client.get(
+            f"/prior-auth/{request_id}/answers/{answer.id}/citations", headers=auth_headers,
+        )
+
+        assert response.status_code == 200
+        [cited] = response.json()
+        assert (cited["line_id"], cited["id"]) == ("3f2a9c1d", "med-1")
+        assert cited["resource"]["status"] == "active"
+
+    async def test_answer_from_another_request_returns_404(self, client, db_session, auth_headers):
+        request_id = await _prior_auth(client, db_session, auth_headers)
+        answer = PriorAuthAnswer(request_id=request_id, question="Q", answer="A",
+                                 supporting_record_ids=[])
+        db_session.add(answer)
+        await db_session.commit()
+
+        response = await client.get(
+            f"/prior-auth/{request_id + 1}/answers/{answer.id}/citations", headers=auth_headers,
+        )
+
+        assert response.status_code == 404
@@ -0,0 +1,119 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app import relevance_model
+from app.fhir import FhirRecord, classify_relevance
+from app.models_prior_auth import RelevanceCorrection
+from app.relevance_model import RelevanceModel, features, load_examples, train
+
+RA = ("Rheumatoid arthritis", "Humira")
+EXAMPLES = [
+    (*RA, "Condition", "Rheumatoid arthritis", 1.0, 1.0),
+    (*RA, "Observation", "C reactive protein [Mass/volume] in Serum or Plasma", 1.0, 1.0),
+    (*RA, "Observation", "Erythrocyte sedimentation rate", 1.0, 1.0),
+    (*RA, "MedicationRequest", "Methotrexate 2.5 MG Oral Tablet", 1.0, 1.0),
+    (*RA, "Condition", "Gingivitis", 0.0, 1.0),
+    (*RA, "Procedure", "Dental care", 0.0, 1.0),
+    (*RA, "Observation", "Tobacco smoking status", 0.0, 1.0),
+    (*RA, "Condition", "Seasonal allergic rhinitis", 0.0, 1.0),
+]
+
+
+def test_features_are_stable_and_in_range():
+    a = features(*RA, "Condition", "Rheumatoid arthritis", n_features=1024)
+    b = features(*RA, "Condition", "Rheumatoid arthritis", n_features=1024)
+    assert a == b
+    assert all(0 <= i < 1024 for i in a)
+
+
+def test_trained_model_separates_training_data():
+    model = train(EXAMPLES)
+
+    assert model.score(*RA, "Condition", "Rheumatoid arthritis") > 0.9
+    assert model.score(*RA, "Procedure", "Dental care") < 0.1
+
+
+def test_classify_leaves_uncertain_descriptions_out():
+    model = train(EXAMPLES)
+
+    verdicts = model.classify(*RA, "Condition", ["Rheumatoid arthritis", "Fracture of ankle"], 0.9)
+
+    assert verdicts["Rheumatoid arthritis"].relevant
+    assert "Fracture of ankle" not in verdicts
+
+
+def test_save_and_load_round_trip(tmp_path):
+    model = train(EXAMPLES, n_features=1024)
+    path = tmp_path / "model.npz"
+    model.save(path)
+
+    loaded = RelevanceModel.load(path)
+
+    assert loaded.trained_on == len(EXAMPLES)
+    assert loaded.score(*RA, "Condition", "Gingivitis") == pytest.approx(
+        model.score(*RA, "Condition", "Gingivitis")
+    )
+
+
+async def test_load_examples_lets_corrections_override_cached_verdicts(client, db_session, auth_headers):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from app.models_prior_auth import ClassificationCacheEntry, PriorAuthRequest
+    from app.models import utcnow
+
+    create = await client.post(
+        "/intakes",
+        json={"full_name": "Gerald Witherspoon III", "narrative": "Humira denied."},
+        headers=auth_headers,
+    )
+    request = PriorAuthRequest(
+        case_id=create.json()["case_id"], condition=RA[0], drug=RA[1], questions=["?"],
+    )
+    db_session.add(request)
+    await db_session.flush()
+    db_session.add_all([
+        ClassificationCacheEntry(
+            key="k1", condition=RA[0], drug=RA[1], resource_type="Condition",
+            description="Gingivitis", prompt_version="v1", relevant=True,
+            reasoning="", expires_at=utcnow(),
+        ),
+        RelevanceCorrection(
+            request_id=request.id, condition=RA[0], drug=RA[1],
+            resource_type="Condition", description="gingivitis", relevant=False,
+        ),
+    ])
+    await db_session.flush()
+
+    factory = async_sessionmaker(db_session.bind, expire_on_commit=False)
+    examples, corrections = await load_examples(factory, cache_weight=0.2)
+
+    assert corrections == 1
+    # Other tests share the in-memory database; only look at this request's pair
+    assert [e for e in examples if e[:2] == RA] == [(*RA, "Condition", "gingivitis", 0.0, 1.0)]
+
+
+@pytest.mark.asyncio
+async def test_classify_relevance_only_sends_low_confidence_items_to_gemini(monkeypatch):
+    import app.fhir
+
+    monkeypatch.setattr(relevance_model, "_instance", train(EXAMPLES))
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = AsyncMock(return_value=MagicMock(
+        text='{"classifications": [{"id": "0", "relevant": false, "reasoning": "Injury"}]}'
+    ))
+    monkeypatch.setattr(app.llm.get_gateway(), "client", fake_client)
+    monkeypatch.setattr(app.fhir.settings, "terminology_prefilter", False)
+    monkeypatch.setattr("app.terminology._instance", None)
+    monkeypatch.setattr("app.terminology._loaded", True)
+
+    records = [FhirRecord.from_resource(r) for r in [
+        {"resourceType": "Condition", "id": "c1", "code": {"text": "Rheumatoid arthritis"}},
+        {"resourceType": "Condition", "id": "c2", "code": {"text": "Gingivitis"}},
+        {"resourceType": "Condition", "id": "c3", "code": {"text": "Fracture of ankle"}},
+    ]]
+    result = await classify_relevance(records, *RA)
+
+    assert [r.id for r in result] == ["c1"]
+    prompt = fake_client.aio.models.generate_content.await_args.kwargs["contents"]
+    assert "Fracture of ankle" in prompt
+    assert "Gingivitis" not in prompt
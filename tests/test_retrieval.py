@@ -0,0 +1,57 @@
+from app.retrieval import LineIndex, tokenize
+
+LINES = [
+    "Patient: Jane Doe, born 1970-01-01, female.",
+    "Diagnosis: Rheumatoid arthritis, onset 2019-03-01.",
+    "Lab result: Hemoglobin A1c/Hemoglobin.total in Blood: 6.1 % (recorded 2024-01-10).",
+    "Lab result: Glucose [Mass/volume] in Blood: 98 mg/dL (recorded 2024-01-10).",
+    "Medication: Methotrexate 2.5 MG Oral Tablet, status: active (prescribed 2021-06-01).",
+    "Medication: Naproxen 500 MG Oral Tablet, status: stopped (prescribed 2020-02-01).",
+    "Procedure: Dental cleaning.",
+]
+
+
+def test_tokenize_drops_question_words_and_folds_plurals():
+    assert tokenize("Has the patient tried any medications?") == ["tried", "medication"]
+
+
+def test_top_ranks_the_matching_line_first():
+    index = LineIndex(LINES)
+
+    assert LINES[index.top("Is the patient on methotrexate?", 1)[0]] == LINES[4]
+
+
+def test_shorthand_in_questions_is_expanded():
+    index = LineIndex(LINES)
+
+    assert LINES[index.top("What is the most recent HbA1c?", 1)[0]] == LINES[2]
+    assert LINES[index.top("Has a conventional DMARD been tried?", 1)[0]] == LINES[4]
+
+
+def test_select_keeps_pinned_lines_in_summary_order():
+    index = LineIndex(LINES)
+
+    selected = index.select(["Has naproxen been tried?"], k=1)
+
+    assert selected == [LINES[0], LINES[1], LINES[5]]
+
+
+def test_select_unions_queries():
+    index = LineIndex(LINES)
+
+    selected = index.select(["Latest glucose?", "Any dental work?"], k=1)
+
+    assert selected == [LINES[0], LINES[1], LINES[3], LINES[6]]
+
+
+def test_select_without_any_match_returns_none():
+    assert LineIndex(LINES).select(["Zebra?"], k=5) is None
+
+
+def test_line_ids_are_ignored_for_matching_and_pinning():
+    lines = ["[0a1b2c3d] Patient: Jane Doe.", "[1a1b2c3d] Lab result: Glucose: 98 mg/dL.",
+             "[2a1b2c3d] Procedure: Dental cleaning."]
+    index = LineIndex(lines)
+
+    assert index.select(["Latest glucose?"], k=1) == lines[:2]
+    assert index.top("1a1b2c3d", 1) == []
@@ -0,0 +1,74 @@
+from app.classification_cache import Verdict
+from app.similarity import SimilarityIndex, tokenize
+
+SCOPE = ("rheumatoid arthritis", "humira", "Observation", "v1")
+
+
+def test_tokenize_drops_qualifiers_and_doses():
+    assert tokenize("Body mass index (BMI) [Ratio]") == ["body", "mass", "index"]
+    assert tokenize("Methotrexate 2.5 MG Oral Tablet") == ["methotrexate", "oral", "tablet"]
+
+
+def test_tokenize_keeps_type_and_stage_numbers():
+    assert tokenize("Diabetes mellitus type 1 (disorder)") == ["diabetes", "mellitus", "type", "1"]
+    assert tokenize("Chronic kidney disease (stage 4)")[-1] == "4"
+
+
+def test_type_1_and_type_2_diabetes_do_not_match():
+    index = SimilarityIndex()
+    index.add(SCOPE, {
+        "Diabetes mellitus type 2 (disorder)": Verdict(True, "diabetes"),
+        "Chronic kidney disease stage 1 (disorder)": Verdict(False, "mild"),
+    })
+
+    matches = index.match(SCOPE, [
+        "Diabetes mellitus type 1 (disorder)", "Chronic kidney disease stage 4 (disorder)",
+    ], threshold=0.9)
+
+    assert matches == {}
+
+
+def test_match_finds_reworded_description():
+    index = SimilarityIndex()
+    index.add(SCOPE, {
+        "Body mass index (BMI) [Ratio]": Verdict(False, "not relevant"),
+        "C reactive protein [Mass/volume] in Serum or Plasma": Verdict(True, "inflammation"),
+    })
+
+    matches = index.match(SCOPE, ["Body Mass Index", "Hemoglobin A1c"], threshold=0.9)
+
+    assert list(matches) == ["Body Mass Index"]
+    known, verdict, score = matches["Body Mass Index"]
+    assert known == "Body mass index (BMI) [Ratio]"
+    assert verdict == Verdict(False, "not relevant")
+    assert score > 0.99
+
+
+def test_match_is_scoped():
+    index = SimilarityIndex()
+    index.add(SCOPE, {"Body mass index (BMI) [Ratio]": Verdict(False, "")})
+
+    other = ("psoriasis", "humira", "Observation", "v1")
+    assert index.match(other, ["Body Mass Index"], threshold=0.5) == {}
+
+
+def test_oldest_entries_are_evicted():
+    index = SimilarityIndex(max_entries_per_scope=1)
+    index.add(SCOPE, {"Body mass index": Verdict(False, "")})
+    index.add(SCOPE, {"Hemoglobin A1c": Verdict(True, "")})
+
+    assert index.match(SCOPE, ["Body mass index"], threshold=0.5) == {}
+    assert "Hemoglobin A1c" in index.match(SCOPE, ["Hemoglobin A1c"], threshold=0.5)
+
+
+def test_least_recently_used_scope_is_dropped():
+    index = SimilarityIndex(max_scopes=2)
+    other = ("psoriasis", "humira", "Observation", "v1")
+    third = ("asthma", "dupixent", "Observation", "v1")
+    index.add(SCOPE, {"Body mass index": Verdict(False, "")})
+    index.add(other, {"Body mass index": Verdict(False, "")})
+    index.match(SCOPE, ["Body mass index"], threshold=0.5)
+    index.add(third, {"Body mass index": Verdict(False, "")})
+
+    assert index.match(other, ["Body mass index"], threshold=0.5) == {}
+    assert index.match(SCOPE, ["Body mass index"], threshold=0.5)
@@ -0,0 +1,244 @@
+import asyncio
+import io
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from google.genai import errors
+
+import app.llm
+import app.subscribers
+from app.pubsub import PubSubMessage
+from app.subscribers import (
+    UNANSWERED, answer_questions_with_llm, handle_prior_auth_requested, handle_records_classified,
+    load_bundle_records, summary_token_budget,
+)
+
+SUMMARY = "Patient: Jane Doe\nDiagnosis: Rheumatoid arthritis (since 2019)"
+QUESTIONS = ["Is there an RA diagnosis?", "Has methotrexate failed?", "Is CRP elevated?"]
+
+
+def _qa(answer, **extra):
+    return {"answer": answer, "supporting_record_ids": ["Diagnosis: Rheumatoid arthritis"],
+            "confidence": 0.9, **extra}
+
+
+def _fake_client(monkeypatch, *payloads):
+    """Responses in order; an exception in payloads is raised instead, a str sent as is."""
+    client = MagicMock()
+    client.aio.models.generate_content = AsyncMock(side_effect=[
+        p if isinstance(p, Exception) else MagicMock(text=p if isinstance(p, str) else json.dumps(p))
+        for p in payloads
+    ])
+    monkeypatch.setattr(app.llm.get_gateway(), "client", client)
+    return client.aio.models.generate_content
+
+
+@pytest.fixture(autouse=True)
+def no_retry_backoff(monkeypatch):
+    monkeypatch.setattr(app.subscribers.settings, "qa_retry_backoff_seconds", 0)
+
+
+@pytest.fixture
+def batch_mode(monkeypatch):
+    monkeypatch.setattr(app.subscribers.settings, "qa_batch_questions", True)
+
+
+async def test_one_call_per_question_by_default(monkeypatch):
+    generate = _fake_client(monkeypatch, *[_qa(f"Answer {i}") for i in range(3)])
+
+    answers = await answer_questions_with_llm(SUMMARY, QUESTIONS)
+
+    assert [a["answer"] for a in answers] == ["Answer 0", "Answer 1", "Answer 2"]
+    assert generate.call_count == 3
+
+
+async def test_questions_run_concurrently_up_to_the_limit(monkeypatch):
+    monkeypatch.setattr(app.subscribers.settings, "qa_max_concurrency", 2)
+    in_flight = peak = 0
+
+    async def generate_content(model, contents, config):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        # Later questions finish first; answers must still come back in order
+        return MagicMock(text=json.dumps(_qa(contents.rsplit("QUESTION: ", 1)[1])))
+
+    client = MagicMock()
+    client.aio.models.generate_content = generate_content
+    monkeypatch.setattr(app.llm.get_gateway(), "client", client)
+    questions = [f"Question {i}?" for i in range(6)]
+
+    answers = await answer_questions_with_llm(SUMMARY, questions)
+
+    assert [a["answer"] for a in answers] == questions
+    assert peak == 2
+
+
+async def test_invalid_answer_is_retried_on_its_own(monkeypatch):
+    generate = _fake_client(monkeypatch, _qa("Answer 0"), '{"answer": "Trunc', _qa("Answer 1"))
+
+    answers = await answer_questions_with_llm(SUMMARY, QUESTIONS[:2])
+
+    assert [a["answer"] for a in answers] == ["Answer 0", "Answer 1"]
+    assert generate.call_count == 3
+
+
+async def test_question_that_keeps_answering_invalid_json_is_left_for_review(monkeypatch):
+    monkeypatch.setattr(app.subscribers.settings, "qa_max_retries", 1)
+    _fake_client(monkeypatch, _qa("Answer 0"), '{"answer": ', '{"confidence": "high"}')
+
+    answers = await answer_questions_with_llm(SUMMARY, QUESTIONS[:2])
+
+    assert answers[0]["answer"] == "Answer 0"
+    assert answers[1] == {"question": QUESTIONS[1], "answer": UNANSWERED,
+                          "supporting_record_ids": [], "confidence": None}
+
+
+async def test_call_the_gateway_gave_up_on_is_not_retried_again(monkeypatch):
+    gateway = app.llm.get_gateway()
+    monkeypatch.setattr(gateway, "max_retries", 1)
+    monkeypatch.setattr(gateway, "retry_base_seconds", 0)
+    unavailable = errors.ServerError(503, {"error": {"code": 503, "message": "Unavailable"}})
+    generate = _fake_client(monkeypatch, unavailable, unavailable, _qa("never asked"))
+
+    answers = await answer_questions_with_llm(SUMMARY, QUESTIONS[:1])
+
+    assert answers[0]["answer"] == UNANSWERED
+    assert generate.call_count == 2         # the gateway's own attempts, not QA_MAX_RETRIES more
+
+
+async def test_each_prompt_carries_only_the_lines_its_question_needs(monkeypatch):
+    monkeypatch.setattr(app.subscribers.settings, "qa_retrieval_top_k", 2)
+    lines = SUMMARY.splitlines() + [f"Procedure: Routine visit {i}." for i in range(50)] + [
+        "Medication: Methotrexate 2.5 MG Oral Tablet, status: stopped (prescribed 2021-06-01).",
+        "Lab result: C reactive protein [Mass/volume] in Serum: 14 mg/L (recorded 2024-02-01).",
+    ]
+    generate = _fake_client(monkeypatch, _qa("Answer 0"), _qa("Answer 1"))
+
+    await answer_questions_with_llm("\n".join(lines), ["Has methotrexate failed?", "Is CRP elevated?"])
+
+    prompts = [call.kwargs["contents"] for call in generate.call_args_list]
+    assert all(SUMMARY in p and "Routine visit" not in p for p in prompts)
+    assert "Methotrexate" in prompts[0] and "C reactive protein" not in prompts[0]
+    assert "C reactive protein" in prompts[1] and "Methotrexate" not in prompts[1]
+
+
+async def test_batch_mode_answers_all_questions_in_one_call(monkeypatch, batch_mode):
+    # Answers come back out of order; they're matched up by id
+    generate = _fake_client(monkeypatch, {"answers": [
+        _qa("Answer 2", id="2"), _qa("Answer 0", id="0"), _qa("Answer 1", id="1"),
+    ]})
+
+    answers = await answer_questions_with_llm(SUMMARY, QUESTIONS)
+
+    assert [(a["question"], a["answer"]) for a in answers] == list(zip(
+        QUESTIONS, ["Answer 0", "Answer 1", "Answer 2"]
+    ))
+    assert generate.call_count == 1
+    prompt = generate.call_args.kwargs["contents"]
+    assert prompt.count(SUMMARY) == 1
+    assert all(q in prompt for q in QUESTIONS)
+
+
+async def test_batch_mode_splits_large_questionnaires(monkeypatch, batch_mode):
+    # Room for two answers per call: five questions become calls of 2, 2 and 1
+    monkeypatch.setattr(app.subscribers.settings, "qa_max_output_tokens",
+                        2 * app.subscribers.RESPONSE_TOKENS_PER_ANSWER)
+    questions = [f"Question {i}?" for i in range(5)]
+    generate = _fake_client(
+        monkeypatch,
+        {"answers": [_qa("a", id="0"), _qa("b", id="1")]},
+        {"answers": [_qa("c", id="0"), _qa("d", id="1")]},
+        {"answers": [_qa("e", id="0")]},
+    )
+
+    answers = await answer_questions_with_llm(SUMMARY, questions)
+
+    assert [a["answer"] for a in answers] == ["a", "b", "c", "d", "e"]
+    assert [a["question"] for a in answers] == questions
+    assert generate.call_count == 3
+
+
+async def test_batch_mode_asks_skipped_questions_individually(monkeypatch, batch_mode):
+    generate = _fake_client(
+        monkeypatch,
+        {"answers": [_qa("Answer 0", id="0"), _qa("Answer 2", id="2")]},
+        _qa("Answer 1"),
+    )
+
+    answers = await answer_questions_with_llm(SUMMARY, QUESTIONS)
+
+    assert [a["answer"] for a in answers] == ["Answer 0", "Answer 1", "Answer 2"]
+    assert "QUESTION: Has methotrexate failed?" in generate.call_args.kwargs["contents"]
+
+
+def test_batch_budget_reserves_room_for_every_question(monkeypatch, batch_mode):
+    assert summary_token_budget(QUESTIONS) < summary_token_budget(QUESTIONS[:1])
+
+
+async def test_answers_keep_only_valid_citations_and_resolve_them(monkeypatch, temp_bundle_store):
+    _fake_client(monkeypatch, _qa("Yes", supporting_record_ids=["[aaaa1111]", "made up"]))
+    pubsub = MagicMock(publish=AsyncMock())
+    monkeypatch.setattr(app.subscribers, "get_pubsub", lambda: pubsub)
+    resource = {"resourceType": "Condition", "id": "cond-1", "code": {"text": "Rheumatoid arthritis"}}
+    bundle = json.dumps({"resourceType": "Bundle", "entry": [{"resource": resource}]})
+    bundle_ref = temp_bundle_store.put(io.BytesIO(bundle.encode("utf-8")))
+
+    await handle_records_classified(PubSubMessage({
+        "request_id": 1, "case_id": 1, "questions": QUESTIONS[:1],
+        "patient_summary": "[aaaa1111] Diagnosis: Rheumatoid arthritis, onset 2019.",
+        "citations": {"aaaa1111": [["Condition", "cond-1"]]},
+        "bundle_ref": bundle_ref,
+        "summary_budget": {"tokens": 10, "lines_dropped": 0, "tokens_dropped": 0},
+    }))
+
+    [answer] = pubsub.publish.call_args.args[1]["answers"]
+    assert answer["supporting_record_ids"] == ["aaaa1111"]
+    assert answer["cited_resources"] == [{
+        "line_id": "aaaa1111", "resource_type": "Condition", "id": "cond-1", "resource": resource,
+    }]
+
+
+async def test_reauthorization_batch_answers_at_background_priority(monkeypatch):
+    priorities = []
+
+    async def generate(**kwargs):
+        priorities.append(app.llm._priority.get())
+        return MagicMock(text=json.dumps(_qa("Yes")))
+
+    client = MagicMock()
+    client.aio.models.generate_content = generate
+    monkeypatch.setattr(app.llm.get_gateway(), "client", client)
+    monkeypatch.setattr(app.subscribers, "get_pubsub", lambda: MagicMock(publish=AsyncMock()))
+    message = {
+        "request_id": 1, "case_id": 1, "questions": QUESTIONS[:1],
+        "patient_summary": "Diagnosis: Rheumatoid arthritis, onset 2019.", "citations": {},
+        "summary_budget": {"tokens": 10, "lines_dropped": 0, "tokens_dropped": 0},
+    }
+
+    await handle_records_classified(PubSubMessage(message))
+    await handle_records_classified(PubSubMessage({**message, "reauthorization": True}))
+
+    assert priorities == [app.llm.INTERACTIVE, app.llm.BACKGROUND]
+
+
+async def test_fetcher_publishes_a_bundle_reference_not_the_bundle(monkeypatch, temp_bundle_store):
+    pubsub = MagicMock(publish=AsyncMock())
+    monkeypatch.setattr(app.subscribers, "get_pubsub", lambda: pubsub)
+    request = {"request_id": 1, "case_id": 1, "condition": "RA", "drug": "Humira",
+               "questions": QUESTIONS}
+
+    await handle_prior_auth_requested(PubSubMessage(request))
+
+    topic, message = pubsub.publish.call_args.args
+    assert topic == "fhir-records-ready"
+    assert message == {**request, "bundle_ref": message["bundle_ref"]}
+    assert len(json.dumps(message)) < 1000
+
+    # The classifier, or a retry of it, reads the records back from the store
+    records = load_bundle_records(message["bundle_ref"])
+    assert records[0].resource_type == "Patient"
+    assert len(records) > 10
@@ -0,0 +1,90 @@
+import pytest
+
+from app.terminology import TerminologyIndex, build_index, code_key
+
+VALUE_SETS = {
+    "conditions": {
+        "rheumatoid arthritis": {
+            "aliases": ["rheumatoid arthritis", "ra"],
+            "codes": ["sct|69896004", "loinc|1988-5", "rxnorm|105585"],
+        },
+    },
+    "drugs": {
+        "adalimumab": {
+            "aliases": ["adalimumab", "humira"],
+            "codes": ["rxnorm|327361", "sct|28163009"],
+        },
+    },
+    "out_of_scope": {
+        "dental": ["sct|34043003"],
+        "social_history": ["obs-category|social-history", "sct|69896004"],
+    },
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = tmp_path / "value_sets.idx"
+    build_index(VALUE_SETS, path)
+    return TerminologyIndex(path)
+
+
+def test_code_key_uses_short_system_tags():
+    assert code_key("http://loinc.org", "4548-4") == "loinc|4548-4"
+    assert code_key("urn:example", "x") == "urn:example|x"
+
+
+def test_lookup_returns_every_containing_set(index):
+    names = {index.sets[i]["name"] for i in index.lookup("sct|69896004")}
+
+    assert names == {"condition:rheumatoid arthritis", "out_of_scope:social_history"}
+    assert index.lookup("sct|0000000") == set()
+
+
+def test_scope_matches_aliases_on_word_boundaries(index):
+    scope = index.scope("RA", "Humira (adalimumab)")
+    assert scope.names == ["condition:rheumatoid arthritis", "drug:adalimumab"]
+
+    # "ra" must not match inside another word
+    assert index.scope("Migraine", "Sumatriptan").names == []
+
+
+def test_triage_accepts_rejects_and_defers(index):
+    scope = index.scope("Rheumatoid arthritis", "Humira")
+
+    assert index.triage(["sct|28163009"], scope) is True           # TB screening for a biologic
+    assert index.triage(["sct|34043003"], scope) is False          # dental consultation
+    assert index.triage(["loinc|2339-0"], scope) is None           # glucose: let the LLM decide
+    # In-scope wins over out-of-scope when a code is in both
+    assert index.triage(["sct|69896004"], scope) is True
+
+
+def test_rejects_files_that_are_not_indexes(tmp_path):
+    path = tmp_path / "bogus.idx"
+    path.write_bytes(b"not an index at all")
+
+    with pytest.raises(ValueError):
+        TerminologyIndex(path)
+
+
+def test_bundled_index_is_built_from_bundled_value_sets():
+    import json
+    from app.terminology import DEFAULT_INDEX_PATH
+
+    with open(DEFAULT_INDEX_PATH.with_suffix(".json")) as f:
+        value_sets = json.load(f)
+    expected = sum(len(s["codes"]) for group in ("conditions", "drugs")
+                   for s in value_sets[group].values())
+    expected += sum(len(codes) for codes in value_sets["out_of_scope"].values())
+
+    assert len(TerminologyIndex(DEFAULT_INDEX_PATH)) == expected
+
+
+def test_bundled_type_2_diabetes_scope_needs_type_2_wording():
+    from app.terminology import DEFAULT_INDEX_PATH
+
+    index = TerminologyIndex(DEFAULT_INDEX_PATH)
+
+    assert index.scope("Type 2 diabetes mellitus", "Metformin").names == ["condition:type 2 diabetes"]
+    assert index.scope("Type 1 diabetes", "Insulin").names == []
+    assert index.scope("Diabetes", "Insulin").names == []
@@ -0,0 +1,64 @@
+from app.tokens import ChunkSizer, RESPONSE_TOKENS_PER_CLASSIFICATION, estimate_tokens
+
+
+def test_estimate_tokens_rounds_up():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+
+def test_split_keeps_small_batches_whole():
+    sizer = ChunkSizer(target_seconds=10, max_output_tokens=8192)
+
+    assert sizer.split(["a", "b", "c"]) == [["a", "b", "c"]]
+
+
+def test_split_respects_output_token_limit():
+    sizer = ChunkSizer(target_seconds=1000, max_output_tokens=10 * RESPONSE_TOKENS_PER_CLASSIFICATION)
+    descriptions = [f"lab {i}" for i in range(25)]
+
+    chunks = sizer.split(descriptions)
+
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    assert [d for c in chunks for d in c] == descriptions
+
+
+def test_slow_responses_shrink_chunks():
+    sizer = ChunkSizer(target_seconds=5, max_output_tokens=100_000, min_items=1)
+    descriptions = [f"Observation number {i}" for i in range(200)]
+    before = len(sizer.split(descriptions))
+
+    for _ in range(10):
+        sizer.observe(descriptions[:50], seconds=30.0)   # far slower than expected
+
+    assert len(sizer.split(descriptions)) > before
+
+
+def test_fast_responses_grow_chunks_but_never_below_minimum():
+    sizer = ChunkSizer(target_seconds=5, max_output_tokens=100_000, min_items=10)
+    descriptions = [f"Observation number {i}" for i in range(200)]
+
+    for _ in range(10):
+        sizer.observe(descriptions[:10], seconds=600.0)  # pathologically slow
+    assert min(len(c) for c in sizer.split(descriptions)[:-1]) >= 10
+
+    for _ in range(20):
+        sizer.observe(descriptions, seconds=0.5)
+    assert sizer.split(descriptions) == [descriptions]
+
+
+def test_fixed_overhead_does_not_shrink_chunks_towards_the_minimum():
+    sizer = ChunkSizer(target_seconds=8, max_output_tokens=100_000, min_items=1)
+    descriptions = [f"Observation number {i}" for i in range(400)]
+
+    def latency(chunk):     # 2s per call plus 400 cost units per second
+        return 2.0 + sum(sizer.item_cost(d) for d in chunk) / 400
+
+    for _ in range(10):
+        for chunk in sizer.split(descriptions):
+            sizer.observe(chunk, latency(chunk))
+
+    assert abs(sizer.overhead_seconds - 2.0) < 0.2
+    assert abs(sizer.tokens_per_second - 400) < 40
+    chunks = sizer.split(descriptions)
+    assert all(abs(latency(c) - 8) < 1 for c in chunks[:-1])